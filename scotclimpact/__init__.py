@@ -18,10 +18,22 @@ def create_app(test_config=None):
         from . import postgres
         from . import db
         from . import data
+        from . import variates
+        from . import tiling
+        from . import diagnostics
+        from . import artifacts
+        from . import model_store
+        from . import warmup
 
         flask_static_digest.init_app(app)
         data.init_data(app)
         postgres.pgdb.init_app(app)
         db.init_app(app)
+        variates.init_app(app)
+        tiling.init_app(app)
+        diagnostics.init_app(app)
+        artifacts.init_app(app)
+        model_store.init_app(app)
+        warmup.init_app(app)
 
         return app
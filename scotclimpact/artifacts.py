@@ -0,0 +1,85 @@
+'''
+Preprocessed serving artifacts of the fitted models.
+
+Building a Fitted_Obs_Sim from the input files opens three NetCDF files,
+selects and aligns them and merges the observation and simulation
+parameters. `flask build-artifacts` does this once per dataset and writes
+the merged parameters, covariance and grid mask to a single NetCDF file per
+dataset and data version, which init_composite_fit loads directly when it
+exists (see Fitted_Obs_Sim.from_artifact).
+'''
+import os
+
+import click
+from flask import current_app
+import xarray as xr
+
+from .data import DATA_REPO_VERSION, datasets
+
+
+def artifact_path(data_dir, dataset_name, simParams):
+    '''Location of the serving artifact of a dataset for the current data version.'''
+    filename = '%s_%s.nc' % (dataset_name, simParams.replace(',', '-'))
+    return os.path.join(data_dir, DATA_REPO_VERSION, 'artifacts', filename)
+
+
+def save_artifact(path, ds, grid, gridDims):
+    '''Write the merged parameters (root group) and the grid (group 'grid') of a fitted model.
+    The order of the grid dimensions, which determines the layout of the bootstrap variates, is kept.
+    The file is written under a temporary name first, so readers never open a partial file.'''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    ds = ds.assign_attrs(data_repo_version=DATA_REPO_VERSION)
+    grid = grid.assign_attrs(grid_dims=' '.join(gridDims))
+    ds.to_netcdf(tmp_path, mode='w', engine='netcdf4')
+    grid.to_netcdf(tmp_path, mode='a', group='grid', engine='netcdf4')
+    os.replace(tmp_path, path)
+
+
+def load_artifact(path):
+    '''Load the merged parameters, grid and grid dimensions of a serving artifact into memory.
+    Returns None if the file does not exist or was built for another data version or format.'''
+    if not os.path.exists(path):
+        return None
+    ds = xr.load_dataset(path, engine='netcdf4')
+    if ds.attrs.pop('data_repo_version', None) != DATA_REPO_VERSION:
+        return None
+    grid = xr.load_dataset(path, group='grid', engine='netcdf4')
+    if 'grid_dims' not in grid.attrs:
+        return None
+    return ds, grid, grid.attrs.pop('grid_dims').split()
+
+
+@click.command("build-artifacts", short_help="Build the serving artifact of each dataset")
+@click.option(
+    "--dataset",
+    "dataset_names",
+    multiple=True,
+    type=click.Choice(list(datasets)),
+    help="Dataset to build the artifact for (default: all datasets).",
+)
+@click.option("--sim-params", default='c,loc1,scale0,scale1', show_default=True)
+@click.option("--force", is_flag=True, help="Overwrite artifacts that already exist.")
+def build_artifacts(dataset_names, sim_params, force):
+    '''Align and merge the observation and simulation fits of each dataset once and store the result,
+    so that workers load one small file instead of preprocessing the input files on every start.'''
+    from .developing_process import Fitted_Obs_Sim, open_composite_inputs
+
+    for dataset_name in dataset_names or datasets:
+        path = artifact_path(current_app.config['DATA_DIR'], dataset_name, sim_params)
+        if os.path.exists(path) and not force:
+            click.echo(f"{dataset_name}: {path} exists")
+            continue
+        composite_fit = Fitted_Obs_Sim(
+            *open_composite_inputs(dataset_name),
+            simParams=sim_params.split(','),
+            preProcess=False,
+            slim=True,
+        )
+        save_artifact(path, composite_fit.ds, composite_fit.grid, composite_fit.gridDims)
+        click.echo(f"{dataset_name}: wrote {path}")
+
+
+def init_app(app):
+    '''Register the artifact command with the Flask application.'''
+    app.cli.add_command(build_artifacts)
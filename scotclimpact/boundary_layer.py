@@ -1,9 +1,21 @@
 from flask import current_app
+import numpy as np
 import shapely
 import functools
+import gzip
+import hashlib
 import json
+import os
 
-from .data import get_pooch, fetch_file
+from .data import DATA_REPO_VERSION, get_pooch, fetch_file, temporary_path
+
+# Simplification tolerances (in metres, EPSG:27700) of the levels of detail of the boundary layers
+BOUNDARY_DETAILS = dict(
+    full=None,
+    high=20.0,
+    medium=100.0,
+    low=500.0,
+)
 
 def is_valid_boundary_layer(layer_name):
     '''Returns True if layer_name is a valid boundary layer.'''
@@ -16,6 +28,52 @@ def get_boundary_layer(layer_name):
     with open(local_filename, 'r') as file:
         return file.read()
 
+class Compressed_Asset():
+    def __init__(self, content):
+        '''
+        A static JSON document as served (a boundary layer or the cells of a grid): its content uncompressed
+        and gzip compressed (the only content encoding served), with a strong ETag of the content.
+        '''
+        self.etag = hashlib.sha256(content).hexdigest()[:32]
+        self.encodings = dict(identity=content, gzip=gzip.compress(content, compresslevel=6, mtime=0))
+
+    def representation(self, accept_encodings):
+        '''The content encoding served to a client (gzip if it accepts it), its content and its ETag.'''
+        if accept_encodings['gzip'] > 0:
+            return 'gzip', self.encodings['gzip'], f'{self.etag}-gzip'
+        return 'identity', self.encodings['identity'], self.etag
+
+@functools.lru_cache(maxsize=None)
+def get_boundary_geometries(layer_name):
+    '''The GeoJSON content of a boundary layer, the shapes of its features and
+    whether they form a valid coverage (no gaps or overlaps between neighbouring features).'''
+    geojson = json.loads(get_boundary_layer(layer_name))
+    geometries = np.array([shapely.geometry.shape(feature['geometry']) for feature in geojson['features']])
+    return geojson, geometries, bool(shapely.coverage_is_valid(geometries))
+
+def simplify_layer(layer_name, tolerance):
+    '''Simplify the features of a boundary layer, keeping the boundaries shared between
+    neighbouring features together (if the features form a valid coverage) and rounding coordinates to 0.1m.'''
+    geojson, geometries, is_coverage = get_boundary_geometries(layer_name)
+    if is_coverage:
+        simplified = shapely.coverage_simplify(geometries, tolerance)
+    else:
+        simplified = shapely.simplify(geometries, tolerance, preserve_topology=True)
+    simplified = shapely.transform(simplified, lambda coords: np.round(coords, 1))
+    features = [
+        dict(feature, geometry=shapely.geometry.mapping(geometry))
+        for feature, geometry in zip(geojson['features'], simplified)
+    ]
+    return dict(geojson, features=features)
+
+@functools.lru_cache(maxsize=None)
+def get_boundary_asset(layer_name, detail='full'):
+    '''The boundary layer at a level of detail of BOUNDARY_DETAILS, built once per process.'''
+    if BOUNDARY_DETAILS[detail] is None:
+        return Compressed_Asset(get_boundary_layer(layer_name).encode('utf-8'))
+    geojson = simplify_layer(layer_name, BOUNDARY_DETAILS[detail])
+    return Compressed_Asset(json.dumps(geojson, separators=(',', ':')).encode('utf-8'))
+
 @functools.lru_cache(maxsize=1)
 def get_scotland_shape():
     '''Calculate a shape for Scotland by taking the union of health board shapes'''
@@ -25,11 +83,46 @@ def get_scotland_shape():
         shapely.geometry.shape(feature)
         for feature in health_boards_json['features']
     ]
-    return shapely.coverage_union_all(health_boards_shp)
-
-def in_scotland(bounds):
-    '''Predicate to determine if a rectangular region overlaps with Scotland'''
-    scotland = get_scotland_shape()
-    region = shapely.geometry.Polygon(list(bounds) + [bounds[0]])
-    return shapely.intersects(scotland, region)
-    
+    scotland = shapely.coverage_union_all(health_boards_shp)
+    shapely.prepare(scotland)
+    return scotland
+
+def cell_boxes(x_coords, y_coords):
+    '''The cells around a grid of points as an array of shapely boxes, indexed by (x, y).'''
+    dx = np.diff(x_coords).min()/2.0
+    dy = np.diff(y_coords).min()/2.0
+    x, y = np.meshgrid(x_coords, y_coords, indexing='ij')
+    return shapely.box(x - dx, y - dy, x + dx, y + dy)
+
+def grid_name(x_coords, y_coords):
+    '''A name for the files derived from a grid: its grid size and a hash of its coordinates.'''
+    grid_size = int(round(np.diff(x_coords).min()/1000.0))
+    digest = hashlib.sha1(np.ascontiguousarray(x_coords, dtype=np.float64).tobytes()
+                          + np.ascontiguousarray(y_coords, dtype=np.float64).tobytes()).hexdigest()[:12]
+    return f'{grid_size}km_{digest}'
+
+def scotland_mask_path(x_coords, y_coords):
+    '''Location of the mask of a grid for the current data version.'''
+    return os.path.join(current_app.config['DATA_DIR'], DATA_REPO_VERSION, 'masks',
+                        f'scotland_{grid_name(x_coords, y_coords)}.npy')
+
+def scotland_mask(x_coords, y_coords):
+    '''Boolean mask, indexed by (x, y), of the cells of a grid that overlap with Scotland.'''
+    return _scotland_mask(tuple(map(float, x_coords)), tuple(map(float, y_coords)))
+
+@functools.lru_cache(maxsize=16)
+def _scotland_mask(x_coords, y_coords):
+    '''The mask of a grid, loaded from the data directory or calculated with a single
+    vectorised intersection of all the cells with the prepared shape of Scotland and saved.'''
+    path = scotland_mask_path(x_coords, y_coords)
+    if os.path.exists(path):
+        mask = np.load(path)
+    else:
+        mask = shapely.intersects(get_scotland_shape(), cell_boxes(x_coords, y_coords))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = temporary_path(path)
+        with open(tmp_path, 'wb') as file:
+            np.save(file, mask)
+        os.replace(tmp_path, path)
+    mask.flags.writeable = False
+    return mask
@@ -1,7 +1,11 @@
+import hashlib
 import os
+import tempfile
 
 import pooch
 
+from .data import DATA_REPO_VERSION
+
 class Config:
     '''Set Flask configuration variables'''
 
@@ -10,6 +14,11 @@ class Config:
     PROFILE = os.environ.get('PROFILE', False)
     CACHE_TYPE = os.environ.get('CACHE_TYPE', 'SimpleCache')
     CACHE_DEFAULT_TIMEOUT = os.environ.get('CACHE_DEFAULT_TIMEOUT', 300)
+    # Boundary layers and grid cells are served gzip compressed (the only content encoding served) and
+    # browsers keep boundary layers this many seconds before revalidating them with their ETag
+    BOUNDARY_CACHE_MAX_AGE = int(os.environ.get('BOUNDARY_CACHE_MAX_AGE', 7 * 24 * 3600))
+    # ... and the cells of the grids of the hazards, which only change with the data
+    GRID_CACHE_MAX_AGE = int(os.environ.get('GRID_CACHE_MAX_AGE', 7 * 24 * 3600))
 
 
     ## External services
@@ -31,6 +40,65 @@ class Config:
         'DATA_DIR',
         pooch.os_cache('scotclimpact'),
     )
+    # 'eager' fetches (and verifies) all data files when the app starts, 'lazy' on first use.
+    # Verified files are recorded in a manifest in DATA_DIR and are not hashed again while unchanged.
+    DATA_FETCH_MODE = os.environ.get('DATA_FETCH_MODE', 'eager')
+    DATA_FETCH_WORKERS = int(os.environ.get('DATA_FETCH_WORKERS', 8))
+
+    ## Bootstrap variates
+    # Seed used to generate (and find stored) bootstrap variates, see variates.py
+    BOOTSTRAP_SEED = int(os.environ.get('BOOTSTRAP_SEED', 20250101))
+    # Precision of the bootstrap variates and the quantities calculated from them,
+    # float32 halves their memory (compare with `flask variates-validate-precision`)
+    BOOTSTRAP_DTYPE = os.environ.get('BOOTSTRAP_DTYPE', 'float64')
+    # Sampler of the bootstrap variates, 'random' or 'sobol' (scrambled Sobol points, which give the same
+    # CI precision with fewer variates; compare with `flask variates-benchmark-sampler`)
+    BOOTSTRAP_SAMPLER = os.environ.get('BOOTSTRAP_SAMPLER', 'random')
+    # Number of bootstrap variates of the served models, rounded up to a power of two for Sobol variates
+    BOOTSTRAP_VARIATES = int(os.environ.get('BOOTSTRAP_VARIATES', 1000))
+    # Add variates to each cell in growing batches (100, 200, 400, ...) until its quantiles change by less than
+    # ADAPTIVE_VARIATES_TOLERANCE times their spread, see Fitted_Obs_Sim.adaptive_quantiles
+    ADAPTIVE_VARIATES = os.environ.get('ADAPTIVE_VARIATES', 'false').lower() in ('1', 'true')
+    ADAPTIVE_VARIATES_TOLERANCE = float(os.environ.get('ADAPTIVE_VARIATES_TOLERANCE', 0.01))
+
+    ## Covariate lattice
+    # Precompute the GEV parameters at the covariates used by the hazards (see Fitted_Obs_Sim.build_lattice),
+    # keeping bootstrap parameters for up to COVARIATE_LATTICE_MAX_BYTES per dataset. With 1000 float64 variates
+    # an entry takes about 85MB on the 12km grids and 490MB on the 5km grids, two per covariate; a warning is
+    # logged when entries do not fit and their bootstrap parameters are calculated per request
+    COVARIATE_LATTICE = os.environ.get('COVARIATE_LATTICE', 'false').lower() in ('1', 'true')
+    COVARIATE_LATTICE_MAX_BYTES = int(os.environ.get('COVARIATE_LATTICE_MAX_BYTES', 2 * 1024**3))
+
+    ## Hazard cache
+    # Hazard results are deterministic for a data version and the bootstrap, adaptive variates and lattice
+    # settings above, so they are cached under a prefix with a hash of all of them, without expiry by default
+    # (0 never expires)
+    HAZARD_CACHE_TIMEOUT = int(os.environ.get('HAZARD_CACHE_TIMEOUT', 0))
+    CACHE_KEY_PREFIX = 'scotclimpact_%s_%s_' % (DATA_REPO_VERSION, hashlib.sha1(repr((
+        BOOTSTRAP_SEED, BOOTSTRAP_DTYPE, BOOTSTRAP_SAMPLER, BOOTSTRAP_VARIATES,
+        ADAPTIVE_VARIATES, ADAPTIVE_VARIATES_TOLERANCE,
+        COVARIATE_LATTICE, COVARIATE_LATTICE_MAX_BYTES,
+    )).encode('utf-8')).hexdigest()[:12])
+
+    ## Model registry
+    # Fitted models are kept per worker until they use more than this many bytes, see registry.py
+    MODEL_REGISTRY_MAX_BYTES = int(os.environ.get('MODEL_REGISTRY_MAX_BYTES', 4 * 1024**3))
+    # Only keep the fitted parameters of models in memory; diagnostic inputs are loaded on demand
+    SLIM_MODELS = os.environ.get('SLIM_MODELS', 'true').lower() in ('1', 'true')
+    # Build the serving models in create_app, before gunicorn --preload forks the workers, see warmup.py
+    MODEL_WARMUP = os.environ.get('MODEL_WARMUP', 'false').lower() in ('1', 'true')
+    # Share the arrays of the fitted models between worker processes through shared memory, see model_store.py
+    # (the segments live in /dev/shm, which containers limit to 64MB unless started with a larger --shm-size)
+    SHARED_MODEL_STORE = os.environ.get('SHARED_MODEL_STORE', 'false').lower() in ('1', 'true')
+    # The catalog of the store, per user as it must be owned by the user of the workers (see check_catalog_dir)
+    MODEL_STORE_DIR = os.environ.get(
+        'MODEL_STORE_DIR',
+        os.path.join(tempfile.gettempdir(), 'scotclimpact-models-%i' % os.getuid()),
+    )
+
+    ## Tiled calculations
+    # Memory budget of each tile of `flask hazard-compute-tiled`, see tiling.py
+    TILE_MAX_BYTES = int(os.environ.get('TILE_MAX_BYTES', 512 * 1024**2))
 
     GTAG_ID = os.environ.get(
         'GTAG_ID',
@@ -1,9 +1,17 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import threading
+
 from flask import g, current_app
 import pooch
 import requests
 
 DATA_REPO_VERSION = "v0.1.0"
 GITHUB_API_URL = "https://media.githubusercontent.com/media/SCSDMWT/climate_scenario_web_tool_data/{version}"
+MANIFEST_NAME = '.verified.json'
+
+manifest_lock = threading.Lock()
 
 '''
 Meta-data that describes which hazards use which datafiles etc.
@@ -11,6 +19,7 @@ Meta-data that describes which hazards use which datafiles etc.
 datasets = dict(
     extreme_temp=dict(
         model_file='GEV_covaraite_fit_%s_tasmax_linear_loc_log_scale_nFits_1000_parametric_False.nc',
+        intensity_units=u"\u00b0C",
         grid_size=12,
         grid_selection=dict(
             projection_x_coordinate = slice(0,0.5e6),
@@ -19,6 +28,7 @@ datasets = dict(
     ),
     sustained_3day_Tmin_intensity=dict(
         model_file='exclude_GEV_covaraite_fit_%s_max_3day_tasmin_linear_loc_log_scale_nFits_1000_parametric_False.nc',
+        intensity_units=u"\u00b0C",
         grid_size=12,
         grid_selection=dict(
             projection_x_coordinate = slice(0,0.5e6),
@@ -27,6 +37,7 @@ datasets = dict(
     ),
     extreme_1day_precip=dict(
         model_file='smoothed_GEV_covaraite_fit_%s_1day_precip_max_log_loc_scale_nFits_1000_parametric_False.nc',
+        intensity_units="mm",
         grid_size=5,
         grid_selection=dict(
             projection_x_coordinate=slice(0,0.5e6),
@@ -35,6 +46,7 @@ datasets = dict(
     ),
     extreme_3day_precip=dict(
         model_file='smoothed_GEV_covaraite_fit_%s_3day_precip_max_log_loc_scale_nFits_1000_parametric_False.nc',
+        intensity_units="mm",
         grid_size=5,
         grid_selection=dict(
             projection_x_coordinate=slice(0,0.5e6),
@@ -76,15 +88,80 @@ def get_pooch(app):
     return g.pooch
 
 
+def manifest_path(pooch_):
+    return os.path.join(str(pooch_.abspath), MANIFEST_NAME)
+
+
+def read_manifest(pooch_):
+    '''The files of the data directory whose hashes have been verified, as
+    {filename: [known hash, size, modification time in ns]}. Empty if there is no readable manifest.'''
+    try:
+        with open(manifest_path(pooch_)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def file_signature(pooch_, filename):
+    '''The registry hash, size and modification time of a downloaded file.'''
+    stat = os.stat(os.path.join(str(pooch_.abspath), filename))
+    return [pooch_.registry[filename], stat.st_size, stat.st_mtime_ns]
+
+
+def is_verified(pooch_, filename, manifest):
+    '''Whether a file is in the manifest and has not changed (or been replaced) since it was verified.'''
+    try:
+        return manifest.get(filename) == file_signature(pooch_, filename)
+    except FileNotFoundError:
+        return False
+
+
+def temporary_path(path):
+    '''A name to write a file under before moving it to path with os.replace, unique to the process and thread,
+    so concurrent writers of the same file never write into each other's temporary file (the last one wins).'''
+    return '%s.%i.%i.tmp' % (path, os.getpid(), threading.get_ident())
+
+
+def record_verified(pooch_, filenames):
+    '''Add files to the manifest, keeping entries written by other processes.
+    The manifest is replaced atomically, so readers never see a partial file.'''
+    with manifest_lock:
+        manifest = read_manifest(pooch_)
+        manifest.update({filename: file_signature(pooch_, filename) for filename in filenames})
+        path = manifest_path(pooch_)
+        tmp_path = temporary_path(path)
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+
+def fetch_verified(pooch_, filename, manifest=None):
+    '''The local filename of a file in the registry. Files in the manifest are used without
+    hashing them again; others are downloaded and/or verified by pooch and added to the manifest.'''
+    if is_verified(pooch_, filename, read_manifest(pooch_) if manifest is None else manifest):
+        return os.path.join(str(pooch_.abspath), filename)
+    local_filename = pooch_.fetch(filename)
+    record_verified(pooch_, [filename])
+    return local_filename
+
+
 def fetch_file(filename):
     '''Downloads a file in the registry and returns it's local filename.'''
     pooch_ = get_pooch(current_app)
-    return pooch_.fetch(
-        filename, 
-    )
+    return fetch_verified(pooch_, filename)
 
 
 def init_data(app):
-    '''Ensure each data file is downloaded'''
-    for file in get_pooch(app).registry:
-        fetch_file(file)
+    '''Ensure each data file is downloaded and verified. Files in the manifest of verified files
+    are only checked by size and modification time; the others are fetched in parallel.
+    With DATA_FETCH_MODE=lazy nothing is fetched here and files are fetched on first use.'''
+    if app.config['DATA_FETCH_MODE'] == 'lazy':
+        return
+    pooch_ = get_pooch(app)
+    manifest = read_manifest(pooch_)
+    pending = [file for file in pooch_.registry if not is_verified(pooch_, file, manifest)]
+    if not pending:
+        return
+    with ThreadPoolExecutor(max_workers=app.config['DATA_FETCH_WORKERS']) as pool:
+        list(pool.map(pooch_.fetch, pending))
+    record_verified(pooch_, pending)
@@ -1,10 +1,11 @@
+import functools
 from functools import wraps
 import json
 import numpy as np
 import re
 import xarray as xr
 
-from .boundary_layer import in_scotland
+from .boundary_layer import scotland_mask
 
 def is_number(s):
     '''Returns true if s is a string representing an actual number (excluding NaN or Inf)'''
@@ -48,20 +49,59 @@ def validate_args(*types):
 def str_lower(s):
     return s.lower()
 
-def _make_bounds(dataset, idx, x_key, y_key):
-    '''Calculate the 4 corners for cells from the grid of points.'''
-    x_dim = dataset[x_key].to_numpy()
-    y_dim = dataset[y_key].to_numpy()
-
-    dx = np.diff(x_dim).min()/2.0
-    dy = np.diff(y_dim).min()/2.0
-
-    top_right =    [ [float(x_dim[i]+dx), float(y_dim[j]+dy)] for i, j in zip(*idx) ]
-    top_left  =    [ [float(x_dim[i]+dx), float(y_dim[j]-dy)] for i, j in zip(*idx) ]
-    bottom_right = [ [float(x_dim[i]-dx), float(y_dim[j]+dy)] for i, j in zip(*idx) ]
-    bottom_left  = [ [float(x_dim[i]-dx), float(y_dim[j]-dy)] for i, j in zip(*idx) ]
-
-    return top_right, top_left, bottom_right, bottom_left
+class Grid_Geometries():
+    def __init__(self, grid_size, x_coords, y_coords):
+        '''
+        The cell polygons of a grid of points, built once per grid: an (N, 5, 2) array of the closed rings
+        (top right, top left, bottom left, bottom right, top right) of the cells in (x, y) order,
+        and the geometry id of each cell (see make_geometry_id).
+        '''
+        x_coords = np.asarray(x_coords, dtype=np.float64)
+        y_coords = np.asarray(y_coords, dtype=np.float64)
+        dx = np.diff(x_coords).min()/2.0
+        dy = np.diff(y_coords).min()/2.0
+
+        self.shape = (len(x_coords), len(y_coords))
+        x_idx, y_idx = (i.ravel() for i in np.meshgrid(np.arange(self.shape[0]), np.arange(self.shape[1]), indexing='ij'))
+        self.ids = make_geometry_id(grid_size, x_idx, y_idx)
+
+        x, y = x_coords[x_idx, np.newaxis], y_coords[y_idx, np.newaxis]
+        self.rings = np.stack([
+            np.hstack([x + dx, x + dx, x - dx, x - dx, x + dx]),
+            np.hstack([y + dy, y - dy, y - dy, y + dy, y + dy]),
+        ], axis=-1)
+        self.rings.flags.writeable = False
+        self.ring_lists = self.rings.tolist()
+
+    def rows(self, idx):
+        '''The rows of the cells idx, a tuple of (x, y) index arrays, in the geometry arrays.'''
+        return np.ravel_multi_index(idx, self.shape)
+
+    def row_of_id(self, geometry_id):
+        '''The row of the cell with a geometry id.'''
+        return self.rows(((geometry_id // 1000) % 1000, geometry_id % 1000))
+
+    def corners(self, rows):
+        '''The corners (top right, top left, bottom right, bottom left) of cells, as lists.'''
+        return self.rings[rows][:, [0, 1, 3, 2]].tolist()
+
+@functools.lru_cache(maxsize=16)
+def _grid_geometries(grid_size, x_coords, y_coords):
+    return Grid_Geometries(grid_size, x_coords, y_coords)
+
+def grid_geometries(dataset, x_key, y_key, grid_size=None):
+    '''The cached Grid_Geometries of the grid of a dataset. The grid size (in km) defaults to the spacing of the grid.'''
+    x_coords = tuple(map(float, dataset[x_key].to_numpy()))
+    y_coords = tuple(map(float, dataset[y_key].to_numpy()))
+    if grid_size is None:
+        grid_size = int(round(np.diff(x_coords).min()/1000.0))
+    return _grid_geometries(grid_size, x_coords, y_coords)
+
+def _in_scotland(dataset, idx, x_key, y_key):
+    '''Select the cells idx of a grid that overlap with Scotland.'''
+    mask = scotland_mask(dataset[x_key].to_numpy(), dataset[y_key].to_numpy())
+    keep = mask[idx]
+    return tuple(i[keep] for i in idx)
 
 def _fix_infs(np_array, multiplier=1000):
     '''Update all 'inf' values of an np array to be multiplier * max(np_array)'''
@@ -78,20 +118,10 @@ def unwrap_grid(grid, x_key='projection_x_coordinate', y_key='projection_y_coord
         np.arange(grid.sizes[y_key]),
         #indexing='ij',
     )
-    idx = (idx[0].flatten(), idx[1].flatten())
+    idx = _in_scotland(grid, (idx[0].flatten(), idx[1].flatten()), x_key, y_key)
 
-    top_right, top_left, bottom_right, bottom_left = _make_bounds(grid, idx, x_key, y_key)
-    geometries = [
-        (tr, tl, br, bl)
-        for tr, tl, br, bl
-        in zip(top_right, top_left, bottom_right, bottom_left)
-    ]
-    return [
-        (coord_idx, geometry)
-        for coord_idx, geometry
-        in zip(zip(*idx), geometries)
-        if in_scotland(geometry)
-    ]
+    geometries = grid_geometries(grid, x_key, y_key)
+    return list(zip(zip(*idx), geometries.corners(geometries.rows(idx))))
 
 
 def unwrap_xarray(xr_dataset, grid_size, x_key='projection_x_coordinate', y_key='projection_y_coordinate'):
@@ -99,24 +129,19 @@ def unwrap_xarray(xr_dataset, grid_size, x_key='projection_x_coordinate', y_key=
 
     np_dataset = xr_dataset.to_numpy()
     _fix_infs(np_dataset)
-    idx = np.where(np_dataset == np_dataset)
+    idx = _in_scotland(xr_dataset, np.where(np_dataset == np_dataset), x_key, y_key)
 
-    top_right, top_left, bottom_right, bottom_left = _make_bounds(xr_dataset, idx, x_key, y_key)
-    geometries = [
-        (tr, tl, br, bl)
-        for tr, tl, br, bl
-        in zip(top_right, top_left, bottom_right, bottom_left)
-    ]
+    geometries = grid_geometries(xr_dataset, x_key, y_key, grid_size)
+    rows = geometries.rows(idx)
     return [
         dict(
             central_estimate=central_estimate,
             coord_idx=coord_idx,
             geometry_coords=geometry,
-            geometry_id=make_geometry_id(grid_size, *coord_idx),
+            geometry_id=geometry_id,
         )
-        for central_estimate, coord_idx, geometry 
-        in zip(np_dataset[idx], zip(*idx), geometries)
-        if in_scotland(geometry)
+        for central_estimate, coord_idx, geometry, geometry_id
+        in zip(np_dataset[idx], zip(*idx), geometries.corners(rows), geometries.ids[rows])
     ]
 
 def make_geometry_id(grid_size, x_idx, y_idx):
@@ -177,9 +202,8 @@ def xarray_to_geojson(dataset_name, xr_dataset, x_key='projection_x_coordinate',
     '''Convert an xarray.DataArray object to GeoJSON compatible object.'''
     # Load the data
     np_dataset = xr_dataset.to_numpy()
-    idx = np.where(np_dataset == np_dataset)
-
-    top_right, top_left, bottom_right, bottom_left = _make_bounds(xr_dataset, idx, x_key, y_key)
+    idx = _in_scotland(xr_dataset, np.where(np_dataset == np_dataset), x_key, y_key)
+    geometries = grid_geometries(xr_dataset, x_key, y_key)
 
     # Create the geometry features
     features = [
@@ -191,12 +215,11 @@ def xarray_to_geojson(dataset_name, xr_dataset, x_key='projection_x_coordinate',
             ),
             geometry=dict(
                 type='Polygon',
-                coordinates=[[tr, tl, bl, br, tr]],
+                coordinates=[geometries.ring_lists[row]],
             ),
         )
-        for tr, tl, br, bl, value, coord_idx 
-        in zip(top_right, top_left, bottom_right, bottom_left, np_dataset[idx], zip(*idx))
-        if in_scotland([tr, tl, br, bl])
+        for row, value, coord_idx
+        in zip(geometries.rows(idx), np_dataset[idx], zip(*idx))
     ]
 
     crs = dict(
@@ -213,3 +236,53 @@ def xarray_to_geojson(dataset_name, xr_dataset, x_key='projection_x_coordinate',
         features=features,
         crs=crs,
     )
+
+
+def grid_to_geojson(grid_size, grid, x_key='projection_x_coordinate', y_key='projection_y_coordinate'):
+    '''
+    The cells of a grid that overlap with Scotland as GeoJSON features without values, identified by their
+    geometry id (see make_geometry_id) with their (x, y) indices. The features are in the order of the values
+    of xarray_to_values on the same grid.
+    '''
+    geometries = grid_geometries(grid, x_key, y_key, grid_size)
+    mask = scotland_mask(grid[x_key].to_numpy(), grid[y_key].to_numpy())
+    rows = np.flatnonzero(mask)
+    features = [
+        dict(
+            type='Feature',
+            id=int(geometries.ids[row]),
+            properties=dict(x=int(x_idx), y=int(y_idx)),
+            geometry=dict(
+                type='Polygon',
+                coordinates=[geometries.ring_lists[row]],
+            ),
+        )
+        for row, x_idx, y_idx
+        in zip(rows, *np.unravel_index(rows, geometries.shape))
+    ]
+
+    crs = dict(
+        type='name',
+        properties=dict(
+            name="urn:ogc:def:crs:EPSG::27700"
+        )
+    )
+
+    return dict(
+        type='FeatureCollection',
+        numberMatched=len(features),
+        name=f'grid_{grid_size}km',
+        features=features,
+        crs=crs,
+    )
+
+
+def xarray_to_values(xr_dataset, x_key='projection_x_coordinate', y_key='projection_y_coordinate'):
+    '''
+    The values of a 2D xarray.DataArray on the cells of grid_to_geojson, in the same order, as a float32 array.
+    Cells without a value are NaN and, like xarray_to_geojson, infinite values are 10000.
+    '''
+    mask = scotland_mask(xr_dataset[x_key].to_numpy(), xr_dataset[y_key].to_numpy())
+    values = xr_dataset.transpose(x_key, y_key).to_numpy()[mask].astype(np.float32)
+    values[values == np.inf] = 10000
+    return values
@@ -5,6 +5,7 @@ import numpy as np
 import xarray as xr
 
 from .developing_process import init_composite_fit
+from .warmup import serving_fit
 from .postgres import pgdb
 from .data_helpers import (sql_to_geojson, unwrapped_xarray_to_sql, unwrap_xarray, unwrap_grid, make_geometry_id)
 from .data import datasets
@@ -57,6 +58,27 @@ def get_json_hazard_data(**kwargs):
         cursor.execute(f"SELECT hd.central_estimate, ST_AsGeoJSON(g.geom), hd.ci_report FROM hazard_data as hd, geometries as g WHERE g.id = hd.geometry_id and {where_clause};")
         results = cursor.fetchall()
     return sql_to_geojson(kwargs['function'], results)
+
+
+def get_hazard_values(geometry_ids, **kwargs):
+    '''The central estimates of a hazard at the cells of geometry_ids, in their order, as a float32 array
+    (NaN for cells without a result), as the values of xarray_to_values for the geometry ids of grid_to_geojson.'''
+    where_clause = _make_where_clause(kwargs)
+    with pgdb.get_cursor() as cursor:
+        cursor.execute(f"SELECT geometry_id, central_estimate FROM hazard_data WHERE {where_clause};")
+        results = cursor.fetchall()
+    return values_by_geometry(geometry_ids, results)
+
+
+def values_by_geometry(geometry_ids, rows):
+    '''The values of (geometry id, value) rows in the order of geometry_ids (sorted, as by grid_to_geojson).'''
+    values = np.full(len(geometry_ids), np.nan, dtype=np.float32)
+    if rows:
+        ids, central_estimates = map(np.asarray, zip(*rows))
+        positions = np.searchsorted(geometry_ids, ids).clip(max=len(geometry_ids) - 1)
+        on_grid = geometry_ids[positions] == ids
+        values[positions[on_grid]] = central_estimates[on_grid]
+    return values
     
 
 def has_dataset_geometries(grid_size):
@@ -107,6 +129,23 @@ def db_insert(query):
         cursor.execute(query)
 
 
+def hazard_results(hazard, composite_fit):
+    '''Yields the input parameters and central estimate for all combinations of a hazard's parameters.
+    Hazards with a sweep_function are evaluated for all values of their last parameter at once.'''
+    if 'sweep_function' in hazard:
+        *leading_args, sweep_args = hazard['args']
+        for leading_arg in itertools.product(*leading_args):
+            results = hazard['sweep_function'](composite_fit, *leading_arg, sweep_args)
+            for i, sweep_arg in enumerate(sweep_args):
+                yield leading_arg + (sweep_arg,), results.isel({results.dims[0]: i})
+        return
+
+    for arg in itertools.product(*hazard['args']):
+        if 'covariate_comp' in hazard['arg_names'] and arg[1] >= arg[2]:
+            continue
+        yield arg, hazard['function'](composite_fit, *arg)
+
+
 @click.command("db-pre-compute")
 @click.option(
     "--commit", 
@@ -145,34 +184,25 @@ def pre_compute(commit=False, no_header=False):
         grid_sizes.add(dataset['grid_size'])
         composite_fit = init_composite_fit(
             dataset_name,
-            simParams='c,loc1,scale0,scale1',
-            nVariates=1000,
-            preProcess=True,
+            **serving_fit(),
         )
         insert_dataset_geometries(composite_fit, dataset['grid_size'], commit=commit)
 
     for func_name, hazard in hazards.items():
-        func = hazard['function']
         #func_name = hazard['function_name']
         arg_names = hazard['arg_names']
         ci_report_url = hazard['ci_report_url']
 
-        # Call each function with all combinations of input parameters.
-        for arg in itertools.product(*hazard['args']):
-
-            if 'covariate_comp' in arg_names and arg[1] >= arg[2]:
-                continue
+        composite_fit = init_composite_fit(
+            hazard['dataset'],
+            **serving_fit(),
+        )
 
-            composite_fit = init_composite_fit(
-                hazard['dataset'],
-                simParams='c,loc1,scale0,scale1',
-                nVariates=1000,
-                preProcess=True,
-            )
+        # Call each function with all combinations of input parameters.
+        for arg, central_estimate in hazard_results(hazard, composite_fit):
 
             # Unwrapping is needed to turn the 2D grid into a list of entries to be added to the database.
             # This is also a convinient place to add the CI report url for each cell.
-            central_estimate = func(composite_fit, *arg)
             params = dict(zip(arg_names, arg))
             unwrapped_central_estimate = [
                 {**ce, 'ci_report_url': ci_report_url.format(x=ce['coord_idx'][0], y=ce['coord_idx'][1], **params)}
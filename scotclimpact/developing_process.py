@@ -1,16 +1,48 @@
+import copy
 import functools
 
 import numpy  as np
 import xarray as xr
 import pandas as pd
-from scipy.stats     import genextreme as genex
-from scipy.stats     import multivariate_normal
-from scipy.stats     import kstest
-from scipy.stats     import norm
 from scipy.stats     import lognorm
 from datetime        import datetime
 
+from flask import current_app
+
+from . import gev
+from .artifacts import artifact_path, load_artifact
 from .data import fetch_file, datasets
+from .diagnostics import ks_2samp, ks_1samp_less, normal_overlap
+from .model_store import shared_model, store_settings
+from .quantiles import quantile, xarray_quantile
+from .registry import registry
+from .variates import variates_path, load_variates, sample_multivariate_normal, standard_normal_variates
+
+# GEV parameters (c, loc, scale) as a function of the covariate x and the fitted parameters p,
+# by the covariateFunction of a dataset; a logarithmic scale function can be added here
+covariate_functions = dict(
+    stationary          = lambda x,p: np.array([p[0], 
+                                                p[1], 
+                                                p[2]]),
+    linear_loc          = lambda x,p: np.array([p[0], 
+                                                p[1] + p[2]*x, 
+                                                p[3]]),
+    linear_loc_scale    = lambda x,p: np.array([p[0], 
+                                                p[1] + p[2]*x, 
+                                                p[3] + p[4]*x]),
+    linear_loc_log_scale= lambda x,p: np.array([p[0], 
+                                                p[1] + p[2]*x, 
+                                                np.exp(p[3] + p[4]*x)]),
+    log_loc_scale       = lambda x,p: np.array([p[0], 
+                                                np.exp(p[1] + p[2]*x), 
+                                                np.exp(p[3] + p[4]*x)]),
+    quadratic_loc       = lambda x,p: np.array([p[0], 
+                                                p[1] + p[2]*x + p[3]*x*x, 
+                                                p[4]]),
+    quadratic_loc_scale = lambda x,p: np.array([p[0], 
+                                                p[1] + p[2]*x + p[3]*x*x, 
+                                                p[4] + p[5]*x + p[6]*x*x]))
+
 
 class Fitted_Obs_Sim():
     def __init__(self,
@@ -22,11 +54,19 @@ class Fitted_Obs_Sim():
                  nVariates      = 1000,
                  storeInput     = False,
                  intensityUnits = u"\u00b0C",#'degrees_Celsius',
-                 TScotVariates  = True):
+                 TScotVariates  = True,
+                 seed           = None,
+                 bsDtype        = 'float64',
+                 slim           = False,
+                 sampler        = 'random'):
         '''
         initialise with fitted parameter files from simulations and observations.
         When we have confirmed exactly how we want to do the de-biasing of simulations,
         these steps can be skipped by only providing the fully processed composite file.
+        Bootstrap quantities are stored and calculated with bsDtype, e.g. float32 to halve their memory.
+        The sampler of the bootstrap and temperature anomaly variates is 'random' or 'sobol' (see variates.py).
+        A slim model (for serving) only keeps the fitted parameters; the input data used by the
+        diagnostics is loaded when they are first called (see load_inputs).
         '''
         # align and transpose coordinates
         sameTranspose = lambda x: x.transpose('projection_x_coordinate','projection_y_coordinate',...)
@@ -35,24 +75,31 @@ class Fitted_Obs_Sim():
                                       sameTranspose(grid), 
                                       join = 'inner', exclude = ['year', 'ensemble_member'])
 
-        self.dsObs = dsObs.load(); self.dsSim = dsSim.load()
+        self.inputs = None
+        if slim:
+            self.inputs = (dsObs, dsSim)
+            dsObs = dsObs[['fit', 'bootstrap_mean', 'bootstrap_covariance']].compute()
+            dsSim = dsSim[['fit', 'bootstrap_mean', 'bootstrap_covariance']].compute()
+        else:
+            dsObs = dsObs.load(); dsSim = dsSim.load()
         
         self.TScotVariates  = TScotVariates
+        self.seed           = seed
         self.intensityUnits = intensityUnits
+        self.bsDtype        = np.dtype(bsDtype)
+        self.sampler        = sampler
         if storeInput: # if there is a need to keep full input files
-            self.dsObsInput = self.dsObs.copy(deep = True)
-            self.dsSimInput = self.dsSim.copy(deep = True)
+            self.dsObsInput = dsObs.copy(deep = True)
+            self.dsSimInput = dsSim.copy(deep = True)
         
         self.gridDims = list(grid.dims)
-        self.ds     = self.dsObs.copy(deep = True).load()
+        self.ds     = dsObs.copy(deep = not slim)
         self.grid   = grid.load()
-        self.bsGrid = grid.copy(deep = True)
-        self.bsGrid = self.bsGrid.expand_dims(variate = range(nVariates), axis = -1)
 
         for v in ['fit','bootstrap_mean']:
             da = self.ds[v]
             da = da.where(~np.isin(da.params, simParams),
-                            self.dsSim[v])
+                            dsSim[v])
             self.ds[v] = da.compute()
 
         # block zero cross-covariance
@@ -62,72 +109,137 @@ class Fitted_Obs_Sim():
                                 np.matmul(np.array([indexObsP]).T, [indexObsP]))
         self.ds['iCovSimP']  = (['params_i','params_j'],
                                 np.matmul(np.array([indexSimP]).T, [indexSimP]))
-        da = self.dsObs.bootstrap_covariance * self.ds.iCovObsP\
-           + self.dsSim.bootstrap_covariance * self.ds.iCovSimP
+        da = dsObs.bootstrap_covariance * self.ds.iCovObsP\
+           + dsSim.bootstrap_covariance * self.ds.iCovSimP
 
         self.ds['bootstrap_covariance'] = da.compute()
 
         self.ds.coords['paramsGEV'] = ['c','loc','scale']
         
+        self.dsObs = None; self.dsSim = None
+        if not slim:
+            self.load_inputs(dsObs, dsSim)
+        self.init_fitted(nVariates, preProcess)
+
+    @classmethod
+    def from_artifact(cls, ds, grid, gridDims,
+                      preProcess     = True,
+                      nVariates      = 1000,
+                      intensityUnits = u"\u00b0C",
+                      TScotVariates  = True,
+                      seed           = None,
+                      bsDtype        = 'float64',
+                      slim           = True,
+                      sampler        = 'random'):
+        '''
+        a slim fitted object from the merged parameters and grid of a serving artifact (see artifacts.py),
+        skipping the alignment and merging of the input files. The diagnostics, which need the input data, are not available.
+        '''
+        model = cls.__new__(cls)
+        model.inputs = None
+        model.dsObs  = None; model.dsSim = None
+        model.TScotVariates  = TScotVariates
+        model.seed           = seed
+        model.intensityUnits = intensityUnits
+        model.bsDtype        = np.dtype(bsDtype)
+        model.sampler        = sampler
+        model.grid     = grid.transpose('projection_x_coordinate','projection_y_coordinate',...)
+        model.gridDims = list(gridDims)
+        model.ds       = ds.transpose('projection_x_coordinate','projection_y_coordinate',...)
+        model.init_fitted(nVariates, preProcess)
+        return model
+
+    def init_fitted(self, nVariates, preProcess):
+        '''
+        set up the covariate function and (if preProcess) the bootstrap variates from the merged parameters in self.ds
+        '''
         self.fit            = self.ds.fit
         self.bootstrapMean  = self.ds.bootstrap_mean
         self.bootstrapCov   = self.ds.bootstrap_covariance
         self.fCovariateType = self.ds.covariateFunction
-        
-        self.dsObs = self.dsObs.stack(variate = ['year'])
-        self.dsSim = self.dsSim.stack(variate = ['year','ensemble_member'])
-
-        # a logarithmic scale function can be added here
-        displays = dict(
-                    stationary          = lambda x,p: np.array([p[0], 
-                                                                p[1], 
-                                                                p[2]]),
-                    linear_loc          = lambda x,p: np.array([p[0], 
-                                                                p[1] + p[2]*x, 
-                                                                p[3]]),
-                    linear_loc_scale    = lambda x,p: np.array([p[0], 
-                                                                p[1] + p[2]*x, 
-                                                                p[3] + p[4]*x]),
-                    linear_loc_log_scale= lambda x,p: np.array([p[0], 
-                                                                p[1] + p[2]*x, 
-                                                                np.exp(p[3] + p[4]*x)]),
-                    log_loc_scale       = lambda x,p: np.array([p[0], 
-                                                                np.exp(p[1] + p[2]*x), 
-                                                                np.exp(p[3] + p[4]*x)]),
-                    quadratic_loc       = lambda x,p: np.array([p[0], 
-                                                                p[1] + p[2]*x + p[3]*x*x, 
-                                                                p[4]]),
-                    quadratic_loc_scale = lambda x,p: np.array([p[0], 
-                                                                p[1] + p[2]*x + p[3]*x*x, 
-                                                                p[4] + p[5]*x + p[6]*x*x]))
-        self.fCovariate = displays[self.fCovariateType]
+        self.fCovariate     = covariate_functions[self.fCovariateType]
 
         ### pre-process bootstrap variates used to calculate confidence intervals
         self.nVariates  = nVariates
+        self.firstVariate = 0 # the offset of the variates of copies made by select_variates
         self.bsVariates = None
-        if preProcess: self.variate_bootstrap_dist(nVariates)
+        self.covariateFit = None
+        self.lattice      = None
+        if preProcess: self.variate_bootstrap_dist(nVariates, seed = self.seed)
+
+    def __getstate__(self):
+        '''
+        the attributes of the fitted object for pickling (as by the shared model store, see model_store.py),
+        without the covariate function, which is restored from its type, and without the lazily opened inputs
+        of a slim model, whose file handles belong to this process
+        '''
+        state = dict(vars(self))
+        del state['fCovariate']
+        state['inputs'] = None
+        return state
+
+    def __setstate__(self, state):
+        vars(self).update(state)
+        self.fCovariate = covariate_functions[self.fCovariateType]
+
+    def load_inputs(self, dsObs = None, dsSim = None):
+        '''
+        the observations and simulations stacked over their variates, as used by the diagnostics
+        (renormalise, ks_compare and calculate_overlap). Slim models load them on first use.
+        '''
+        if type(self.dsObs) == type(None):
+            if type(dsObs) == type(None):
+                if type(self.inputs) == type(None):
+                    raise ValueError('the input data is not available for a fitted object loaded from an artifact '
+                                     'or the shared model store')
+                dsObs, dsSim = self.inputs
+            self.dsObs = dsObs.load().stack(variate = ['year'])
+            self.dsSim = dsSim.load().stack(variate = ['year','ensemble_member'])
+        return self.dsObs, self.dsSim
+
+    @property
+    def bsGrid(self):
+        '''
+        the 2-D grid mask broadcast over the bootstrap variates, a view without copying the mask
+        '''
+        return self.grid.astype(self.bsDtype).expand_dims(variate = range(self.nVariates), axis = -1)
 
     def get_xy_indices(self, x, y):
         return np.argmin(np.abs(self.grid.projection_x_coordinate.values - x)),\
                np.argmin(np.abs(self.grid.projection_y_coordinate.values - y))
 
-    def variate_bootstrap_dist(self, nVariates = 1000):
+    def variate_bootstrap_dist(self, nVariates = 1000, seed = None):
         '''
-        produce random variates of the bootstrap parameters
+        produce random variates of the bootstrap parameters for all cells at once, reproducible if a seed is given
         '''
-        def f(mean, cov, nVariates): 
-            if (not np.isfinite(mean).all()) or (not np.isfinite(cov).all()):
-                return np.array([[np.nan]*mean.size]*nVariates)
-            else:
-                return multivariate_normal(mean, cov).rvs(nVariates)
-        self.bsVariates = xr.apply_ufunc(
-                        f,
-                        self.bootstrapMean,
-                        self.bootstrapCov,
+        self.set_bootstrap_variates(sample_multivariate_normal(
+                        self.bootstrapMean.transpose(*self.gridDims, 'params').values,
+                        self.bootstrapCov.transpose(*self.gridDims, 'params_i', 'params_j').values,
                         nVariates,
-                        input_core_dims = [['params'],['params_i','params_j'],[]],
-                        output_core_dims = [['variate','params']],
-                        vectorize = True).compute()
+                        seed    = seed,
+                        dtype   = self.bsDtype,
+                        sampler = self.sampler))
+
+    def set_bootstrap_variates(self, variates):
+        '''
+        use precomputed bootstrap variates (e.g. a memory mapped array from the variates store)
+        with dimensions (projection_x_coordinate, projection_y_coordinate, variate, params)
+        '''
+        mean  = self.bootstrapMean.transpose(*self.gridDims, 'params')
+        shape = mean.shape[:-1] + (self.nVariates,) + mean.shape[-1:]
+        if variates.shape != shape:
+            raise ValueError('bootstrap variates have shape %s, expected %s'%(variates.shape, shape))
+        self.bsVariates = xr.DataArray(variates.astype(self.bsDtype, copy = False), 
+                                       dims = self.gridDims + ['variate', 'params'], 
+                                       coords = mean.coords)
+        self.lattice    = None # built from the previous variates
+
+    def temperature_anomaly_covariate(self, Tanomaly):
+        '''
+        the covariate of the central fit at a global temperature anomaly, see get_temperature_anomaly_params
+        '''
+        m = [-0.264, 0.825, 0.998]#mu from normal fits
+        return m[0] + m[1] * (Tanomaly - m[2])
 
     def get_temperature_anomaly_params(self, Tanomaly):
         '''
@@ -136,41 +248,117 @@ class Fitted_Obs_Sim():
         Scotland average temperature using HadUK-Grid,
         Scotland sensitivity using UKCP18 60km GCM and 12km RCP,
         global temperature anomaly using HadCRUT5 ensemble,
+        Variates are deterministic for a given seed and data version.
         '''
         m = [-0.264, 0.825, 0.998]#mu from normal fits
         s = [ 0.090, 0.094, 0.040]#sigma from normal fits
-        mean = m[0] + m[1] * (Tanomaly - m[2])
+        mean = self.temperature_anomaly_covariate(Tanomaly)
         if type(self.bsVariates) == type(None):
             return mean
         elif self.TScotVariates == False:#if we don't want to unclude uncertainty in TScot
             return mean, np.array([mean]*self.nVariates)            
         else:
             std  = np.sqrt(s[0]**2 + (s[1]*(Tanomaly - m[2]))**2 + (m[1]*s[2])**2)
-            return mean, norm.rvs(mean, std, self.nVariates)
+            variates = standard_normal_variates(self.firstVariate + self.nVariates, self.seed, 
+                                                sampler = self.sampler, column = self.ds.params.size)
+            return mean, mean + std * variates[self.firstVariate:]
     
     def set_temperature_anomaly(self, Tanomaly):
-        m,v = self.get_temperature_anomaly_params(Tanomaly)
-        self.set_covariate(m, bsCovariates = v)
+        self.covariateFit = self.evaluate_temperature_anomaly(Tanomaly)
+        self.fitGEV, self.bsfitGEV = self.covariateFit.fitGEV, self.covariateFit.bsfitGEV
        
     def set_covariate(self, covariate, bsCovariates = None):
         '''
-        set the covariate, can accept an array of bootstrap covariates (same length as number of bootstrap variates)
+        set the covariate, can accept an array of bootstrap covariates (same length as number of bootstrap variates).
+        This modifies the fitted object; use evaluate() when the object is shared between requests or threads.
+        '''
+        self.covariateFit = self.evaluate(covariate, bsCovariates)
+        self.fitGEV, self.bsfitGEV = self.covariateFit.fitGEV, self.covariateFit.bsfitGEV
+
+    def evaluate(self, covariate, bsCovariates = None):
+        '''
+        evaluate the GEV parameters at a covariate without modifying the fitted object.
+        Returns a Covariate_Fit, which can accept an array of bootstrap covariates 
+        (same length as number of bootstrap variates)
         '''
-        self.ds['fitGEV'] = (['paramsGEV']+self.gridDims, 
-                     self.fCovariate(covariate, [self.fit.sel(params = p) for p in self.ds.params]))
-        self.fitGEV = genex(c     = self.ds.fitGEV.sel(paramsGEV='c'),
-                            loc   = self.ds.fitGEV.sel(paramsGEV='loc'),
-                            scale = self.ds.fitGEV.sel(paramsGEV='scale'))
+        if type(bsCovariates) == type(None) and self.in_lattice(('covariate', covariate)):
+            return self.from_lattice(('covariate', covariate))
+        fitGEV = self.gev_params(
+                    self.fCovariate(covariate, [self.fit.sel(params = p) for p in self.ds.params]))
+        bsfitGEV = None
         if type(self.bsVariates) != type(None):
             if type(bsCovariates) == type(None):
                 bsCovariates = covariate
-            self.ds['bsfitGEV'] = (['paramsGEV']+self.gridDims+['variate'], 
-                     self.fCovariate(bsCovariates, [self.bsVariates.sel(params = p) for p in self.ds.params]))
-            self.bsfitGEV = genex(c     = self.ds.bsfitGEV.sel(paramsGEV='c'),
-                                  loc   = self.ds.bsfitGEV.sel(paramsGEV='loc'),
-                                  scale = self.ds.bsfitGEV.sel(paramsGEV='scale'))
+            bsCovariates = np.asarray(bsCovariates, dtype = self.bsDtype)
+            bsfitGEV = self.gev_params(
+                    self.fCovariate(bsCovariates, [self.bsVariates.sel(params = p) for p in self.ds.params]))
+        return Covariate_Fit(self, fitGEV, bsfitGEV)
+
+    def evaluate_temperature_anomaly(self, Tanomaly):
+        '''
+        evaluate the GEV parameters at a global temperature anomaly without modifying the fitted object.
+        '''
+        if self.in_lattice(('temperature', Tanomaly)):
+            return self.from_lattice(('temperature', Tanomaly))
+        if type(self.bsVariates) == type(None):
+            return self.evaluate(self.get_temperature_anomaly_params(Tanomaly))
+        m,v = self.get_temperature_anomaly_params(Tanomaly)
+        return self.evaluate(m, bsCovariates = v)
+
+    def build_lattice(self, covariates, maxBytes = None):
+        '''
+        precompute the GEV parameters at a fixed set of covariates, both used directly (as by change_in_intensity
+        and times_more_likely) and as global temperature anomalies, so evaluate and set_covariate become lookups.
+        The central fit is always stored; the bootstrap parameters are stored while the lattice
+        stays within maxBytes and are otherwise calculated when needed.
+        Returns the number of entries stored without their bootstrap parameters.
+        '''
+        self.lattice      = dict()
+        self.latticeBytes = 0
+        bsBytes = 0
+        if type(self.bsVariates) != type(None):
+            bsBytes = 3 * self.bsVariates.isel(params = 0).size * self.bsVariates.dtype.itemsize
+        for key in [(kind, value) for value in covariates for kind in ['temperature', 'covariate']]:
+            bootstrap = type(maxBytes) == type(None) or self.latticeBytes + bsBytes <= maxBytes
+            covariateFit = self.lattice_params(key, bootstrap = bootstrap)
+            self.lattice[key]  = covariateFit
+            self.latticeBytes += sum(p.nbytes for p in covariateFit.fitGEV + (covariateFit.bsfitGEV or ()))
+        return sum(type(covariateFit.bsfitGEV) == type(None) for covariateFit in self.lattice.values()) if bsBytes else 0
+
+    def lattice_params(self, key, bootstrap = True):
+        '''
+        evaluate the GEV parameters for a lattice key, ('temperature', Tanomaly) or ('covariate', covariate),
+        without using the lattice
+        '''
+        model = copy.copy(self)
+        model.lattice = None
+        if not bootstrap:
+            model.bsVariates = None
+        kind, value = key
+        if kind == 'temperature':
+            covariateFit = model.evaluate_temperature_anomaly(value)
         else:
-            self.bsGEV = None
+            covariateFit = model.evaluate(value)
+        covariateFit.model = self
+        return covariateFit
+
+    def in_lattice(self, key):
+        return type(self.lattice) != type(None) and key in self.lattice
+
+    def from_lattice(self, key):
+        '''
+        the lattice entry for key, with bootstrap parameters calculated if they did not fit in the lattice
+        '''
+        covariateFit = self.lattice[key]
+        if type(covariateFit.bsfitGEV) == type(None) and type(self.bsVariates) != type(None):
+            return Covariate_Fit(self, covariateFit.fitGEV, self.lattice_params(key).bsfitGEV)
+        return covariateFit
+
+    def gev_params(self, paramsGEV):
+        '''
+        split an array of (c, loc, scale) parameters along the first axis into contiguous arrays for the gev kernels
+        '''
+        return tuple(np.ascontiguousarray(p) for p in paramsGEV)
             
     def apply_units(self, da, 
                     units = '',
@@ -187,69 +375,65 @@ class Fitted_Obs_Sim():
             return self.apply_units(x*grid, units, attrs)
 
     def intensity_from_return_time(self, tauReturn, mode = 'fit', output = 'dataarray', quantiles = [0.025,0.975]):
-        if (mode == 'variates') or (mode == 'quantiles'):
-            fit = self.intensity_from_return_time(tauReturn, mode = 'fit')
-            bss = self.intensity_from_return_time(tauReturn, mode = 'bs')
-            if mode == 'quantiles':
-                ds = xr.merge([fit, bss.quantile(quantiles, dim = 'variate')\
-                         .rename(intensity = 'intensity_quantiles')])
-            else:
-                ds = xr.merge([fit, bss.rename(intensity = 'intensity_variates')])
-            return self.apply_units(ds, units = self.intensityUnits)
-        elif mode == 'fit':
-                x    = self.fitGEV.ppf(1-1/tauReturn)
-                grid = self.grid.mask.rename('intensity')
-        elif mode == 'bs':
-                x    = self.bsfitGEV.ppf(1-1/tauReturn)
-                grid = self.bsGrid.mask.rename('intensity')
-        return self.output_modes(x, grid, output, 
-            units = self.intensityUnits,
-            attrs = dict(
-                description = 'intensity at %d year return time'%tauReturn),
-                    ).to_dataset()
+        '''
+        intensity at the covariate set with set_covariate or set_temperature_anomaly
+        '''
+        return self.covariateFit.intensity_from_return_time(tauReturn, mode, output, quantiles)
 
     def return_time_from_intensity(self, intensity, mode = 'fit', output = 'dataarray', quantiles = [0.025,0.975]):
-        if (mode == 'variates') or (mode == 'quantiles'):
-            fit = self.return_time_from_intensity(intensity, mode = 'fit')
-            bss = self.return_time_from_intensity(intensity, mode = 'bs')
-            if mode == 'quantiles':
-                ds = xr.merge([fit, bss.quantile(quantiles, dim = 'variate')\
-                         .rename(return_time = 'return_time_quantiles')])
-            else:
-                ds = xr.merge([fit, bss.rename(return_time = 'return_time_variates')])
-            return self.apply_units(ds, units = 'years')
-        elif mode == 'fit':
-                x    = 1/self.fitGEV.sf(intensity)
-                grid = self.grid.mask.rename('return_time')
-        elif mode == 'bs':
-                x    = 1/self.bsfitGEV.sf(intensity)
-                grid = self.bsGrid.mask.rename('return_time')
-        return self.output_modes(x, grid, output, 
-            units = 'year',
-            attrs = dict(
-                description = 'return time of %0.1f %s'%(intensity,self.intensityUnits)),
-                    ).to_dataset()
+        '''
+        return time at the covariate set with set_covariate or set_temperature_anomaly
+        '''
+        return self.covariateFit.return_time_from_intensity(intensity, mode, output, quantiles)
         
     def times_more_likely(self, intensity, cov0, cov1, 
                           bsCovs0 = None, bsCovs1 = None,
                           mode = 'quantiles',
                           quantiles = [0.025,0.975]):
         '''
-        compare how many times more likely an event is at cov1 than at cov0
+        compare how many times more likely an event is at cov1 than at cov0,
+        mode = 'fit' returns only the central estimate without evaluating the bootstrap variates
         '''
-        self.set_covariate(cov0, bsCovs0)
-        r0   = self.return_time_from_intensity(intensity, mode = 'fit', output = 'dataarray')
-        bsR0 = self.return_time_from_intensity(intensity, mode =  'bs', output = 'dataarray')
-        
-        self.set_covariate(cov1, bsCovs1)
-        r1   = self.return_time_from_intensity(intensity, mode = 'fit', output = 'dataarray')
-        bsR1 = self.return_time_from_intensity(intensity, mode =  'bs', output = 'dataarray')
+        return self.compare_return_times(intensity, self.evaluate(cov0, bsCovs0), self.evaluate(cov1, bsCovs1),
+                                         cov0, cov1, mode = mode, quantiles = quantiles)
+            
+    def times_more_likely_T(self, intensity, T0, T1,
+                          mode = 'quantiles',
+                          quantiles = [0.025,0.975]):
+        '''
+        times_more_likely at the global temperature anomalies T0 and T1, evaluated (or looked up in the lattice)
+        with evaluate_temperature_anomaly
+        '''
+        return self.compare_return_times(intensity,
+                          self.evaluate_temperature_anomaly(T0), self.evaluate_temperature_anomaly(T1),
+                          self.temperature_anomaly_covariate(T0), self.temperature_anomaly_covariate(T1),
+                          mode = mode,
+                          quantiles = quantiles)
+
+    def compare_return_times(self, intensity, fit0, fit1, cov0, cov1,
+                          mode = 'quantiles',
+                          quantiles = [0.025,0.975]):
+        '''
+        the ratio of the return times of an intensity of the Covariate_Fits at cov0 and cov1
+        '''
+        r0   = fit0.return_time_from_intensity(intensity, mode = 'fit', output = 'dataarray')
+        r1   = fit1.return_time_from_intensity(intensity, mode = 'fit', output = 'dataarray')
+
+        if mode == 'fit':
+            return self.apply_units(xr.merge([(r0/r1).rename(return_time = 'times_more_likely')]),
+                    'times_more_frequent',
+                            attrs = dict(
+                    description = 'ratio of return times at cov%0.1f vs cov%0.1f of %0.1f %s'\
+                                %(cov0, cov1, intensity, self.intensityUnits)))
+        bsR0 = fit0.return_time_from_intensity(intensity, mode =  'bs', output = 'dataarray')
+        bsR1 = fit1.return_time_from_intensity(intensity, mode =  'bs', output = 'dataarray')
 
         if mode == 'quantiles':
             return self.apply_units(xr.merge([
                 (r0/r1).rename(return_time = 'times_more_likely'),
-                (bsR0/bsR1).rename(return_time='times_more_likely_quantiles')\
-                                    .times_more_likely_quantiles.quantile(quantiles, dim = 'variate')]),
+                xarray_quantile((bsR0/bsR1).rename(return_time='times_more_likely_quantiles')\
+                                    .times_more_likely_quantiles, quantiles, dim = 'variate',
+                                dtype = self.bsDtype)]),
                     'times_more_frequent',
                             attrs = dict(
                     description = 'ratio of return times at cov%0.1f vs cov%0.1f of %0.1f %s'\
@@ -262,39 +446,55 @@ class Fitted_Obs_Sim():
                             attrs = dict(
                     description = 'ratio of return times at cov%0.1f vs cov%0.1f of %0.1f %s'\
                                 %(cov0, cov1, intensity, self.intensityUnits)))
-            
-    def times_more_likely_T(self, intensity, T0, T1,
-                          mode = 'quantiles',
-                          quantiles = [0.025,0.975]):
-        
-        cov0, bsCovs0 = self.get_temperature_anomaly_params(T0)
-        cov1, bsCovs1 = self.get_temperature_anomaly_params(T1)
-        
-        return self.times_more_likely(intensity, cov0, cov1, 
-                          bsCovs0, bsCovs1,
-                          mode = mode,
-                          quantiles = quantiles)
     
     def change_in_intensity(self, return_time, cov0, cov1, 
                           bsCovs0 = None, bsCovs1 = None,
                           mode = 'quantiles',
                           quantiles = [0.025,0.975]):
         '''
-        compare how many times more likely an event is at cov1 than at cov0
+        compare how many times more likely an event is at cov1 than at cov0,
+        mode = 'fit' returns only the central estimate without evaluating the bootstrap variates
         '''
-        self.set_covariate(cov0, bsCovs0)
-        r0   = self.intensity_from_return_time(return_time, mode = 'fit', output = 'dataarray')
-        bsR0 = self.intensity_from_return_time(return_time, mode =  'bs', output = 'dataarray')
-        
-        self.set_covariate(cov1, bsCovs1)
-        r1   = self.intensity_from_return_time(return_time, mode = 'fit', output = 'dataarray')
-        bsR1 = self.intensity_from_return_time(return_time, mode =  'bs', output = 'dataarray')
+        return self.compare_intensities(return_time, self.evaluate(cov0, bsCovs0), self.evaluate(cov1, bsCovs1),
+                                        cov0, cov1, mode = mode, quantiles = quantiles)
+
+    def change_in_intensity_T(self, return_time, T0, T1,
+                              mode = 'quantiles',
+                              quantiles = [0.025,0.975]):
+        '''
+        change_in_intensity at the global temperature anomalies T0 and T1, evaluated (or looked up in the lattice)
+        with evaluate_temperature_anomaly
+        '''
+        return self.compare_intensities(return_time,
+                              self.evaluate_temperature_anomaly(T0), self.evaluate_temperature_anomaly(T1),
+                              self.temperature_anomaly_covariate(T0), self.temperature_anomaly_covariate(T1),
+                              mode = mode,
+                              quantiles = quantiles)
+
+    def compare_intensities(self, return_time, fit0, fit1, cov0, cov1,
+                          mode = 'quantiles',
+                          quantiles = [0.025,0.975]):
+        '''
+        the change in the intensity at a return time from the Covariate_Fit at cov0 to the one at cov1
+        '''
+        r0   = fit0.intensity_from_return_time(return_time, mode = 'fit', output = 'dataarray')
+        r1   = fit1.intensity_from_return_time(return_time, mode = 'fit', output = 'dataarray')
+
+        if mode == 'fit':
+            return self.apply_units(xr.merge([(r1-r0).rename(intensity = 'intensity_change')]),
+                    self.intensityUnits,
+                            attrs = dict(
+                    description = 'change in intensity at cov%0.1f vs cov%0.1f at return time of %d years'\
+                                %(cov0, cov1, return_time)))
+        bsR0 = fit0.intensity_from_return_time(return_time, mode =  'bs', output = 'dataarray')
+        bsR1 = fit1.intensity_from_return_time(return_time, mode =  'bs', output = 'dataarray')
 
         if mode == 'quantiles':
             return self.apply_units(xr.merge([
                 (r1-r0).rename(intensity = 'intensity_change'),
-                (bsR1-bsR0).rename(intensity='intensity_change_quantiles')\
-                                    .intensity_change_quantiles.quantile(quantiles, dim = 'variate')]),
+                xarray_quantile((bsR1-bsR0).rename(intensity='intensity_change_quantiles')\
+                                    .intensity_change_quantiles, quantiles, dim = 'variate',
+                                dtype = self.bsDtype)]),
                     self.intensityUnits,
                             attrs = dict(
                     description = 'change in intensity at cov%0.1f vs cov%0.1f at return time of %d years'\
@@ -308,17 +508,172 @@ class Fitted_Obs_Sim():
                     description = 'change in intensity at cov%0.1f vs cov%0.1f at return time of %d years'\
                                 %(cov0, cov1, return_time)))
 
-    def change_in_intensity_T(self, return_time, T0, T1,
-                              mode = 'quantiles',
-                              quantiles = [0.025,0.975]):
-            
-        cov0, bsCovs0 = self.get_temperature_anomaly_params(T0)
-        cov1, bsCovs1 = self.get_temperature_anomaly_params(T1)
-            
-        return self.change_in_intensity(return_time, cov0, cov1, 
-                              bsCovs0, bsCovs1,
-                              mode = mode,
-                              quantiles = quantiles)
+    def select_cell(self, xIndex, yIndex):
+        '''
+        a shallow copy of the fitted object restricted to a single grid cell (keeping the grid dimensions with size 1),
+        so point calculations scale with the number of variates instead of the size of the grid.
+        '''
+        cell  = dict(projection_x_coordinate = slice(xIndex, xIndex+1),
+                     projection_y_coordinate = slice(yIndex, yIndex+1))
+        point = copy.copy(self)
+        for name in ['ds', 'grid', 'fit', 'bootstrapMean', 'bootstrapCov', 'bsVariates']:
+            value = getattr(self, name)
+            if type(value) != type(None):
+                setattr(point, name, value.isel(cell))
+        if type(self.covariateFit) != type(None):
+            point.covariateFit = self.covariateFit.select_cell(point, xIndex, yIndex)
+        if type(self.lattice) != type(None):
+            point.lattice = {key: covariateFit.select_cell(point, xIndex, yIndex)
+                             for key, covariateFit in self.lattice.items()}
+        return point
+
+    def select_cells(self, xIndices, yIndices):
+        '''
+        a shallow copy of the fitted object restricted to a list of grid cells, laid out along the x dimension of a
+        grid with a single row (the grid coordinates are the positions in the list), so calculations can be
+        repeated on only the cells that need them.
+        '''
+        xIndices, yIndices = np.asarray(xIndices), np.asarray(yIndices)
+        gridDims = ['projection_x_coordinate', 'projection_y_coordinate']
+        coords   = dict(projection_x_coordinate = np.arange(len(xIndices)), projection_y_coordinate = [0])
+        def cells(value):
+            if isinstance(value, xr.Dataset):
+                return xr.Dataset({name: cells(v) for name, v in value.data_vars.items()}, attrs = value.attrs)\
+                         .assign_coords({name: c for name, c in value.coords.items() if not set(c.dims) & set(gridDims)})
+            if not set(gridDims) <= set(value.dims):
+                return value
+            value = value.transpose(*gridDims, ...)
+            return xr.DataArray(value.values[xIndices, yIndices][:, np.newaxis], dims = value.dims,
+                                coords = dict({name: c for name, c in value.coords.items() if not set(c.dims) & set(gridDims)},
+                                              **coords),
+                                name = value.name, attrs = value.attrs)
+        point = copy.copy(self)
+        for name in ['ds', 'grid', 'fit', 'bootstrapMean', 'bootstrapCov', 'bsVariates']:
+            value = getattr(self, name)
+            if type(value) != type(None):
+                setattr(point, name, cells(value))
+        if type(self.covariateFit) != type(None):
+            point.covariateFit = self.covariateFit.select_cells(point, xIndices, yIndices)
+        if type(self.lattice) != type(None):
+            point.lattice = {key: covariateFit.select_cells(point, xIndices, yIndices)
+                             for key, covariateFit in self.lattice.items()}
+        return point
+
+    def select_variates(self, nVariates, start = 0):
+        '''
+        a shallow copy of the fitted object using only the bootstrap variates from start up to nVariates
+        (the first nVariates by default). The variates (and those of the temperature anomaly) of smaller copies
+        are a prefix of those of larger ones, so a calculation on the variates from start up to nVariates
+        continues one on the first start variates.
+        '''
+        point = copy.copy(self)
+        end   = min(nVariates, self.nVariates)
+        point.firstVariate = self.firstVariate + start
+        point.nVariates    = end - start
+        if type(self.bsVariates) != type(None):
+            point.bsVariates = self.bsVariates.isel(variate = slice(start, end))
+        if type(self.covariateFit) != type(None):
+            point.covariateFit = self.covariateFit.select_variates(point, start, end)
+        if type(self.lattice) != type(None):
+            point.lattice = {key: covariateFit.select_variates(point, start, end)
+                             for key, covariateFit in self.lattice.items()}
+        return point
+
+    def central_fit(self):
+        '''
+        a shallow copy of the fitted object without the bootstrap variates, so that calculations in mode = 'fit'
+        (the central estimate) evaluate only the GEV parameters of the fit
+        '''
+        point = copy.copy(self)
+        point.bsVariates = None
+        if type(self.covariateFit) != type(None):
+            point.covariateFit = Covariate_Fit(point, self.covariateFit.fitGEV)
+        if type(self.lattice) != type(None):
+            point.lattice = {key: Covariate_Fit(point, covariateFit.fitGEV)
+                             for key, covariateFit in self.lattice.items()}
+        return point
+
+    def adaptive_quantiles(self, calculate, quantiles = [0.025,0.975], tolerance = 0.01, nStart = 100, minBatch = 2**17):
+        '''
+        the quantiles of a calculation over the bootstrap variates, using only as many variates as each cell needs.
+        calculate(model, mode) returns the dataset of a calculation in the given mode ('variates' or 'quantiles').
+        All cells are calculated on the first nStart variates. After that, only the cells whose quantiles changed
+        by more than tolerance times the spread of their quantiles in the last batch are calculated again, on the
+        next variates (doubling the number of variates of those cells each time, up to nVariates), which are added
+        to the variates already calculated for them.
+        Each calculation has a fixed cost of about that of 10^5 cell-variates, so a batch of fewer than minBatch
+        cell-variates (as for a single cell) calculates all the remaining variates of its cells at once.
+        Returns the dataset of mode = 'quantiles', with the largest and the mean number of variates used by the
+        cells in its 'nVariates_used' and 'nVariates_mean' attributes. Results without bootstrap variates
+        (e.g. central estimates only) are returned from the first batch.
+        '''
+        gridDims  = ['projection_x_coordinate', 'projection_y_coordinate']
+        nCells    = self.grid.sizes[gridDims[0]] * self.grid.sizes[gridDims[1]]
+        if self.sampler == 'sobol':
+            # batches ending at powers of two, where the Sobol points are balanced
+            nStart = 1 << (nStart - 1).bit_length()
+        nVariates = min(nStart, self.nVariates)
+        if nCells * self.nVariates <= minBatch:
+            nVariates = self.nVariates
+        result    = calculate(self.select_variates(nVariates), 'variates')
+        if isinstance(result, xr.DataArray):
+            return result
+        names = [name for name, v in result.data_vars.items() if 'variate' in v.dims]
+        if len(names) == 0:
+            return result
+
+        variates = lambda ds, name: ds[name].transpose(*gridDims, ..., 'variate').values
+        quantiles = np.asarray(quantiles, dtype = np.float64)
+        # the variates of each cell (cells, ..., variate), filled in as they are calculated
+        buffers, current = dict(), dict()
+        for name in names:
+            first = variates(result, name)
+            buffers[name] = np.empty(first.shape[:-1] + (self.nVariates,), dtype = first.dtype)
+            buffers[name][..., :nVariates] = first
+            current[name] = quantile(first, quantiles, dtype = self.bsDtype)
+        used   = np.full(buffers[names[0]].shape[:2], nVariates)
+        active = np.ones(used.shape, dtype = bool)
+        while nVariates < self.nVariates and active.any():
+            xs, ys = np.nonzero(active)
+            end    = min(2*nVariates, self.nVariates)
+            if len(xs) * (self.nVariates - nVariates) <= minBatch:
+                end = self.nVariates
+            # cells are calculated in the order of (xs, ys) both on the whole grid and on a selection of cells
+            model  = self if active.all() else self.select_cells(xs, ys)
+            batch  = calculate(model.select_variates(end, start = nVariates), 'variates')
+            updated = dict()
+            for name in names:
+                buffers[name][xs, ys, ..., nVariates:end] = variates(batch, name)\
+                    .reshape((len(xs),) + buffers[name].shape[2:-1] + (end - nVariates,))
+                updated[name] = quantile(buffers[name][xs, ys, ..., :end], quantiles, dtype = self.bsDtype)
+            converged = cells_converged({name: current[name][:, xs, ys] for name in names}, updated, tolerance)
+            for name in names:
+                current[name][:, xs, ys] = updated[name]
+            used[xs, ys]   = end
+            active[xs, ys] = ~converged
+            nVariates = end
+
+        # replace the variates by their quantiles, as in mode = 'quantiles'
+        for name in names:
+            da   = result[name]
+            dims = [d for d in da.transpose(*gridDims, ..., 'variate').dims if d != 'variate']
+            q    = xr.DataArray(current[name], dims = ['quantile'] + dims,
+                                coords = {k: c for k, c in da.coords.items() if not 'variate' in c.dims})
+            q    = q.assign_coords(quantile = quantiles).transpose('quantile', *[d for d in da.dims if d != 'variate'])
+            result = result.drop_vars(name).assign({name.replace('_variates', '_quantiles'): q})
+        result = result.drop_vars([k for k, c in result.coords.items() if 'variate' in c.dims])
+        result.attrs['nVariates_used'] = int(used.max())
+        result.attrs['nVariates_mean'] = float(used.mean())
+        return result
+
+    def covariate_fit(self, T0 = None):
+        '''
+        evaluate at the temperature anomaly T0, or use the covariate set with set_covariate if T0 is None
+        '''
+        if type(T0) == type(None):
+            return self.covariateFit
+        return self.evaluate_temperature_anomaly(T0)
+
     def get_variates_dist(self, calculation,
                  xIndex    = None,      yIndex = None,
                  intensity = None, return_time = None,
@@ -326,18 +681,21 @@ class Fitted_Obs_Sim():
         '''
         can add raise statements here
         '''
+        model = self
+        if (type(xIndex) != type(None)) and (type(yIndex) != type(None)):
+            model = self.select_cell(xIndex, yIndex)
         if calculation == 'intensity_from_return_time':
-            dataset = self.intensity_from_return_time(return_time, mode = 'variates')
+            dataset = model.covariate_fit(T0).intensity_from_return_time(return_time, mode = 'variates')
         elif calculation == 'return_time_from_intensity':
-            dataset = self.return_time_from_intensity(intensity, mode = 'variates')
+            dataset = model.covariate_fit(T0).return_time_from_intensity(intensity, mode = 'variates')
         elif calculation == 'change_in_intensity':
-            dataset = self.change_in_intensity_T(return_time, T0 = T0, T1 = T1, mode = 'variates')
+            dataset = model.change_in_intensity_T(return_time, T0 = T0, T1 = T1, mode = 'variates')
         elif calculation == 'times_more_likely':
-            dataset = self.times_more_likely_T(intensity, T0 = T0, T1 = T1, mode = 'variates')
+            dataset = model.times_more_likely_T(intensity, T0 = T0, T1 = T1, mode = 'variates')
         
-        if (type(xIndex) != type(None)) and (type(yIndex) != type(None)):
-            dataset = dataset.isel(projection_x_coordinate = xIndex,
-                                   projection_y_coordinate = yIndex)
+        if model is not self:
+            dataset = dataset.isel(projection_x_coordinate = 0,
+                                   projection_y_coordinate = 0)
         return dataset
 
     def get_CI_report(self, calculation, 
@@ -345,40 +703,50 @@ class Fitted_Obs_Sim():
                  quantiles = [0.025,0.975],
                  xIndex    = None,      yIndex = None,
                  intensity = None, return_time = None,
-                 T0        = None,          T1 = None):
+                 T0        = None,          T1 = None,
+                 tolerance = None):
         '''
-        can add raise statements here
+        can add raise statements here.
+        With a tolerance, the number of bootstrap variates is chosen adaptively (see adaptive_quantiles)
         '''
         if report == 'calibrated_confidence':
             quantiles = [0.05,0.1,0.25,0.75,0.9,0.95]
+        # restrict point reports to a single cell before any GEV or quantile calculations
+        model = self
+        if (type(xIndex) != type(None)) and (type(yIndex) != type(None)):
+            model = self.select_cell(xIndex, yIndex)
         #-----------------------------------------------------------
         if calculation == 'intensity_from_return_time':
             mv = np.inf
-            dataset = self.intensity_from_return_time(return_time, 
-                                                      mode = 'quantiles', quantiles = quantiles)
+            calculate = lambda m, mode: m.covariate_fit(T0).intensity_from_return_time(return_time, 
+                                                      mode = mode, quantiles = quantiles)
             var     = 'intensity'
         #-----------------------------------------------------------            
         elif calculation == 'return_time_from_intensity':
             mv = 200
-            dataset = self.return_time_from_intensity(intensity, 
-                                                      mode = 'quantiles', quantiles = quantiles)
+            calculate = lambda m, mode: m.covariate_fit(T0).return_time_from_intensity(intensity, 
+                                                      mode = mode, quantiles = quantiles)
             var     = 'return_time'
         #-----------------------------------------------------------           
         elif calculation == 'change_in_intensity':
             mv = np.inf
-            dataset = self.change_in_intensity_T(return_time, T0 = T0, T1 = T1, 
-                                                      mode = 'quantiles', quantiles = quantiles)
+            calculate = lambda m, mode: m.change_in_intensity_T(return_time, T0 = T0, T1 = T1, 
+                                                      mode = mode, quantiles = quantiles)
             var     = 'intensity_change'
         #-----------------------------------------------------------            
         elif calculation == 'times_more_likely':
             mv = 50
-            dataset = self.times_more_likely_T(intensity, T0 = T0, T1 = T1,
-                                                      mode = 'quantiles', quantiles = quantiles)
+            calculate = lambda m, mode: m.times_more_likely_T(intensity, T0 = T0, T1 = T1,
+                                                      mode = mode, quantiles = quantiles)
             var     = 'times_more_likely'
         #-----------------------------------------------------------        
-        if (type(xIndex) != type(None)) and (type(yIndex) != type(None)):
-            dataset = dataset.isel(projection_x_coordinate = xIndex,
-                                   projection_y_coordinate = yIndex)
+        if type(tolerance) == type(None):
+            dataset = calculate(model, 'quantiles')
+        else:
+            dataset = model.adaptive_quantiles(calculate, quantiles, tolerance = tolerance)
+        if model is not self:
+            dataset = dataset.isel(projection_x_coordinate = 0,
+                                   projection_y_coordinate = 0)
             def two_sigfigs(num):
                 return '%d'%float(f"{num:.{2}g}")
             def formatVal(q, mv, var): 
@@ -413,23 +781,30 @@ class Fitted_Obs_Sim():
         return dataset
 
     def get_KS_test_p(self, data, distribution, nParams):
-        def fit_and_p(variates,distribution,nParams):
+        '''
+        fit distribution to the variates of each cell and test the fit (one-sided KS test),
+        vectorised over cells once the fits are known
+        '''
+        def fit_dist(variates, distribution, nParams):
             if not np.isfinite(variates).all():
-                fit = np.nan*np.empty(nParams)
-                p   = np.array([np.nan])
-            else:
-                fit = np.array(distribution.fit(variates))
-                p   = np.array([kstest(variates, fit, alternative = 'less').pvalue])
-            return fit, p
-        fit, p = xr.apply_ufunc(
-                    fit_and_p,
+                return np.nan*np.empty(nParams)
+            return np.array(distribution.fit(variates))
+        fit = xr.apply_ufunc(
+                    fit_dist,
                     data,
                     distribution,
                     nParams,
                     input_core_dims = [['variate'],[],[]],
-                    output_core_dims = [['fit'],[]],
+                    output_core_dims = [['fit']],
                     exclude_dims = set(('variate',)),
                     vectorize = True)
+        p = xr.apply_ufunc(
+                    lambda variates, fit: ks_1samp_less(
+                        variates, lambda x: distribution.cdf(x, *np.moveaxis(fit, -1, 0)[..., np.newaxis]))[1],
+                    data,
+                    fit,
+                    input_core_dims = [['variate'],['fit']],
+                    output_core_dims = [[]])
         return xr.merge(
                 [fit.to_dataset(name = 'dist_fit'), 
                    p.to_dataset(name = 'KS_test')])
@@ -437,13 +812,14 @@ class Fitted_Obs_Sim():
     def test_dist(self, data, distribution = 'default', 
                   nParams = 3, threshold = 0.05, return_fit = False):
         if distribution == 'default': distribution = lognorm
-        ks   = self.get_KS_p(data, distribution, nParams)
+        ks   = self.get_KS_test_p(data, distribution, nParams)
         test = xr.where(np.isnan(ks.KS_test), np.nan, 
                         xr.where(ks.KS_test<threshold, 1, 0))
         if return_fit: return test, ks
         else: return test
 
     def renormalise(self, data = 'obs', dataCovariate = 'obs', dataFit = 'obs'):
+        self.load_inputs()
         if data == 'obs':
             data          = self.dsObs.tasmax
             dataCovariate = self.dsObs.covariate
@@ -462,70 +838,39 @@ class Fitted_Obs_Sim():
     def ks_compare(self):
         '''
         identify if the input observations and simulations follow the same distribution
+        (two-sample KS test of the renormalised data, vectorised over cells)
         '''
-        renormObs = self.renormalise(data = 'obs')
-        renormSim = self.renormalise(data = 'sim')
-        return xr.apply_ufunc(
-            lambda a,b: np.array( [kstest(a,b).pvalue]),
+        renormObs = self.renormalise(data = 'obs').renormalised_data
+        renormSim = self.renormalise(data = 'sim').renormalised_data
+        statistic, p = xr.apply_ufunc(
+            ks_2samp,
             renormObs,
             renormSim,
             input_core_dims = [['variate'],['variate']],
-            output_core_dims = [[]],
-            exclude_dims = set(('variate',)),
-            vectorize = True)\
-            .rename(renormalised_data = 'test')
+            output_core_dims = [[],[]],
+            exclude_dims = set(('variate',)))
+        return xr.Dataset(dict(test = p, statistic = statistic))
 
-    def calculate_overlap(self, n = 1e4, calculationMode = 'array'):
+    def calculate_overlap(self):
         '''
         calculate the overlap of the distributions of parameters in 
-        observations and simulations
-        '''
-        x = self.dsObs
-        xVar = x.bootstrap_covariance.where(x.params_i == x.params_j, 0)
-        xMu  = x.fit
-        y = self.dsSim
-        yVar = y.bootstrap_covariance.where(y.params_i == y.params_j, 0)        
-        yMu  = y.fit
-        
-        def overlap(m0, v0, m1, v1, n = 1000, nd = (5,)): 
-            '''
-            estimate shared area
-            '''
-            n = int(n)
-            s0 = np.sqrt(v0.diagonal(axis1 = -2, axis2 = -1))
-            s1 = np.sqrt(v1.diagonal(axis1 = -2, axis2 = -1))
-        
-            N0       = norm(m0, s0)
-            N1       = norm(m1, s1)
-            
-            bounds   = [np.nan_to_num(np.min([m0-3*s0, m1-3*s1], axis = 0),0),
-                        np.nan_to_num(np.max([m0+3*s0, m1+3*s1], axis = 0),0)]
-        
-            scale    = bounds[1]-bounds[0]
-            tests    = np.random.uniform(bounds[0],bounds[1],(n,) + nd)
-            overlap  = np.min([N0.pdf(tests), N1.pdf(tests)], axis = 0)
-            return overlap.sum(axis = 0) * scale / n
-
-        if calculationMode == 'array':#fast for small memory
-            self.ds['overlap'] = (['projection_y_coordinate',
-                                   'projection_x_coordinate',
-                                   'params'],
-                        overlap(xMu.values,xVar.values,
-                                yMu.values,yVar.values,
-                                nd = (self.ds.projection_y_coordinate.size, 
-                                      self.ds.projection_x_coordinate.size, 
-                                      self.ds.params.size), 
-                                n = n))
-        if calculationMode == 'cellwise':#less memory intensive
-            self.ds['overlap'] = xr.apply_ufunc(
-                        overlap,
-                        xMu,xVar,
-                        yMu,yVar,
-                        n,
-                        input_core_dims = [['params'],['params_i','params_j'],
-                                           ['params'],['params_i','params_j'],[],],
+        observations and simulations (normal distributions with the bootstrap
+        variances), in closed form
+        '''
+        x, y = self.load_inputs()
+        std = lambda ds: np.sqrt(xr.apply_ufunc(
+                        np.diagonal,
+                        ds.bootstrap_covariance,
+                        input_core_dims = [['params_i','params_j']],
                         output_core_dims = [['params']],
-                        vectorize = True).compute()
+                        kwargs = dict(axis1 = -2, axis2 = -1)))
+        self.ds['overlap'] = xr.apply_ufunc(
+                        normal_overlap,
+                        x.fit, std(x),
+                        y.fit, std(y),
+                        input_core_dims = [['params']]*4,
+                        output_core_dims = [['params']])\
+                        .transpose(*self.ds.fit.dims)
         return self.ds.overlap
 
     def apply_metadata(self, da,
@@ -611,31 +956,279 @@ class Fitted_Obs_Sim():
                 info.append('')
         return info
         
-@functools.lru_cache(maxsize=16)
-def init_composite_fit(dataset_name, simParams='c,loc1,scale0,scale1', nVariates=10000, preProcess=True, **kwargs):
+class Covariate_Fit():
+    def __init__(self, model, fitGEV, bsfitGEV = None):
+        '''
+        GEV parameters of a Fitted_Obs_Sim evaluated at a single covariate, as returned by Fitted_Obs_Sim.evaluate.
+        The fitted object is only read, so instances can be used concurrently by threads sharing one cached model.
+        '''
+        self.model    = model
+        self.fitGEV   = fitGEV
+        self.bsfitGEV = bsfitGEV
+
+    def select_cell(self, model, xIndex, yIndex):
+        '''
+        the GEV parameters of a single grid cell, for a model returned by Fitted_Obs_Sim.select_cell
+        '''
+        cell = lambda params: None if type(params) == type(None) else \
+                    tuple(p[xIndex:xIndex+1, yIndex:yIndex+1] for p in params)
+        return Covariate_Fit(model, cell(self.fitGEV), cell(self.bsfitGEV))
+
+    def select_cells(self, model, xIndices, yIndices):
+        '''
+        the GEV parameters of a list of grid cells, for a model returned by Fitted_Obs_Sim.select_cells
+        '''
+        cells = lambda params: None if type(params) == type(None) else \
+                    tuple(np.ascontiguousarray(p[xIndices, yIndices][:, np.newaxis]) for p in params)
+        return Covariate_Fit(model, cells(self.fitGEV), cells(self.bsfitGEV))
+
+    def select_variates(self, model, start, end):
+        '''
+        the GEV parameters of the bootstrap variates from start up to end, for a model returned by Fitted_Obs_Sim.select_variates
+        '''
+        bsfitGEV = None if type(self.bsfitGEV) == type(None) else \
+                    tuple(p[..., start:end] for p in self.bsfitGEV)
+        return Covariate_Fit(model, self.fitGEV, bsfitGEV)
+
+    def intensity_from_return_time(self, tauReturn, mode = 'fit', output = 'dataarray', quantiles = [0.025,0.975]):
+        if (mode == 'variates') or (mode == 'quantiles'):
+            fit = self.intensity_from_return_time(tauReturn, mode = 'fit')
+            bss = self.intensity_from_return_time(tauReturn, mode = 'bs')
+            if mode == 'quantiles':
+                ds = xr.merge([fit, xarray_quantile(bss, quantiles, dim = 'variate', dtype = self.model.bsDtype)\
+                         .rename(intensity = 'intensity_quantiles')])
+            else:
+                ds = xr.merge([fit, bss.rename(intensity = 'intensity_variates')])
+            return self.model.apply_units(ds, units = self.model.intensityUnits)
+        elif mode == 'fit':
+                x    = gev.ppf(1-1/tauReturn, *self.fitGEV)
+                grid = self.model.grid.mask.rename('intensity')
+        elif mode == 'bs':
+                x    = gev.ppf(1-1/tauReturn, *self.bsfitGEV)
+                grid = self.model.bsGrid.mask.rename('intensity')
+        return self.model.output_modes(x, grid, output, 
+            units = self.model.intensityUnits,
+            attrs = dict(
+                description = 'intensity at %d year return time'%tauReturn),
+                    ).to_dataset()
+
+    def return_time_from_intensity(self, intensity, mode = 'fit', output = 'dataarray', quantiles = [0.025,0.975]):
+        if (mode == 'variates') or (mode == 'quantiles'):
+            fit = self.return_time_from_intensity(intensity, mode = 'fit')
+            bss = self.return_time_from_intensity(intensity, mode = 'bs')
+            if mode == 'quantiles':
+                ds = xr.merge([fit, xarray_quantile(bss, quantiles, dim = 'variate', dtype = self.model.bsDtype)\
+                         .rename(return_time = 'return_time_quantiles')])
+            else:
+                ds = xr.merge([fit, bss.rename(return_time = 'return_time_variates')])
+            return self.model.apply_units(ds, units = 'years')
+        elif mode == 'fit':
+                x    = np.reciprocal(gev.sf(intensity, *self.fitGEV))
+                grid = self.model.grid.mask.rename('return_time')
+        elif mode == 'bs':
+                x    = gev.sf(intensity, *self.bsfitGEV)
+                x    = np.reciprocal(x, out = x)
+                grid = self.model.bsGrid.mask.rename('return_time')
+        return self.model.output_modes(x, grid, output, 
+            units = 'year',
+            attrs = dict(
+                description = 'return time of %0.1f %s'%(intensity,self.model.intensityUnits)),
+                    ).to_dataset()
+
+    def sweep(self, values, dim, mode, params):
+        '''
+        shape an array of argument values to broadcast against the GEV parameters of the given mode,
+        with the values along a new leading dimension, and the matching grid mask
+        '''
+        grid   = self.model.grid.mask if mode == 'fit' else self.model.bsGrid.mask
+        values = np.asarray(values)
+        return values.reshape((-1,) + (1,)*np.ndim(params[0])).astype(params[0].dtype), \
+               grid.expand_dims({dim: values})
+
+    def intensity_from_return_times(self, tauReturns, mode = 'fit', output = 'dataarray', quantiles = [0.025,0.975]):
+        '''
+        intensity_from_return_time for an array of return times in one pass over the grid,
+        with the return times along a new 'return_time' dimension
+        '''
+        if (mode == 'variates') or (mode == 'quantiles'):
+            fit = self.intensity_from_return_times(tauReturns, mode = 'fit')
+            bss = self.intensity_from_return_times(tauReturns, mode = 'bs')
+            if mode == 'quantiles':
+                ds = xr.merge([fit, xarray_quantile(bss, quantiles, dim = 'variate', dtype = self.model.bsDtype)\
+                         .rename(intensity = 'intensity_quantiles')])
+            else:
+                ds = xr.merge([fit, bss.rename(intensity = 'intensity_variates')])
+            return self.model.apply_units(ds, units = self.model.intensityUnits)
+        params  = self.fitGEV if mode == 'fit' else self.bsfitGEV
+        tauReturns, grid = self.sweep(tauReturns, 'return_time', mode, params)
+        x = gev.ppf(1-1/tauReturns, *params)
+        return self.model.output_modes(x, grid.rename('intensity'), output,
+            units = self.model.intensityUnits,
+            attrs = dict(
+                description = 'intensity at each return time'),
+                    ).to_dataset()
+
+    def return_times_from_intensities(self, intensities, mode = 'fit', output = 'dataarray', quantiles = [0.025,0.975]):
+        '''
+        return_time_from_intensity for an array of intensities in one pass over the grid,
+        with the intensities along a new 'intensity' dimension
+        '''
+        if (mode == 'variates') or (mode == 'quantiles'):
+            fit = self.return_times_from_intensities(intensities, mode = 'fit')
+            bss = self.return_times_from_intensities(intensities, mode = 'bs')
+            if mode == 'quantiles':
+                ds = xr.merge([fit, xarray_quantile(bss, quantiles, dim = 'variate', dtype = self.model.bsDtype)\
+                         .rename(return_time = 'return_time_quantiles')])
+            else:
+                ds = xr.merge([fit, bss.rename(return_time = 'return_time_variates')])
+            return self.model.apply_units(ds, units = 'years')
+        params  = self.fitGEV if mode == 'fit' else self.bsfitGEV
+        intensities, grid = self.sweep(intensities, 'intensity', mode, params)
+        x = gev.sf(intensities, *params)
+        x = np.reciprocal(x, out = x)
+        return self.model.output_modes(x, grid.rename('return_time'), output,
+            units = 'year',
+            attrs = dict(
+                description = 'return time of each intensity in %s'%self.model.intensityUnits),
+                    ).to_dataset()
+
+
+def cells_converged(previous, current, tolerance):
+    '''
+    which cells of the quantile arrays of current (by variable name, with the quantiles along the first axis
+    and the cells along the second) are within tolerance times the cell's quantile spread of those in previous;
+    cells without finite quantiles must be unchanged
+    '''
+    converged = True
+    for name, q in current.items():
+        finite = np.where(np.isfinite(q), q, np.nan)
+        spread = np.fmax.reduce(finite, axis = 0) - np.fmin.reduce(finite, axis = 0)
+        with np.errstate(invalid = 'ignore'):
+            change = np.abs(q - previous[name])
+        stable = (change <= tolerance * spread) | (q == previous[name]) | (np.isnan(q) & np.isnan(previous[name]))
+        converged = converged & stable.reshape(stable.shape[:2] + (-1,)).all(axis = (0, 2))
+    return converged
+
+
+def quantiles_converged(previous, current, tolerance):
+    '''
+    whether all cells of the quantile arrays of current have converged, see cells_converged
+    '''
+    return bool(np.all(cells_converged(previous, current, tolerance)))
+
+
+def open_composite_inputs(dataset_name):
+    '''
+    open the observation and simulation fits and the grid of a dataset, aligned on the same coordinates.
+    The files are read lazily, so parts of them can be loaded (see tiling.py).
+    '''
     dataset = datasets[dataset_name]
     model_file, grid_size, grid_selection = dataset['model_file'], dataset['grid_size'], dataset['grid_selection']
-    simParams = simParams.split(',')
-    dsObs = xr.open_dataset(fetch_file('model_fits/obs/'+model_file%'HadUK'))
-    dsSim = xr.open_dataset(fetch_file('model_fits/sim/'+model_file%'UKCP18'))
-    grid = xr.open_dataset(fetch_file('grids/gridWide_g%i.nc'%grid_size))\
-             .sel(grid_selection)
+    files = [xr.open_dataset(fetch_file('model_fits/obs/'+model_file%'HadUK')),
+             xr.open_dataset(fetch_file('model_fits/sim/'+model_file%'UKCP18')),
+             xr.open_dataset(fetch_file('grids/gridWide_g%i.nc'%grid_size))]
+    dsObs, dsSim, grid = files[0], files[1], files[2].sel(grid_selection)
     dsSim, dsObs, grid = xr.align(dsSim, dsObs, grid, join = 'outer', exclude = ['year', 'ensemble_member'], fill_value  = np.nan)
+    # closing the aligned datasets closes their files; lazily opened variables reopen them when they are loaded
+    for ds, file in zip([dsObs, dsSim, grid], files):
+        ds.set_close(file.close)
+    return dsObs, dsSim, grid
 
-    return Fitted_Obs_Sim(dsObs, dsSim, grid, simParams = simParams, nVariates = nVariates, preProcess = preProcess, **kwargs)
+
+def composite_fit_key(dataset_name, simParams='c,loc1,scale0,scale1', nVariates=10000, preProcess=True, **kwargs):
+    '''
+    the registry key of a fitted model and the options it is built with, with the defaults from the app config.
+    Models are identified by the dataset and the options that change their values;
+    the intensity units always come from data.datasets.
+    '''
+    kwargs.pop('intensityUnits', None)
+    kwargs['bsDtype'] = np.dtype(kwargs.get('bsDtype', current_app.config['BOOTSTRAP_DTYPE'])).name
+    kwargs.setdefault('slim', current_app.config['SLIM_MODELS'])
+    kwargs.setdefault('sampler', current_app.config['BOOTSTRAP_SAMPLER'])
+    return (dataset_name, simParams, nVariates, preProcess, *sorted(kwargs.items())), kwargs
+
+
+def init_composite_fit(dataset_name, simParams='c,loc1,scale0,scale1', nVariates=10000, preProcess=True, **kwargs):
+    '''
+    the fitted model of a dataset, shared between requests through the model registry (see registry.py)
+    and, if SHARED_MODEL_STORE is set, between worker processes through shared memory (see model_store.py)
+    '''
+    key, kwargs = composite_fit_key(dataset_name, simParams, nVariates, preProcess, **kwargs)
+    build = functools.partial(build_composite_fit, dataset_name, simParams, nVariates, preProcess,
+                              intensityUnits = datasets[dataset_name]['intensity_units'], **kwargs)
+    if current_app.config['SHARED_MODEL_STORE']:
+        build = functools.partial(shared_model, current_app.config['MODEL_STORE_DIR'], key, build,
+                                  settings = store_settings(current_app.config))
+    return registry.get(key, build, maxBytes = current_app.config['MODEL_REGISTRY_MAX_BYTES'])
+
+
+def build_composite_fit(dataset_name, simParams='c,loc1,scale0,scale1', nVariates=10000, preProcess=True, **kwargs):
+    simParams = simParams.split(',')
+
+    # Use bootstrap variates from the store (see variates.py) if they have been generated
+    seed = current_app.config['BOOTSTRAP_SEED']
+    bsVariates = None
+    if preProcess:
+        bsVariates = load_variates(variates_path(
+            current_app.config['DATA_DIR'], dataset_name, ','.join(simParams), nVariates, seed, kwargs['bsDtype'], kwargs['sampler']))
+
+    # Slim models are loaded from the serving artifact (see artifacts.py) if it has been built
+    artifact = None
+    if kwargs.get('slim'):
+        artifact = load_artifact(artifact_path(current_app.config['DATA_DIR'], dataset_name, ','.join(simParams)))
+
+    if type(artifact) != type(None):
+        compositeFit = Fitted_Obs_Sim.from_artifact(*artifact, nVariates = nVariates,
+                                  preProcess = preProcess and type(bsVariates) == type(None), seed = seed, **kwargs)
+    else:
+        dsObs, dsSim, grid = open_composite_inputs(dataset_name)
+        compositeFit = Fitted_Obs_Sim(dsObs, dsSim, grid, simParams = simParams, nVariates = nVariates,
+                                  preProcess = preProcess and type(bsVariates) == type(None), seed = seed, **kwargs)
+        # close the input files, so their handles are not shared with forked workers;
+        # the lazily opened inputs of a slim model reopen them if the diagnostics load them
+        for ds in [dsObs, dsSim, grid]:
+            ds.close()
+    if type(bsVariates) != type(None):
+        compositeFit.set_bootstrap_variates(bsVariates)
+
+    if current_app.config['COVARIATE_LATTICE']:
+        from .hazards import hazard_covariates
+        truncated = compositeFit.build_lattice(hazard_covariates(dataset_name),
+                                   maxBytes = current_app.config['COVARIATE_LATTICE_MAX_BYTES'])
+        if truncated:
+            current_app.logger.warning(
+                'The covariate lattice of %s keeps the bootstrap parameters of %d of its %d entries within '
+                'COVARIATE_LATTICE_MAX_BYTES (%d bytes), the others are calculated per request',
+                dataset_name, len(compositeFit.lattice) - truncated, len(compositeFit.lattice),
+                current_app.config['COVARIATE_LATTICE_MAX_BYTES'])
+    return compositeFit
 
 
 def intensity_from_return_time(compositeFit, covariate, tauReturn, format='geojson', **kwargs):
-    compositeFit.set_temperature_anomaly(covariate)
+    covariateFit = compositeFit.evaluate_temperature_anomaly(covariate)
     if format=='geojson':
-        return compositeFit.intensity_from_return_time(tauReturn, **kwargs).intensity
-    return compositeFit.intensity_from_return_time(tauReturn, **kwargs)
+        return covariateFit.intensity_from_return_time(tauReturn, **kwargs).intensity
+    return covariateFit.intensity_from_return_time(tauReturn, **kwargs)
 
 def return_time_from_intensity(compositeFit, covariate, intensity, format='geojson', **kwargs):
-    compositeFit.set_temperature_anomaly(covariate)
+    covariateFit = compositeFit.evaluate_temperature_anomaly(covariate)
+    if format=='geojson':
+        return covariateFit.return_time_from_intensity(intensity, **kwargs).return_time
+    return covariateFit.return_time_from_intensity(intensity, **kwargs)
+
+def intensity_from_return_times(compositeFit, covariate, tauReturns, format='geojson', **kwargs):
+    '''intensity_from_return_time for a list of return times, along the 'return_time' dimension'''
+    covariateFit = compositeFit.evaluate_temperature_anomaly(covariate)
+    if format=='geojson':
+        return covariateFit.intensity_from_return_times(tauReturns, **kwargs).intensity
+    return covariateFit.intensity_from_return_times(tauReturns, **kwargs)
+
+def return_times_from_intensities(compositeFit, covariate, intensities, format='geojson', **kwargs):
+    '''return_time_from_intensity for a list of intensities, along the 'intensity' dimension'''
+    covariateFit = compositeFit.evaluate_temperature_anomaly(covariate)
     if format=='geojson':
-        return compositeFit.return_time_from_intensity(intensity, **kwargs).return_time
-    return compositeFit.return_time_from_intensity(intensity, **kwargs)
+        return covariateFit.return_times_from_intensities(intensities, **kwargs).return_time
+    return covariateFit.return_times_from_intensities(intensities, **kwargs)
 
 def change_in_intensity(compositeFit, return_time, cov0, cov1, format='geojson', **kwargs):
     if format=='geojson':
@@ -647,8 +1240,7 @@ def change_in_frequency(compositeFit, intensity, cov0, cov1, format='geojson', *
         return compositeFit.times_more_likely(intensity, cov0, cov1, **kwargs).times_more_likely
     return compositeFit.times_more_likely(intensity, cov0, cov1, **kwargs)
 
-def intensity_ci_report(compositeFit, cov, return_time, x_idx, y_idx):
-    compositeFit.set_temperature_anomaly(cov)
+def intensity_ci_report(compositeFit, cov, return_time, x_idx, y_idx, tolerance=None):
     return compositeFit.get_CI_report(
         'intensity_from_return_time',
         report='calibrated_confidence',
@@ -656,19 +1248,21 @@ def intensity_ci_report(compositeFit, cov, return_time, x_idx, y_idx):
         T0=cov,
         xIndex=x_idx,
         yIndex=y_idx,
+        tolerance=tolerance,
     )
 
-def return_time_ci_report(compositeFit, cov, intensity, x_idx, y_idx):
-    compositeFit.set_temperature_anomaly(cov)
+def return_time_ci_report(compositeFit, cov, intensity, x_idx, y_idx, tolerance=None):
     return compositeFit.get_CI_report(
         'return_time_from_intensity',
         report='calibrated_confidence',
         intensity=intensity,
+        T0=cov,
         xIndex=x_idx,
         yIndex=y_idx,
+        tolerance=tolerance,
     )
 
-def change_in_intensity_ci_report(compositeFit, return_time, cov0, cov1, x_idx, y_idx):
+def change_in_intensity_ci_report(compositeFit, return_time, cov0, cov1, x_idx, y_idx, tolerance=None):
     return compositeFit.get_CI_report(
         'change_in_intensity',
         report='calibrated_confidence',
@@ -677,9 +1271,10 @@ def change_in_intensity_ci_report(compositeFit, return_time, cov0, cov1, x_idx,
         T1=cov1,
         xIndex=x_idx,
         yIndex=y_idx,
+        tolerance=tolerance,
     )
 
-def change_in_frequency_ci_report(compositeFit, intensity, cov0, cov1, x_idx, y_idx):
+def change_in_frequency_ci_report(compositeFit, intensity, cov0, cov1, x_idx, y_idx, tolerance=None):
     return compositeFit.get_CI_report(
         'times_more_likely',
         report='calibrated_confidence',
@@ -688,5 +1283,6 @@ def change_in_frequency_ci_report(compositeFit, intensity, cov0, cov1, x_idx, y_
         T1=cov1,
         xIndex=x_idx,
         yIndex=y_idx,
+        tolerance=tolerance,
     )
 
@@ -0,0 +1,137 @@
+'''
+Goodness-of-fit diagnostics of the fitted observations and simulations.
+
+The statistics are vectorised over grid cells: two-sample Kolmogorov-Smirnov
+tests use one sort of the pooled samples of every cell, and the overlap of
+the parameter distributions is calculated in closed form instead of by
+Monte Carlo integration. `flask diagnostics` runs them for every dataset,
+over spatial chunks in a process pool, and writes the results to NetCDF.
+'''
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import click
+import numpy as np
+from scipy.special import ndtr
+from scipy.stats import kstwo, ksone
+import xarray as xr
+
+from .data import datasets
+
+
+def ks_2samp(a, b):
+    '''
+    Two-sided two-sample Kolmogorov-Smirnov test along the last axis of a and b, whose other
+    dimensions must match. Returns the statistic and the asymptotic p-value (as scipy's
+    ks_2samp with method='asymp'). Cells with missing values give NaN.
+    '''
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    n, m = a.shape[-1], b.shape[-1]
+    values = np.concatenate([a, b], axis=-1)
+    order = np.argsort(values, axis=-1, kind='stable')
+    values = np.take_along_axis(values, order, axis=-1)
+    # n*m times the difference of the empirical CDFs, in integers so that ties are exact
+    difference = np.cumsum(np.where(order < n, m, -n), axis=-1)
+    # the CDFs are only compared after the last of a run of tied values
+    last = np.ones(values.shape, dtype=bool)
+    last[..., :-1] = values[..., 1:] != values[..., :-1]
+    statistic = np.where(last, np.abs(difference), 0).max(axis=-1) / (n * m)
+
+    statistic = np.where(np.isnan(a).any(axis=-1) | np.isnan(b).any(axis=-1), np.nan, statistic)
+    return statistic, kstwo.sf(statistic, np.round(n * m / (n + m)))
+
+
+def ks_1samp_less(x, cdf):
+    '''
+    One-sample Kolmogorov-Smirnov test with alternative='less' along the last axis of x, for
+    a distribution with the (vectorised) cumulative distribution function cdf. Returns the
+    statistic and the p-value (as scipy's kstest). Cells with missing values give NaN.
+    '''
+    x = np.sort(np.asarray(x, dtype=np.float64), axis=-1)
+    n = x.shape[-1]
+    statistic = (cdf(x) - np.arange(n) / n).max(axis=-1)
+    statistic = np.where(np.isnan(x).any(axis=-1), np.nan, statistic)
+    return statistic, ksone.sf(statistic, n)
+
+
+def normal_overlap(m0, s0, m1, s1):
+    '''
+    Overlapping area of the normal distributions N(m0, s0) and N(m1, s1), elementwise.
+    The densities cross where a quadratic in x vanishes; between the crossings the wider
+    distribution has the lower density, outside them the narrower one.
+    '''
+    m0, s0, m1, s1 = np.broadcast_arrays(*[np.asarray(v, dtype=np.float64) for v in (m0, s0, m1, s1)])
+    swap = s0 > s1 # make distribution 0 the narrower one
+    m0, m1 = np.where(swap, m1, m0), np.where(swap, m0, m1)
+    s0, s1 = np.where(swap, s1, s0), np.where(swap, s0, s1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = 1/s0**2 - 1/s1**2
+        b = 2*(m1/s1**2 - m0/s0**2)
+        c = m0**2/s0**2 - m1**2/s1**2 - 2*np.log(s1/s0)
+        root = np.sqrt(b**2 - 4*a*c)
+        x0 = (-b - root) / (2*a)
+        x1 = (-b + root) / (2*a)
+        lower, upper = np.minimum(x0, x1), np.maximum(x0, x1)
+        overlap = ndtr((lower - m0)/s0) + ndtr((m0 - upper)/s0) \
+                + ndtr((upper - m1)/s1) - ndtr((lower - m1)/s1)
+        # equal widths: a single crossing half way between the means
+        equal = np.isclose(s0, s1, rtol=1e-12, atol=0)
+        overlap = np.where(equal, 2*ndtr(-np.abs(m1 - m0) / (2*s0)), overlap)
+    return np.where(np.isfinite(m0 + m1 + s0 + s1) & (s0 > 0), overlap, np.nan)
+
+
+def chunk_diagnostics(dsObs, dsSim, grid, simParams):
+    '''
+    KS comparison of the renormalised observations and simulations and the overlap of their
+    parameter distributions for one chunk of the grid (runs in a worker process).
+    '''
+    from .developing_process import Fitted_Obs_Sim
+
+    model = Fitted_Obs_Sim(dsObs, dsSim, grid, simParams = simParams, preProcess = False)
+    ks = model.ks_compare()
+    return xr.merge([
+        ks.test.rename('KS_test'),
+        ks.statistic.rename('KS_statistic'),
+        model.calculate_overlap().rename('overlap'),
+    ])
+
+
+@click.command("diagnostics", short_help="Goodness-of-fit diagnostics for each dataset")
+@click.option(
+    "--dataset",
+    "dataset_names",
+    multiple=True,
+    type=click.Choice(list(datasets)),
+    help="Dataset to check (default: all datasets).",
+)
+@click.option("--output-dir", default='.', show_default=True, help="Directory for the NetCDF files.")
+@click.option("--chunk-size", default=16, show_default=True, help="Side length of the spatial chunks in cells.")
+@click.option("--workers", default=os.cpu_count(), show_default=True, help="Number of worker processes.")
+def diagnostics(dataset_names, output_dir, chunk_size, workers):
+    '''Compare the observations and simulations of each dataset: a KS test of the renormalised
+    data and the overlap of the fitted parameter distributions, written to <dataset>_diagnostics.nc.'''
+    from .developing_process import open_composite_inputs
+    from .tiling import X_DIM, Y_DIM, tile_slices
+
+    simParams = ['c', 'loc1', 'scale0', 'scale1']
+    os.makedirs(output_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for dataset_name in dataset_names or datasets:
+            dsObs, dsSim, grid = [ds.transpose(X_DIM, Y_DIM, ...) for ds in open_composite_inputs(dataset_name)]
+            futures = []
+            for xs, ys in tile_slices((grid.sizes[X_DIM], grid.sizes[Y_DIM]), chunk_size):
+                chunk = {X_DIM: xs, Y_DIM: ys}
+                futures.append(pool.submit(chunk_diagnostics,
+                    dsObs.isel(chunk).load(), dsSim.isel(chunk).load(), grid.isel(chunk).load(), simParams))
+            result = xr.combine_by_coords([future.result() for future in futures])
+            result.attrs['dataset'] = dataset_name
+            path = os.path.join(output_dir, f'{dataset_name}_diagnostics.nc')
+            result.to_netcdf(path)
+            click.echo(f"{dataset_name}: wrote {path}")
+
+
+def init_app(app):
+    '''Register the diagnostics command with the Flask application.'''
+    app.cli.add_command(diagnostics)
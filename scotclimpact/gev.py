@@ -0,0 +1,99 @@
+'''
+Closed-form kernels for the generalised extreme value (GEV) distribution.
+
+The shape parameter `c` uses the same sign convention as scipy.stats.genextreme
+(c > 0 has a finite upper bound) and c == 0 is the Gumbel limit. Arguments
+broadcast like NumPy ufuncs and each kernel accepts an optional `out` array, so
+results can be written in place into preallocated buffers.
+'''
+import numpy as np
+
+
+def _output(out, *args):
+    '''Returns `out` or allocates a new array with the broadcast shape and dtype of args.'''
+    if out is not None:
+        return out
+    shape = np.broadcast_shapes(*(np.shape(arg) for arg in args))
+    dtype = np.result_type(*args)
+    if not np.issubdtype(dtype, np.floating):
+        dtype = np.float64
+    return np.empty(shape, dtype=dtype)
+
+
+def _invalid_scale(out, scale):
+    '''Set entries with a non-positive scale parameter to NaN (as scipy does).'''
+    invalid = np.asarray(scale) <= 0
+    if invalid.any():
+        np.copyto(out, np.nan, where=invalid)
+    return out
+
+
+def _reduced_exceedance(x, c, loc, scale, out):
+    '''
+    Calculates t(x) = (1 - c*(x-loc)/scale)**(1/c), or exp(-(x-loc)/scale) for c == 0,
+    so that cdf = exp(-t) and sf = 1 - exp(-t).
+    '''
+    c = np.asarray(c)
+    np.subtract(x, loc, out=out)
+    np.divide(out, scale, out=out)
+    gumbel = np.broadcast_to(c == 0, out.shape)
+    has_gumbel = gumbel.any()
+    if has_gumbel:
+        t_gumbel = np.exp(-out[gumbel])
+
+    np.multiply(out, c, out=out)
+    np.negative(out, out=out)
+    # Values outside the support: above the upper bound (c > 0) or below the lower bound (c < 0)
+    outside = out <= -1
+    np.log1p(out, out=out, where=~outside)
+    np.divide(out, c, out=out, where=~gumbel if has_gumbel else True)
+    np.exp(out, out=out)
+    if outside.any():
+        np.copyto(out, np.where(c > 0, 0.0, np.inf), where=outside)
+
+    if has_gumbel:
+        out[gumbel] = t_gumbel
+    return _invalid_scale(out, scale)
+
+
+def cdf(x, c, loc, scale, out=None):
+    '''Cumulative distribution function of the GEV distribution.'''
+    out = _output(out, x, c, loc, scale)
+    _reduced_exceedance(x, c, loc, scale, out)
+    np.negative(out, out=out)
+    return np.exp(out, out=out)
+
+
+def sf(x, c, loc, scale, out=None):
+    '''Survival function (1 - cdf) of the GEV distribution.'''
+    out = _output(out, x, c, loc, scale)
+    _reduced_exceedance(x, c, loc, scale, out)
+    np.negative(out, out=out)
+    np.expm1(out, out=out)
+    return np.negative(out, out=out)
+
+
+def ppf(q, c, loc, scale, out=None):
+    '''Percent point function (inverse of the cdf) of the GEV distribution.'''
+    c = np.asarray(c)
+    out = _output(out, q, c, loc, scale)
+    # out = log(-log(q))
+    np.log(q, out=out)
+    np.negative(out, out=out)
+    np.log(out, out=out)
+    gumbel = np.broadcast_to(c == 0, out.shape)
+    has_gumbel = gumbel.any()
+    if has_gumbel:
+        ppf_gumbel = -out[gumbel]
+
+    # (1 - (-log(q))**c) / c
+    np.multiply(out, c, out=out)
+    np.expm1(out, out=out)
+    np.negative(out, out=out)
+    np.divide(out, c, out=out, where=~gumbel if has_gumbel else True)
+
+    if has_gumbel:
+        out[gumbel] = ppf_gumbel
+    np.multiply(out, scale, out=out)
+    np.add(out, loc, out=out)
+    return _invalid_scale(out, scale)
@@ -47,12 +47,15 @@ A dictionary containing functions that calculate hazard data.
 The values are names used by routes.py and db.py to find a relavant
 function. Values are dictionaries and must contain the following:
 
+Hazards may also give a sweep_function, which evaluates function for all
+values of the last argument in one call (used by db.pre_compute).
 '''
 hazards = {
     ## Extreme temperatures
     'extreme_temp_intensity': dict(
         dataset='extreme_temp',
         function=developing_process.intensity_from_return_time,
+        sweep_function=developing_process.intensity_from_return_times,
         ci_report_function=developing_process.intensity_ci_report,
         ci_report_url = 'data/ci_report/extreme_temp_intensity/{x}/{y}?covariate={covariate}&return_time={return_time}',
         calculation_dropdown_label="Hottest temperature expected to be exceeded in # years.",
@@ -102,6 +105,7 @@ hazards = {
     'extreme_temp_return_time': dict(
         dataset='extreme_temp',
         function=developing_process.return_time_from_intensity,
+        sweep_function=developing_process.return_times_from_intensities,
         ci_report_function=developing_process.return_time_ci_report,
         ci_report_url = 'data/ci_report/extreme_temp_return_time/{x}/{y}?covariate={covariate}&intensity={intensity}',
         calculation_dropdown_label="Expected return time of hottest temperature.",
@@ -152,6 +156,7 @@ hazards = {
     'sustained_3day_Tmin_intensity': dict(
         dataset='sustained_3day_Tmin_intensity',
         function=developing_process.intensity_from_return_time,
+        sweep_function=developing_process.intensity_from_return_times,
         ci_report_function=developing_process.intensity_ci_report,
         ci_report_url = 'data/ci_report/sustained_3day_Tmin_intensity/{x}/{y}?covariate={covariate}&return_time={return_time}',
         calculation_dropdown_label="Highest 3-day sustained heat expected to be exceeded in # years.",
@@ -201,6 +206,7 @@ hazards = {
     'sustained_3day_Tmin_return_time': dict(
         dataset='sustained_3day_Tmin_intensity',
         function=developing_process.return_time_from_intensity,
+        sweep_function=developing_process.return_times_from_intensities,
         ci_report_function=developing_process.return_time_ci_report,
         ci_report_url = 'data/ci_report/sustained_3day_Tmin_return_time/{x}/{y}?covariate={covariate}&intensity={intensity}',
         calculation_dropdown_label="Expected return time of highest 3-day sustained heat.",
@@ -251,6 +257,7 @@ hazards = {
     'extreme_1day_precip_intensity': dict(
         dataset='extreme_1day_precip',
         function=developing_process.intensity_from_return_time,
+        sweep_function=developing_process.intensity_from_return_times,
         ci_report_function=developing_process.intensity_ci_report,
         ci_report_url = 'data/ci_report/extreme_1day_precip_intensity/{x}/{y}?covariate={covariate}&return_time={return_time}',
         calculation_dropdown_label="Highest 1-day rainfall expected to be exceeded in # years.",
@@ -301,6 +308,7 @@ hazards = {
     'extreme_1day_precip_return_time': dict(
         dataset='extreme_1day_precip',
         function=developing_process.return_time_from_intensity,
+        sweep_function=developing_process.return_times_from_intensities,
         ci_report_function=developing_process.return_time_ci_report,
         ci_report_url = 'data/ci_report/extreme_1day_precip_return_time/{x}/{y}?covariate={covariate}&intensity={intensity}',
         calculation_dropdown_label="Expected return time of highest 1-day rainfall.",
@@ -352,6 +360,7 @@ hazards = {
     'extreme_3day_precip_intensity': dict(
         dataset='extreme_3day_precip',
         function=developing_process.intensity_from_return_time,
+        sweep_function=developing_process.intensity_from_return_times,
         ci_report_function=developing_process.intensity_ci_report,
         ci_report_url = 'data/ci_report/extreme_3day_precip_intensity/{x}/{y}?covariate={covariate}&return_time={return_time}',
         calculation_dropdown_label="Highest 3-day rainfall expected to be exceeded in # years.",
@@ -402,6 +411,7 @@ hazards = {
     'extreme_3day_precip_return_time': dict(
         dataset='extreme_3day_precip',
         function=developing_process.return_time_from_intensity,
+        sweep_function=developing_process.return_times_from_intensities,
         ci_report_function=developing_process.return_time_ci_report,
         ci_report_url = 'data/ci_report/extreme_3day_precip_return_time/{x}/{y}?covariate={covariate}&intensity={intensity}',
         calculation_dropdown_label="Expected return time of highest 3-day rainfall.",
@@ -450,3 +460,12 @@ hazards = {
     ),
 }
 
+
+def hazard_covariates(dataset_name):
+    '''The covariates (global temperature anomalies) that the hazards of a dataset accept.'''
+    return sorted({
+        value
+        for hazard in hazards.values() if hazard['dataset'] == dataset_name
+        for arg_name, values in zip(hazard['arg_names'], hazard['args']) if arg_name.startswith('covariate')
+        for value in values
+    })
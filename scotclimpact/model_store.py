@@ -0,0 +1,221 @@
+'''
+Fitted models shared between worker processes through shared memory.
+
+With SHARED_MODEL_STORE set, the first process that needs a model builds it
+and publishes it: the model is pickled with its numpy arrays as out-of-band
+buffers (pickle protocol 5), the buffers are copied into one
+multiprocessing.shared_memory segment per model, and the remaining pickle,
+which only holds the structure of the model, is written to a catalog entry
+in MODEL_STORE_DIR together with the offsets of the arrays. Every process,
+including the publisher, then loads the model from the catalog with its
+arrays as read-only views of the segment, so the memory of a model is used
+once on the machine rather than once per worker.
+
+Segments outlive the processes that use them and are removed by
+`flask model-store-clear`. Models are identified by their registry key
+(see developing_process.composite_fit_key) and the store settings (the
+format of the store, the data version and the configuration that changes
+the models built for a key); entries of other settings are removed when
+the app starts.
+
+The segments live in /dev/shm, which Docker limits to 64MB by default:
+containers serving from the store need a larger --shm-size (see
+docker/docker-compose.yml).
+'''
+import fcntl
+import hashlib
+import os
+import pickle
+import secrets
+import stat
+import threading
+
+import click
+from flask import current_app
+from multiprocessing import resource_tracker, shared_memory
+
+from .data import DATA_REPO_VERSION, temporary_path
+
+# Offsets of the arrays in a segment are aligned for vectorised loads
+ALIGNMENT = 64
+
+# Version of the layout of the catalog entries and segments, increased when it changes
+STORE_FORMAT_VERSION = 2
+
+# Segments attached by this process by name, which keep their memory mapped while models use them
+attached = dict()
+attached_lock = threading.Lock()
+
+
+def store_settings(config):
+    '''The format of the store, the data version and the settings of an app that change the models built for a key.'''
+    return (STORE_FORMAT_VERSION, DATA_REPO_VERSION, config['BOOTSTRAP_SEED'],
+            config['COVARIATE_LATTICE'], config['COVARIATE_LATTICE_MAX_BYTES'])
+
+
+def model_name(key, settings = ()):
+    '''Name of the catalog entry of a model, unique per registry key and store settings.'''
+    return 'scotclimpact_' + hashlib.sha1(repr((settings, key)).encode('utf-8')).hexdigest()[:16]
+
+
+def entry_path(catalogDir, key, settings = ()):
+    return os.path.join(catalogDir, model_name(key, settings) + '.pkl')
+
+
+def check_catalog_dir(catalogDir):
+    '''
+    Create the catalog directory if needed and check that it is a directory of this user that no one else can
+    write to, as its entries are unpickled: entries written by another user (as into a directory another user
+    created first in /tmp) could run their code in the workers.
+    '''
+    os.makedirs(catalogDir, mode = 0o700, exist_ok = True)
+    status = os.lstat(catalogDir)
+    if not stat.S_ISDIR(status.st_mode) or status.st_uid != os.getuid() or status.st_mode & 0o022:
+        raise PermissionError('the model store directory %s must be a directory owned by this user '
+                              'that the group and others cannot write to' % catalogDir)
+
+
+def untrack(segment):
+    '''
+    Stop the resource tracker of this process from removing the segment when the process exits,
+    as the segment is shared with the other workers (attaching registers it as well before Python 3.13).
+    '''
+    resource_tracker.unregister(segment._name, 'shared_memory')
+
+
+class Attached_Segment(shared_memory.SharedMemory):
+    def __del__(self):
+        '''
+        attached segments stay mapped until the process exits, as the arrays of the models are views of their memory
+        (closing a mapping with views raises a BufferError, as at interpreter shutdown)
+        '''
+        pass
+
+
+def attach_segment(name):
+    with attached_lock:
+        if name not in attached:
+            segment = Attached_Segment(name = name)
+            untrack(segment)
+            attached[name] = segment
+        return attached[name]
+
+
+def publish(catalogDir, key, model, settings = ()):
+    '''Copy the arrays of a model into a new shared memory segment and write its catalog entry.'''
+    buffers = []
+    data = pickle.dumps(model, protocol = 5, buffer_callback = buffers.append)
+    raw = [buffer.raw() for buffer in buffers]
+
+    sizes   = [view.nbytes for view in raw]
+    offsets = []
+    nbytes  = 0
+    for view in raw:
+        offsets.append(nbytes)
+        nbytes += -(-view.nbytes // ALIGNMENT) * ALIGNMENT
+
+    # a new name for every segment, so a model published again never meets a stale segment
+    segment = shared_memory.SharedMemory(name = '%s_%s' % (model_name(key, settings), secrets.token_hex(4)),
+                                         create = True, size = max(nbytes, 1))
+    untrack(segment)
+    for view, offset in zip(raw, offsets):
+        segment.buf[offset:offset + view.nbytes] = view
+        view.release()
+
+    entry = dict(key = repr(key), settings = settings, segment = segment.name, offsets = offsets,
+                 sizes = sizes, model = data)
+    segment.close()
+    path = entry_path(catalogDir, key, settings)
+    tmp_path = temporary_path(path)
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(entry, f)
+    os.replace(tmp_path, path)
+
+
+def attach(catalogDir, key, settings = ()):
+    '''
+    The model for key with its arrays as read-only views of its shared memory segment,
+    or None if it is not in the catalog or its segment no longer exists (as after a restart of the machine).
+    '''
+    path = entry_path(catalogDir, key, settings)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        entry = pickle.load(f)
+    try:
+        segment = attach_segment(entry['segment'])
+    except FileNotFoundError:
+        return None
+    buf = segment.buf.toreadonly()
+    return pickle.loads(entry['model'], buffers = [buf[offset:offset + size]
+                                                  for offset, size in zip(entry['offsets'], entry['sizes'])])
+
+
+def shared_model(catalogDir, key, build, settings = ()):
+    '''
+    The model for key from the shared store, calling build() and publishing the model if it is not there yet.
+    A lock file per model makes concurrent workers wait for the first one to publish it instead of building it too.
+    '''
+    check_catalog_dir(catalogDir)
+    with open(os.path.join(catalogDir, model_name(key, settings) + '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        model = attach(catalogDir, key, settings)
+        if type(model) == type(None):
+            publish(catalogDir, key, build(), settings)
+            model = attach(catalogDir, key, settings)
+    return model
+
+
+def clear_entries(catalogDir, keep = None):
+    '''
+    Unlink the shared memory segments of the catalog entries in catalogDir and remove the entries,
+    except those published with the store settings keep. Returns the keys of the removed entries.
+    Entries that cannot be read (as from an older format of the store) are removed as well.
+    '''
+    removed = []
+    if not os.path.isdir(catalogDir):
+        return removed
+    check_catalog_dir(catalogDir)
+    for filename in sorted(os.listdir(catalogDir)):
+        if not filename.endswith('.pkl'):
+            continue
+        path = os.path.join(catalogDir, filename)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            entry = dict(key = filename)
+        if type(keep) != type(None) and entry.get('settings') == keep:
+            continue
+        if 'segment' in entry:
+            try:
+                segment = shared_memory.SharedMemory(name = entry['segment'])
+                segment.close()
+                segment.unlink()
+            except FileNotFoundError:
+                pass
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        removed.append(entry['key'])
+    return removed
+
+
+@click.command("model-store-clear", short_help="Remove the models in the shared model store")
+def model_store_clear():
+    '''Unlink the shared memory segments of the models in MODEL_STORE_DIR and remove their catalog entries.
+    Workers that attached a model keep using it until they exit.'''
+    for key in clear_entries(current_app.config['MODEL_STORE_DIR']):
+        click.echo(f"removed {key}")
+
+
+def init_app(app):
+    '''
+    Register the model store command with the Flask application and, with SHARED_MODEL_STORE set,
+    remove the models published with other store settings (as by an earlier data version or seed).
+    '''
+    app.cli.add_command(model_store_clear)
+    if app.config['SHARED_MODEL_STORE']:
+        for key in clear_entries(app.config['MODEL_STORE_DIR'], keep = store_settings(app.config)):
+            app.logger.info(f"Removed stale model {key} from the shared model store")
@@ -0,0 +1,93 @@
+'''
+Hazard results aggregated over the regions of a boundary layer.
+
+The weight of a grid cell in a region is the area of their intersection, so
+the mean of a result over a region is a sparse matrix-vector product of the
+(regions, cells) weight matrix with the flattened result, divided by the
+area of the region covered by cells with values. The weight matrix of a
+layer and grid is found once with a spatial index of the cells, saved with
+the data version and kept in memory.
+'''
+import functools
+import os
+
+from flask import current_app
+import numpy as np
+import scipy.sparse
+import shapely
+
+from .boundary_layer import cell_boxes, get_boundary_geometries, grid_name
+from .data import DATA_REPO_VERSION, temporary_path
+
+
+def region_weights_path(layer_name, x_coords, y_coords):
+    '''Location of the weight matrix of a boundary layer and grid for the current data version.'''
+    return os.path.join(current_app.config['DATA_DIR'], DATA_REPO_VERSION, 'region_weights',
+                        f'{layer_name}_{grid_name(x_coords, y_coords)}.npz')
+
+
+def compute_region_weights(regions, x_coords, y_coords):
+    '''
+    Sparse (regions, cells) matrix of the areas of intersection of regions with the cells of a grid,
+    with the cells in the order of cell_boxes(x_coords, y_coords).ravel(). Cells that only touch a region
+    are left out, rather than stored with a zero weight that would turn an infinite value into NaN.
+    '''
+    boxes = cell_boxes(x_coords, y_coords).ravel()
+    regions = np.asarray(regions)
+    region_idx, cell_idx = shapely.STRtree(boxes).query(regions, predicate='intersects')
+    areas = shapely.area(shapely.intersection(regions[region_idx], boxes[cell_idx]))
+    overlap = areas > 0
+    return scipy.sparse.csr_matrix((areas[overlap], (region_idx[overlap], cell_idx[overlap])),
+                                   shape=(len(regions), len(boxes)))
+
+
+def region_weights(layer_name, x_coords, y_coords):
+    '''The weight matrix of a boundary layer and grid.'''
+    return _region_weights(layer_name, tuple(map(float, x_coords)), tuple(map(float, y_coords)))
+
+
+@functools.lru_cache(maxsize=32)
+def _region_weights(layer_name, x_coords, y_coords):
+    path = region_weights_path(layer_name, x_coords, y_coords)
+    if os.path.exists(path):
+        weights = scipy.sparse.load_npz(path)
+        weights.eliminate_zeros()
+        return weights
+    _, geometries, _ = get_boundary_geometries(layer_name)
+    weights = compute_region_weights(shapely.make_valid(geometries), np.array(x_coords), np.array(y_coords))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = temporary_path(path)
+    with open(tmp_path, 'wb') as file:
+        scipy.sparse.save_npz(file, weights)
+    os.replace(tmp_path, path)
+    return weights
+
+
+def region_means(weights, values):
+    '''
+    Area-weighted means over each region of values on the cells of the weight matrix, ignoring cells without
+    a value (NaN). Regions without any cell with a value get NaN.
+    '''
+    values = np.ravel(values)
+    valid = ~np.isnan(values)
+    totals = weights @ np.where(valid, values, 0.0)
+    areas = weights @ valid.astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(areas > 0, totals / areas, np.nan)
+
+
+def aggregate_regions(layer_name, result, x_key='projection_x_coordinate', y_key='projection_y_coordinate'):
+    '''The area-weighted means of a 2D hazard result over the regions of a boundary layer,
+    as a list of the properties of each region with its value.'''
+    result = result.transpose(x_key, y_key)
+    weights = region_weights(layer_name, result[x_key].values, result[y_key].values)
+    means = region_means(weights, result.values)
+    geojson, _, _ = get_boundary_geometries(layer_name)
+    return [
+        dict(
+            properties=feature['properties'],
+            # like xarray_to_geojson, infinite values are shown as 10000
+            data=None if np.isnan(mean) else (10000 if mean == float("inf") else float(mean)),
+        )
+        for feature, mean in zip(geojson['features'], means)
+    ]
@@ -0,0 +1,152 @@
+'''
+Registry of the fitted models (Fitted_Obs_Sim) used by a worker.
+
+Models are kept until the memory they use exceeds a byte budget
+(MODEL_REGISTRY_MAX_BYTES), after which the least recently used models are
+evicted. The memory of a model is the size of the arrays it holds, counting
+arrays that share memory (views, broadcasts) once and arrays over memory owned
+elsewhere, as memory maps in the OS page cache and shared memory segments
+(see model_store.py), not at all.
+'''
+from collections import OrderedDict
+from concurrent.futures import Future
+import threading
+
+import numpy as np
+import xarray as xr
+
+
+def reachable_arrays(obj, seen=None):
+    '''
+    The numpy arrays reachable from obj: an array, xarray object, Covariate_Fit, Fitted_Obs_Sim
+    or a list, tuple or dict of those. Each object is visited once.
+    '''
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        yield obj
+    elif isinstance(obj, (xr.Dataset, xr.DataArray)):
+        variables = obj.variables.values() if isinstance(obj, xr.Dataset) \
+                    else [obj.variable, *obj.coords.variables.values()]
+        # variable.data would load lazily opened variables, so only follow those already in memory
+        for variable in variables:
+            if isinstance(variable._data, np.ndarray):
+                yield from reachable_arrays(variable._data, seen)
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            yield from reachable_arrays(item, seen)
+    elif isinstance(obj, dict):
+        for item in obj.values():
+            yield from reachable_arrays(item, seen)
+    elif hasattr(obj, '__dict__'):
+        for item in vars(obj).values():
+            yield from reachable_arrays(item, seen)
+
+
+def array_nbytes(obj):
+    '''
+    Bytes of memory owned by the numpy arrays reachable from obj (see reachable_arrays).
+    '''
+    nbytes = 0
+    bases = set()
+    for array in reachable_arrays(obj):
+        base = array
+        while isinstance(base.base, np.ndarray):
+            base = base.base
+        if not base.flags.owndata or id(base) in bases:
+            continue
+        bases.add(id(base))
+        # broadcast arrays (zero strides) only own the memory of their non-broadcast dimensions
+        nbytes += base.itemsize * int(np.prod([n for n, stride in zip(base.shape, base.strides) if stride != 0]))
+    return nbytes
+
+
+class Model_Registry():
+    def __init__(self):
+        '''
+        least recently used models by key, with their sizes in bytes, and the futures of the models being built
+        '''
+        self.models    = OrderedDict()
+        self.building  = dict()
+        self.lock      = threading.Lock()
+        self.hits      = 0
+        self.misses    = 0
+        self.waits     = 0
+        self.evictions = 0
+
+    def get(self, key, build, maxBytes = None):
+        '''
+        the model for key, calling build() to create it if it is not in the registry.
+        Models are built without holding the lock, so other models are served while one is built;
+        concurrent requests for a model that is being built wait for that build (and get its exception if it fails)
+        instead of building it again.
+        '''
+        with self.lock:
+            if key in self.models:
+                self.hits += 1
+                self.models.move_to_end(key)
+                return self.models[key][0]
+            future = self.building.get(key)
+            if type(future) == type(None):
+                self.misses += 1
+                future = self.building[key] = Future()
+                owner  = True
+            else:
+                self.waits += 1
+                owner  = False
+        if not owner:
+            return future.result()
+
+        try:
+            model  = build()
+            nbytes = array_nbytes(model)
+        except BaseException as e:
+            with self.lock:
+                del self.building[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            del self.building[key]
+            self.models[key] = (model, nbytes)
+            self.evict(maxBytes)
+        future.set_result(model)
+        return model
+
+    def evict(self, maxBytes):
+        '''
+        remove the least recently used models until the registry is within maxBytes,
+        always keeping the most recent model
+        '''
+        while type(maxBytes) != type(None) and len(self.models) > 1 and self.nbytes() > maxBytes:
+            self.models.popitem(last = False)
+            self.evictions += 1
+
+    def __contains__(self, key):
+        return key in self.models
+
+    def nbytes(self):
+        return sum(nbytes for _, nbytes in self.models.values())
+
+    def clear(self):
+        with self.lock:
+            self.models.clear()
+
+    def stats(self):
+        '''
+        counters and the current contents of the registry
+        '''
+        with self.lock:
+            return dict(
+                hits      = self.hits,
+                misses    = self.misses,
+                waits     = self.waits,
+                evictions = self.evictions,
+                nbytes    = self.nbytes(),
+                models    = {', '.join(map(str, key)): nbytes for key, (_, nbytes) in self.models.items()},
+            )
+
+
+registry = Model_Registry()
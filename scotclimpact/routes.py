@@ -1,8 +1,9 @@
 from collections import namedtuple
-from functools import partial
+from functools import lru_cache, partial
 import io
 import json
 import markdown
+import numpy as np
 import os
 
 from flask import current_app as app
@@ -12,9 +13,13 @@ from . import db
 from .developing_process import (
     init_composite_fit,
 )
-from .data_helpers import xarray_to_geojson, is_number, validate_args, str_lower
-from .boundary_layer import is_valid_boundary_layer, get_boundary_layer
+from .data import datasets
+from .data_helpers import xarray_to_geojson, xarray_to_values, grid_to_geojson, is_number, validate_args, str_lower
+from .boundary_layer import is_valid_boundary_layer, get_boundary_asset, grid_name, BOUNDARY_DETAILS, Compressed_Asset
 from .cache import get_cache
+from .regions import aggregate_regions
+from .registry import registry
+from .warmup import serving_fit, model_status as warm_status
 from .hazards import (ui_selection, hazards)
 
 def menu_items():
@@ -98,7 +103,40 @@ def make_csv_response(dataset, endpoint_name, params):
     )
 
 
-SUPPORTED_FORMATS = ['geojson', 'netcdf', 'csv']
+def make_values_response(values, output, grid):
+    '''Return the values of xarray_to_values as little-endian float32 bytes, or as JSON (with null for NaN),
+    naming the grid of their cells (see get_grid) in the X-Grid header and the JSON.'''
+    if output == 'json':
+        response = make_json_response(dict(
+            grid_size=grid.size,
+            grid=grid.name,
+            # the shortest decimals that read back to the same float32
+            values=[None if np.isnan(value) else float(str(value)) for value in values],
+        ))
+    else:
+        response = make_response(values.astype('<f4').tobytes())
+        response.mimetype = 'application/octet-stream'
+        response.headers.add('Access-Control-Allow-Origin', '*')
+    response.headers['X-Grid'] = grid.name
+    return response
+
+
+def make_asset_response(asset, max_age):
+    '''Return a Compressed_Asset compressed as accepted by the client, cached publicly for max_age seconds
+    and answered with 304 Not Modified if the client has it.'''
+    encoding, content, etag = asset.representation(request.accept_encodings)
+    response = make_response(content)
+    response.mimetype = 'application/json'
+    if encoding != 'identity':
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response.make_conditional(request)
+
+
+SUPPORTED_FORMATS = ['geojson', 'netcdf', 'csv', 'values']
 
 def is_supported_format(fmt):
     '''Predicate to check if fmt is a supported data format'''
@@ -116,10 +154,60 @@ def make_data_response(dataset, format, endpoint_name, params, ci_report_url):
 
 
 @app.route('/boundaries/<layer_name>')
-@get_cache().cached(timeout=50)
 @validate_args(('layer_name', is_valid_boundary_layer, str))
 def bondaries_local_authorities(layer_name):
-    return get_boundary_layer(layer_name)
+    '''A boundary layer at the level of detail of the `detail` query parameter (see BOUNDARY_DETAILS),
+    compressed as accepted by the client and answered with 304 Not Modified if the client has it.'''
+    detail = request.args.get('detail', 'full')
+    if detail not in BOUNDARY_DETAILS:
+        return "Invalid arguments", 400
+
+    return make_asset_response(get_boundary_asset(layer_name, detail), app.config['BOUNDARY_CACHE_MAX_AGE'])
+
+
+Grid = namedtuple("Grid", "size name ids asset")
+
+@lru_cache(maxsize=None)
+def get_grid(grid_size):
+    '''
+    The grid of a grid size, built once per process from the grid of the first dataset of that size, as for
+    the geometries table of the database: its name (see grid_name, a hash of its coordinates), the geometry
+    ids of its cells and its cells as GeoJSON (see grid_to_geojson), named in the `grid` member.
+    '''
+    dataset_name = next(name for name, dataset in datasets.items() if dataset['grid_size'] == grid_size)
+    composite_fit = init_composite_fit(
+        dataset_name,
+        **serving_fit(),
+    )
+    name = grid_name(composite_fit.grid['projection_x_coordinate'].to_numpy(),
+                     composite_fit.grid['projection_y_coordinate'].to_numpy())
+    geojson = dict(grid_to_geojson(grid_size, composite_fit.grid), grid=name)
+    ids = np.array([feature['id'] for feature in geojson['features']], dtype=np.int64)
+    return Grid(grid_size, name, ids, Compressed_Asset(json.dumps(geojson, separators=(',', ':')).encode('utf-8')))
+
+
+def check_grid(grid, result, dataset_name):
+    '''Fail if a hazard result is not on the coordinates of the grid its values are served for.'''
+    name = grid_name(result['projection_x_coordinate'].to_numpy(), result['projection_y_coordinate'].to_numpy())
+    if name != grid.name:
+        raise ValueError(f"The grid of {dataset_name} ({name}) is not the {grid.size}km grid {grid.name} "
+                         "of the values format, its datasets should share their coordinates")
+
+
+@app.route('/data/grid/<grid_size>')
+def grid(grid_size):
+    '''
+    The cells of a grid (grid size in km) with their geometry ids and (x, y) indices, in the order of the values
+    of the `values` format of the data endpoint. They only change with the data, so clients fetch them once
+    per grid and only fetch values as the arguments change. The grid is named (see get_grid) in the X-Grid
+    header, as are the values.
+    '''
+    if not is_number(grid_size) or not int(grid_size) in {dataset['grid_size'] for dataset in datasets.values()}:
+        return "not found\n", 404
+    grid = get_grid(int(grid_size))
+    response = make_asset_response(grid.asset, app.config['GRID_CACHE_MAX_AGE'])
+    response.headers['X-Grid'] = grid.name
+    return response
 
 
 def parse_and_validate_args(hazard):
@@ -150,12 +238,16 @@ def get_metadata():
         "calculation_description_template",
         "args",
         "legend",
+        "ci_report_url",
     ]
     def trim_for_client(hazard):
-        return {
-            key: hazard.get(key, '')
-            for key in client_keys
-        }
+        return dict(
+            {
+                key: hazard.get(key, '')
+                for key in client_keys
+            },
+            grid_size=datasets[hazard['dataset']]['grid_size'],
+        )
     hazards_ = {
         hazard_name: trim_for_client(hazard)
         for hazard_name, hazard
@@ -167,12 +259,20 @@ def get_metadata():
 
 @app.route('/data/map/<function_name>')
 @app.route('/data/map/<function_name>/<format>')
-@get_cache().cached(timeout=60, query_string=True)
+@get_cache().cached(timeout=app.config['HAZARD_CACHE_TIMEOUT'], query_string=True)
 def data(function_name, format='geojson'):
+    '''
+    A hazard on its grid with quantiles, as GeoJSON, CSV or NetCDF, or only its central estimate as the
+    `values` of the cells of /data/grid/<grid_size>: float32 bytes or, with `output=json`, JSON.
+    '''
 
     if not function_name in hazards:
         return "not found\n", 404
-    if not format in {'geojson', 'csv', 'netcdf'}:
+    if not is_supported_format(format):
+        return "Invalid arguments", 400
+    format = format.lower()
+    output = request.args.get('output', 'binary')
+    if format == 'values' and not output in {'binary', 'json'}:
         return "Invalid arguments", 400
 
     hazard = hazards[function_name]
@@ -184,17 +284,31 @@ def data(function_name, format='geojson'):
         return make_json_response(
             db.get_json_hazard_data(function=function_name, **request.args)
         )
+    if format == 'values':
+        grid = get_grid(datasets[hazard['dataset']]['grid_size'])
+        params = dict(zip(hazard['arg_names'], args))
+        if db.has_results(function=function_name, **params):
+            return make_values_response(db.get_hazard_values(grid.ids, function=function_name, **params), output, grid)
 
     hazard_function = hazard['function']
     composite_fit = init_composite_fit(
         hazard['dataset'],
-        simParams='c,loc1,scale0,scale1',
-        nVariates=1000,
-        preProcess=True,
+        **serving_fit(),
     )
 
+    if format == 'values':
+        # the values are the central estimate, so the bootstrap variates are left out
+        result = hazard_function(composite_fit.central_fit(), *args, mode='fit')
+        check_grid(grid, result, hazard['dataset'])
+        return make_values_response(xarray_to_values(result), output, grid)
+
     quantiles = [0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.975, 0.99]
-    result = hazard_function(composite_fit, *args, format=format, mode='quantiles', quantiles=quantiles)
+    calculate = lambda model, mode: hazard_function(model, *args, format=format, mode=mode, quantiles=quantiles)
+    if app.config['ADAPTIVE_VARIATES']:
+        result = composite_fit.adaptive_quantiles(calculate, quantiles,
+                                                  tolerance=app.config['ADAPTIVE_VARIATES_TOLERANCE'])
+    else:
+        result = calculate(composite_fit, 'quantiles')
     composite_fit.apply_metadata(
         result,
         creator="ScotClimATE",
@@ -207,8 +321,32 @@ def data(function_name, format='geojson'):
     return make_data_response(result, format, function_name, args, ci_report_url)
 
 
+@app.route('/data/region/<function_name>/<layer_name>')
+@get_cache().cached(timeout=app.config['HAZARD_CACHE_TIMEOUT'], query_string=True)
+def region_data(function_name, layer_name):
+    '''The central estimate of a hazard averaged over each region of a boundary layer, weighted by area.'''
+    if not function_name in hazards or not is_valid_boundary_layer(layer_name):
+        return "not found\n", 404
+
+    hazard = hazards[function_name]
+    args = parse_and_validate_args(hazard)
+    if not args:
+        return "Invalid arguments", 400
+
+    composite_fit = init_composite_fit(
+        hazard['dataset'],
+        **serving_fit(),
+    )
+    result = hazard['function'](composite_fit.central_fit(), *args, mode='fit')
+    return make_json_response(dict(
+        name=function_name,
+        layer=layer_name,
+        regions=aggregate_regions(layer_name, result),
+    ))
+
+
 @app.route('/data/ci_report/<function_name>/<x_idx>/<y_idx>')
-@get_cache().cached(timeout=60, query_string=True)
+@get_cache().cached(timeout=app.config['HAZARD_CACHE_TIMEOUT'], query_string=True)
 def ci_report(function_name, x_idx, y_idx):
 
     if not function_name in hazards:
@@ -230,13 +368,30 @@ def ci_report(function_name, x_idx, y_idx):
     ci_report_function = hazard['ci_report_function']
     composite_fit = init_composite_fit(
         hazard['dataset'],
-        simParams='c,loc1,scale0,scale1',
-        nVariates=1000,
-        preProcess=True,
-        intensityUnits=hazard.get('intensityUnits', ''),
+        **serving_fit(),
     )
 
-    result = ci_report_function(composite_fit, *args)
+    tolerance = app.config['ADAPTIVE_VARIATES_TOLERANCE'] if app.config['ADAPTIVE_VARIATES'] else None
+    result = ci_report_function(composite_fit, *args, tolerance=tolerance)
 
     
     return result, 200
+
+
+@app.route('/status/models')
+def model_status():
+    '''Hit, miss and eviction counters and the memory use of the model registry of this worker.'''
+    return make_json_response(registry.stats())
+
+
+@app.route('/ready')
+def ready():
+    '''
+    Readiness of this worker for the load balancer: warm if the serving model of every dataset is in its registry.
+    A cold worker is only reported as unavailable (503) when MODEL_WARMUP is set, as otherwise models are
+    built by the first requests.
+    '''
+    models = warm_status()
+    warm = all(models.values())
+    status = 200 if warm or not app.config['MODEL_WARMUP'] else 503
+    return make_json_response(dict(status='warm' if warm else 'cold', models=models)), status
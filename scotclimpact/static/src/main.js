@@ -16,6 +16,9 @@ function check_disclaimer_cookie() {
 
 var previous_input_values = {};
 var hazard_metadata = {};
+var data_layer_requests = 0;
+/// Requests for the cells of each grid, made once per grid size.
+const grid_requests = {};
 const ui_map = new UIMap('map', tilelayerurl);
 
 /// Helper function to request data points from a URL. 
@@ -25,15 +28,56 @@ async function fetch_data(url) {
     return data;
 }
 
+/// Helper function to request the values of a hazard on the cells of its grid.
+async function fetch_values(url) {
+    let response = await fetch(url);
+    let data = await response.arrayBuffer();
+    return new Float32Array(data);
+}
+
+/// Request the cells of a grid, unless they were requested before.
+function fetch_grid(grid_size) {
+    if (!(grid_size in grid_requests)) {
+        const url = new URL(
+            window.location.protocol + "//" + window.location.host + "/" +
+            window.location.pathname + "/data/grid/" + grid_size
+        );
+        grid_requests[grid_size] = fetch_data(url.href).catch((error) => {
+            delete grid_requests[grid_size];
+            throw error;
+        });
+    }
+    return grid_requests[grid_size];
+}
+
+/// Returns a function of the (x, y) index of a cell that gives the URL of its CI report
+function make_ci_report_url(input_values, hazard_meta) {
+    return (x, y) => {
+        var url = hazard_meta["ci_report_url"].replaceAll("{x}", x).replaceAll("{y}", y);
+        for (const arg_name of hazard_meta["arg_names"]) {
+            url = url.replaceAll("{" + arg_name + "}", input_values["#param_" + arg_name]);
+        }
+        return url;
+    };
+}
+
 async function update_data_layer(input_values, colorbar) {
-    const url_endpoint = make_data_url(input_values, '');
+    const hazard_meta = get_hazard_function_meta(input_values["#scenario"], input_values["#calculation"]);
+    const url_endpoint = make_data_url(input_values, 'values');
     gtag('event', 'update_data_layer', {
         'input_values': input_values,
         'url_endpoint': url_endpoint.href,
     });
     ui_map.hide_overlay();
-    const data = await fetch_data(url_endpoint);
-    ui_map.update_data_layer(data, colorbar);
+    const request = ++data_layer_requests;
+    const [grid, values] = await Promise.all([
+        fetch_grid(hazard_meta["grid_size"]),
+        fetch_values(url_endpoint),
+    ]);
+    // Drop values that arrive after those of a later input
+    if (request != data_layer_requests)
+        return;
+    ui_map.update_data_layer(hazard_meta["grid_size"], grid, values, colorbar, make_ci_report_url(input_values, hazard_meta));
     $("#opacityInput")[0].oninput();
 }
 
@@ -55,6 +99,8 @@ async function update_boundary_layer(layer_name) {
         window.location.protocol + "//" + window.location.host + "/" +
         window.location.pathname + "/boundaries/" + layer_name
     ); 
+    // Boundaries simplified to within about 20m, a fraction of the size of the full resolution files
+    url.searchParams.set('detail', 'high');
 
     gtag('event', 'update_boundary_layer', {
         'layer_name': layer_name,
@@ -43,6 +43,10 @@ export class UIMap {
     #overlay = null;
     #overlay_content = null;
     #selection = {};
+    #data_layers = {};
+    #grid_size = null;
+    #colorbar = null;
+    #ci_report_url = null;
 
     constructor(div_id, tilelayerurl) {
         /// Default view that includes Scotland
@@ -125,7 +129,7 @@ export class UIMap {
         // Fetch ci report
         const ci_report_url =  new URL(
             window.location.protocol + "//" + window.location.host + "/" +
-            window.location.pathname + "/" + feature.values_.ci_report_url
+            window.location.pathname + "/" + this.#ci_report_url(feature.get('x'), feature.get('y'))
         ); 
         let response = await fetch(ci_report_url);
         if (!response.ok)
@@ -151,7 +155,9 @@ export class UIMap {
             return;
         }
 
-        let features = data_layer.getSource().getFeaturesAtCoordinate(coordinate);
+        // Cells without a value are not drawn
+        let features = data_layer.getSource().getFeaturesAtCoordinate(coordinate)
+            .filter((feature) => !isNaN(feature.get('data')));
         if (features.length == 0) {
             let alert_root = $("#alert-root");
             if (alert_root.length == 0)
@@ -221,44 +227,62 @@ export class UIMap {
         this.#map.updateSize();
     }
 
-    /// Update the values shown in the data layer.
-    update_data_layer(data, colorbar) {
-
-        this.hide_overlay();
-
-        data.features.forEach(function(element) {
-            element.properties.data = parseFloat(element.properties.data);
-        })
-
-        const styles = {
-            'Polygon': new Style({
-                fill: new Fill({
-                    color: "#11eeee",
-                }),
+    /// Creates the data layer of a grid, with a feature for each cell of the grid. The features are
+    /// in the order of the values of the grid, which are set by update_data_layer.
+    make_data_layer(grid) {
+        const style = new Style({
+            fill: new Fill({
+                color: "#11eeee",
             }),
-        };
+        });
 
-        const styleFunction = function (feature) {
-            var style = styles[feature.getGeometry().getType()];
-            if (feature.getGeometry().getType() == 'Polygon') {
-                const color_value = apply_color_map(feature.values_.data, colorbar.edges, colorbar.colors, colorbar.endpoint_type);
-                style.getFill().setColor(color_value);
-            }
+        const styleFunction = (feature) => {
+            const value = feature.get('data');
+            // Cells without a value are not drawn
+            if (isNaN(value))
+                return;
+            const colorbar = this.#colorbar;
+            style.getFill().setColor(apply_color_map(value, colorbar.edges, colorbar.colors, colorbar.endpoint_type));
             return style;
         };
 
-        // Update the vector layer
-        const vectorSource = new VectorSource({
-            features: new GeoJSON().readFeatures(data),
-        });
-        this.#layers[this.#data_layer_idx] = new VectorLayer({
-            source: vectorSource,
+        const features = new GeoJSON().readFeatures(grid);
+        const layer = new VectorLayer({
+            source: new VectorSource({
+                features: features,
+            }),
             style: styleFunction,
         });
+        return {features: features, layer: layer};
+    }
 
-        this.update_selection_layer(this.#layers[this.#data_layer_idx], vectorSource);
-        // Reset the map layers
-        this.update_layers()
+    /// Update the values shown in the data layer. The cells of each grid are only read once,
+    /// after that only the values of their features change.
+    update_data_layer(grid_size, grid, values, colorbar, ci_report_url) {
+
+        this.hide_overlay();
+        this.#colorbar = colorbar;
+        this.#ci_report_url = ci_report_url;
+
+        if (!(grid_size in this.#data_layers))
+            this.#data_layers[grid_size] = this.make_data_layer(grid);
+        const data_layer = this.#data_layers[grid_size];
+
+        if (values.length != data_layer.features.length)
+            console.error(`Expected ${data_layer.features.length} values for the ${grid_size}km grid, got ${values.length}`);
+        data_layer.features.forEach(function(feature, i) {
+            // Without change events, the layer is redrawn once below
+            feature.set('data', values[i], true);
+        });
+        data_layer.layer.changed();
+
+        if (this.#grid_size !== grid_size) {
+            this.#grid_size = grid_size;
+            this.#layers[this.#data_layer_idx] = data_layer.layer;
+            this.update_selection_layer(data_layer.layer, data_layer.layer.getSource());
+            // Reset the map layers
+            this.update_layers()
+        }
     }
 
     set_data_layer_opacity(opacity) {
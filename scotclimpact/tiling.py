@@ -0,0 +1,164 @@
+'''
+Chunked calculation of hazard maps for grids that do not fit in memory.
+
+The grid is split into spatial tiles, sized so that the bootstrap arrays of
+one tile stay within a memory budget (TILE_MAX_BYTES). Each tile is loaded
+from the lazily opened input files, evaluated with its own Fitted_Obs_Sim and
+written into the output NetCDF file before the next tile is read, so peak
+memory depends on the budget instead of the size of the grid.
+'''
+import itertools
+
+import click
+from flask import current_app
+import netCDF4
+import numpy as np
+
+from .data import datasets
+from .developing_process import Fitted_Obs_Sim, open_composite_inputs
+from .variates import bootstrap_variates, variates_path, load_variates
+
+X_DIM = 'projection_x_coordinate'
+Y_DIM = 'projection_y_coordinate'
+
+QUANTILES = [0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.975, 0.99]
+
+
+def bytes_per_cell(dsObs, dsSim, grid, nVariates, nParams, dtype='float64'):
+    '''
+    Estimate of the memory needed for one grid cell: its share of the input files, the bootstrap
+    variates and the temporary arrays of a hazard calculation (GEV parameters, results and quantile
+    buffers for two covariates).
+    '''
+    nCells = grid.sizes[X_DIM] * grid.sizes[Y_DIM]
+    inputBytes = sum(ds.nbytes for ds in [dsObs, dsSim, grid]) / nCells
+    return inputBytes + nVariates * np.dtype(dtype).itemsize * (nParams + 16)
+
+
+def tile_size(cellBytes, maxBytes):
+    '''Side length of the largest square tile within maxBytes (at least a single cell).'''
+    return max(1, int(np.sqrt(maxBytes / cellBytes)))
+
+
+def tile_slices(shape, size):
+    '''Yields pairs of slices covering a (nx, ny) grid with tiles of size x size cells.'''
+    for x0, y0 in itertools.product(range(0, shape[0], size), range(0, shape[1], size)):
+        yield slice(x0, min(x0 + size, shape[0])), slice(y0, min(y0 + size, shape[1]))
+
+
+def create_output(path, result, grid):
+    '''Create a NetCDF file with the variables of a tile's result, sized for the whole grid.'''
+    nc = netCDF4.Dataset(path, 'w')
+    for dim in result.dims:
+        coord = grid[dim] if dim in (X_DIM, Y_DIM) else result[dim]
+        nc.createDimension(dim, coord.size)
+        variable = nc.createVariable(dim, coord.dtype, (dim,))
+        variable[:] = coord.values
+        variable.setncatts(coord.attrs)
+    for name, da in result.data_vars.items():
+        variable = nc.createVariable(name, da.dtype, da.dims, fill_value=np.nan)
+        variable.setncatts(da.attrs)
+    nc.setncatts(result.attrs)
+    return nc
+
+
+def compute_tiled(dsObs, dsSim, grid, function, args, path,
+                  maxBytes=512 * 1024**2,
+                  simParams=['c', 'loc1', 'scale0', 'scale1'],
+                  nVariates=1000,
+                  quantiles=QUANTILES,
+                  seed=None,
+                  bsDtype='float64',
+                  sampler='random',
+                  bsVariates=None,
+                  intensityUnits=u"\u00b0C",
+                  metadata=dict()):
+    '''
+    Evaluate a hazard function from hazards.py (e.g. developing_process.intensity_from_return_time) with
+    quantiles over the grid one tile at a time, writing the results to a NetCDF file at path.
+    The inputs are the aligned, lazily opened datasets of open_composite_inputs. If stored bootstrap
+    variates (a memory mapped array) are given, each tile uses its part of them and the results are the
+    same as for the whole grid; otherwise each tile draws its own variates, seeded by the seed and tile position.
+    Returns the number of tiles.
+    '''
+    transpose = lambda ds: ds.transpose(X_DIM, Y_DIM, ...)
+    dsObs, dsSim, grid = transpose(dsObs), transpose(dsSim), transpose(grid)
+    shape = (grid.sizes[X_DIM], grid.sizes[Y_DIM])
+    size = tile_size(bytes_per_cell(dsObs, dsSim, grid, nVariates, dsObs.sizes['params'], bsDtype), maxBytes)
+
+    nc = None
+    nTiles = 0
+    try:
+        for xs, ys in tile_slices(shape, size):
+            tile = {X_DIM: xs, Y_DIM: ys}
+            model = Fitted_Obs_Sim(dsObs.isel(tile), dsSim.isel(tile), grid.isel(tile),
+                                   simParams = simParams, nVariates = nVariates, preProcess = False,
+                                   seed = seed, bsDtype = bsDtype, sampler = sampler,
+                                   intensityUnits = intensityUnits, slim = True)
+            if bsVariates is None:
+                tileSeed = seed if seed is None else [seed, xs.start, ys.start]
+                model.variate_bootstrap_dist(nVariates, seed = tileSeed)
+            else:
+                model.set_bootstrap_variates(np.asarray(bsVariates[xs, ys]))
+
+            result = function(model, *args, format='netcdf', mode='quantiles', quantiles=quantiles)
+            model.apply_metadata(result, other=metadata)
+            if nc is None:
+                nc = create_output(path, result, grid)
+            for name, da in result.data_vars.items():
+                region = tuple(tile.get(dim, slice(None)) for dim in da.dims)
+                nc[name][region] = da.values
+            del model, result
+            nTiles += 1
+    finally:
+        if nc is not None:
+            nc.close()
+    return nTiles
+
+
+@click.command("hazard-compute-tiled", short_help="Calculate a hazard map tile by tile")
+@click.argument("function_name")
+@click.argument("args", nargs=-1)
+@click.option("--output", "path", required=True, help="NetCDF file to write.")
+@click.option("--max-bytes", type=int, default=None, help="Memory budget per tile (default: TILE_MAX_BYTES).")
+@click.option("--n-variates", type=int, default=None, help="Number of variates (default: as served, see BOOTSTRAP_VARIATES).")
+def compute_tiled_cli(function_name, args, path, max_bytes, n_variates):
+    '''Calculate the hazard FUNCTION_NAME (a key of hazards.py) with its ARGS, in the order of its arg_names,
+    for a whole dataset with bounded memory, e.g. `flask hazard-compute-tiled extreme_temp_intensity 2.0 50 --output out.nc`.'''
+    from .hazards import hazards
+
+    if function_name not in hazards:
+        raise click.BadParameter(f"unknown hazard {function_name}")
+    hazard = hazards[function_name]
+    if len(args) != len(hazard['arg_names']):
+        raise click.BadParameter(f"expected arguments {', '.join(hazard['arg_names'])}")
+    args = [hazard['arg_types'][name](value) for name, value in zip(hazard['arg_names'], args)]
+
+    simParams = 'c,loc1,scale0,scale1'
+    n_variates = n_variates or bootstrap_variates(current_app.config)
+    seed = current_app.config['BOOTSTRAP_SEED']
+    dtype = current_app.config['BOOTSTRAP_DTYPE']
+    sampler = current_app.config['BOOTSTRAP_SAMPLER']
+    bsVariates = load_variates(variates_path(
+        current_app.config['DATA_DIR'], hazard['dataset'], simParams, n_variates, seed, dtype, sampler))
+    nTiles = compute_tiled(
+        *open_composite_inputs(hazard['dataset']),
+        hazard['function'],
+        args,
+        path,
+        maxBytes=max_bytes or current_app.config['TILE_MAX_BYTES'],
+        simParams=simParams.split(','),
+        nVariates=n_variates,
+        seed=seed,
+        bsDtype=dtype,
+        sampler=sampler,
+        bsVariates=bsVariates,
+        intensityUnits=datasets[hazard['dataset']]['intensity_units'],
+        metadata=dict(zip(hazard['arg_names'], args)),
+    )
+    click.echo(f"{function_name}: wrote {path} in {nTiles} tiles")
+
+
+def init_app(app):
+    '''Register the tiled calculation command with the Flask application.'''
+    app.cli.add_command(compute_tiled_cli)
@@ -0,0 +1,313 @@
+import click
+import functools
+from flask import current_app
+import numpy as np
+import os
+from scipy.special import ndtri
+from scipy.stats import qmc
+
+from .data import DATA_REPO_VERSION, datasets
+
+# 'random': pseudo-random variates, 'sobol': scrambled Sobol (quasi-Monte Carlo) variates
+SAMPLERS = ('random', 'sobol')
+# Version of the variates each sampler draws for a seed, part of the names of stored variates after the first
+SAMPLER_VERSIONS = dict(random=1, sobol=2)
+
+
+def covariance_factors(cov):
+    '''Factors F with F @ F.T == cov for a stack of covariance matrices with shape (..., p, p).
+    Cholesky factors of all matrices are calculated with one call to np.linalg.cholesky. If some
+    matrices are not positive definite, those use an eigendecomposition with negative eigenvalues
+    clipped to zero. Matrices with non-finite entries get NaN factors.'''
+    factors = np.full(cov.shape, np.nan)
+    valid = np.isfinite(cov).all(axis=(-2, -1))
+    cov = cov[valid]
+    try:
+        factors[valid] = np.linalg.cholesky(cov)
+        return factors
+    except np.linalg.LinAlgError:
+        pass
+
+    eigenvalues, eigenvectors = np.linalg.eigh(cov)
+    positive_definite = eigenvalues.min(axis=-1) > 1e-12 * np.abs(eigenvalues).max(axis=-1)
+    valid_factors = eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))[..., np.newaxis, :]
+    try:
+        valid_factors[positive_definite] = np.linalg.cholesky(cov[positive_definite])
+    except np.linalg.LinAlgError:
+        pass # keep the eigendecomposition for all matrices
+    factors[valid] = valid_factors
+    return factors
+
+
+def sample_multivariate_normal(mean, cov, nVariates, seed=None, dtype=None, sampler='random'):
+    '''Draw nVariates samples from a multivariate normal distribution for every cell of a grid.
+    mean has shape (..., p) and cov (..., p, p); the result has shape (..., nVariates, p).
+    All samples are produced by one matrix multiplication of standard normal variates with the
+    covariance factors. Cells with non-finite mean or covariance give NaN samples.
+    The samples are returned in dtype (float64 or float32, default float64).
+    With sampler='sobol' every cell maps the scrambled Sobol points of sobol_points (their first p columns),
+    with its own random digital shift (an exclusive or of their binary digits with random bits), through the
+    inverse normal CDF and its covariance factors: the points of each cell remain a scrambled Sobol net, also
+    jointly with the unshifted temperature variates of column p, while different cells get different points,
+    so their sampling errors are independent.'''
+    grid_shape, p = mean.shape[:-1], mean.shape[-1]
+    mean = mean.reshape(-1, p)
+    factors = covariance_factors(cov.reshape(-1, p, p))
+    factors[~np.isfinite(mean).all(axis=-1)] = np.nan
+
+    dtype = np.dtype(dtype or np.float64)
+    # Always draw float64 variates, so reduced precision samples round the float64 samples
+    if sampler == 'sobol':
+        shifts = np.random.default_rng(seed).integers(2**32, size=(mean.shape[0], 1, p), dtype=np.uint32)
+        # the points are multiples of 2**-30 (scipy's Sobol), so their digits are exact in 32 bits
+        samples = (sobol_points(nVariates, p + 1, hashable_seed(seed))[:, :p] * 2**32).astype(np.uint32) ^ shifts
+        samples = ndtri((samples + 0.5) * 2.0**-32).astype(dtype, copy=False)
+    else:
+        rng = np.random.default_rng(seed)
+        samples = rng.standard_normal((mean.shape[0], nVariates, p)).astype(dtype, copy=False)
+    samples = np.matmul(samples, np.swapaxes(factors, -1, -2).astype(dtype))
+    samples += mean[:, np.newaxis, :].astype(dtype)
+    return samples.reshape(grid_shape + (nVariates, p))
+
+
+@functools.lru_cache(maxsize=16)
+def standard_normal_variates(nVariates, seed=None, version=DATA_REPO_VERSION, sampler='random', column=0):
+    '''Read-only standard normal variates, memoized per (nVariates, seed, data version).
+    Every covariate is sampled from the same variates (common random numbers), so results are
+    reproducible between requests and comparisons between covariates are not affected by sampling
+    noise. The stream is separate from the bootstrap variates drawn with the same seed.
+    With sampler='sobol' they are the given column of sobol_normal_variates, so that they are jointly
+    low-discrepancy with bootstrap variates of column parameters (use column=p).'''
+    if sampler == 'sobol':
+        # the prefix of a power of two of variates, which the batches of adaptive_quantiles share
+        nPoints = 1 << (nVariates - 1).bit_length()
+        return sobol_normal_variates(nPoints, column + 1, seed, version)[:nVariates, column]
+    rng = np.random.default_rng(None if seed is None else [seed, 1])
+    variates = rng.standard_normal(nVariates)
+    variates.setflags(write=False)
+    return variates
+
+
+def hashable_seed(seed):
+    '''A seed (None, an integer or a sequence of integers) as a memoization key.'''
+    return seed if seed is None or np.isscalar(seed) else tuple(seed)
+
+
+@functools.lru_cache(maxsize=16)
+def sobol_points(nVariates, dimensions, seed=None, version=DATA_REPO_VERSION):
+    '''Read-only points in [0, 1) with shape (nVariates, dimensions) from a scrambled Sobol sequence,
+    memoized per (nVariates, dimensions, seed, data version).
+    Sobol points are best balanced when nVariates is a power of two (e.g. 256, 1024); other numbers of points
+    are the first nVariates of the next power of two, so they are a prefix of the points of larger numbers.'''
+    rng = np.random.default_rng(None if seed is None else [*np.atleast_1d(seed), 2])
+    sobol = qmc.Sobol(dimensions, scramble=True, seed=rng)
+    points = sobol.random_base2((nVariates - 1).bit_length())[:nVariates]
+    points.setflags(write=False)
+    return points
+
+
+@functools.lru_cache(maxsize=16)
+def sobol_normal_variates(nVariates, dimensions, seed=None, version=DATA_REPO_VERSION):
+    '''Read-only standard normal variates with shape (nVariates, dimensions): the points of sobol_points
+    mapped through the inverse normal CDF.'''
+    variates = ndtri(sobol_points(nVariates, dimensions, seed, version))
+    variates.setflags(write=False)
+    return variates
+
+
+def bootstrap_variates(config):
+    '''The number of bootstrap variates of the served models, BOOTSTRAP_VARIATES rounded up to
+    a power of two for Sobol variates (see sobol_normal_variates).'''
+    nVariates = config['BOOTSTRAP_VARIATES']
+    if config['BOOTSTRAP_SAMPLER'] == 'sobol':
+        nVariates = 1 << (nVariates - 1).bit_length()
+    return nVariates
+
+
+def variates_path(data_dir, dataset_name, simParams, nVariates, seed, dtype='float64', sampler='random'):
+    '''Location of the stored bootstrap variates for a dataset and the current data version.'''
+    filename = '%s_%s_n%i_seed%i.npy' % (dataset_name, simParams.replace(',', '-'), nVariates, seed)
+    if np.dtype(dtype) != np.float64:
+        filename = filename.replace('.npy', '_%s.npy' % np.dtype(dtype).name)
+    if sampler != 'random':
+        filename = filename.replace('.npy', '_%s.npy' % sampler)
+    if SAMPLER_VERSIONS[sampler] > 1:
+        filename = filename.replace('.npy', '_v%i.npy' % SAMPLER_VERSIONS[sampler])
+    return os.path.join(data_dir, DATA_REPO_VERSION, 'variates', filename)
+
+
+def save_variates(path, variates):
+    '''Write an array of variates to a .npy file.
+    The file is written under a temporary name first, so readers never open a partial file.'''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    stored = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=variates.dtype, shape=variates.shape)
+    stored[...] = variates
+    stored.flush()
+    del stored
+    os.replace(tmp_path, path)
+
+
+def load_variates(path):
+    '''Open stored variates as a read-only memory mapped array. Returns None if the file does not exist.
+    Memory mapped pages are shared between processes through the OS page cache.'''
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode='r')
+
+
+@click.command("variates-build", short_help="Generate and store bootstrap variates")
+@click.option(
+    "--dataset",
+    "dataset_names",
+    multiple=True,
+    type=click.Choice(list(datasets)),
+    help="Dataset to generate variates for (default: all datasets).",
+)
+@click.option("--sim-params", default='c,loc1,scale0,scale1', show_default=True)
+@click.option("--n-variates", type=int, default=None, help="Number of variates (default: as served, see BOOTSTRAP_VARIATES).")
+@click.option("--force", is_flag=True, help="Overwrite variates that are already stored.")
+def build_variates(dataset_names, sim_params, n_variates, force):
+    '''Generate the bootstrap variates of each dataset once, with a fixed seed, so that
+    init_composite_fit can memory map them instead of sampling on every start.'''
+    from .developing_process import init_composite_fit
+
+    n_variates = n_variates or bootstrap_variates(current_app.config)
+    seed = current_app.config['BOOTSTRAP_SEED']
+    dtype = current_app.config['BOOTSTRAP_DTYPE']
+    sampler = current_app.config['BOOTSTRAP_SAMPLER']
+    for dataset_name in dataset_names or datasets:
+        path = variates_path(current_app.config['DATA_DIR'], dataset_name, sim_params, n_variates, seed, dtype, sampler)
+        if os.path.exists(path) and not force:
+            click.echo(f"{dataset_name}: {path} exists")
+            continue
+        composite_fit = init_composite_fit(
+            dataset_name,
+            simParams=sim_params,
+            nVariates=n_variates,
+            preProcess=False,
+        )
+        composite_fit.variate_bootstrap_dist(n_variates, seed=seed)
+        save_variates(path, composite_fit.bsVariates.values)
+        click.echo(f"{dataset_name}: wrote {path}")
+
+
+@click.command("variates-validate-precision", short_help="Compare float32 bootstrap results with float64")
+@click.option(
+    "--dataset",
+    "dataset_names",
+    multiple=True,
+    type=click.Choice(list(datasets)),
+    help="Dataset to validate (default: all datasets).",
+)
+@click.option("--n-cells", default=20, show_default=True, help="Number of cells to compare CI reports at.")
+def validate_precision(dataset_names, n_cells):
+    '''Report the maximum deviation of the quantile maps and CI reports of each hazard when the
+    bootstrap quantities are calculated in float32 instead of float64 (see BOOTSTRAP_DTYPE).'''
+    from .developing_process import init_composite_fit
+    from .hazards import hazards
+
+    quantiles = [0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.975, 0.99]
+    for func_name, hazard in hazards.items():
+        if dataset_names and hazard['dataset'] not in dataset_names:
+            continue
+        models = [
+            init_composite_fit(
+                hazard['dataset'],
+                simParams='c,loc1,scale0,scale1',
+                nVariates=bootstrap_variates(current_app.config),
+                preProcess=True,
+                bsDtype=dtype,
+            )
+            for dtype in ['float64', 'float32']
+        ]
+        # A representative set of arguments from the middle of each list
+        args = [values[len(values)//2] for values in hazard['args']]
+        reference, reduced = [
+            hazard['function'](model, *args, format='netcdf', mode='quantiles', quantiles=quantiles)
+            for model in models
+        ]
+        name = [name for name in reference.data_vars if name.endswith('_quantiles')][0]
+        finite = np.isfinite(reference[name].values) & np.isfinite(reduced[name].values)
+        deviation = np.abs(reduced[name].values[finite] - reference[name].values[finite])
+        relative = deviation / np.abs(reference[name].values[finite])
+
+        central = reference[name.replace('_quantiles', '')].values
+        cells = np.argwhere(np.isfinite(central))
+        cells = cells[np.linspace(0, len(cells) - 1, min(n_cells, len(cells))).astype(int)]
+        reports_differ = sum(
+            hazard['ci_report_function'](models[0], *args, x, y) != hazard['ci_report_function'](models[1], *args, x, y)
+            for x, y in cells
+        )
+        click.echo(
+            f"{func_name} {dict(zip(hazard['arg_names'], args))}: "
+            f"max deviation {deviation.max(initial=0):.3g} (relative {relative.max(initial=0):.3g}), "
+            f"{np.count_nonzero(np.isfinite(reference[name].values) != np.isfinite(reduced[name].values))} non-finite mismatches, "
+            f"{reports_differ}/{len(cells)} CI reports differ"
+        )
+
+
+@click.command("variates-benchmark-sampler", short_help="Compare the CI precision of the variate samplers")
+@click.option(
+    "--dataset",
+    "dataset_names",
+    multiple=True,
+    type=click.Choice(list(datasets)),
+    help="Dataset to benchmark (default: all datasets).",
+)
+@click.option("--n-cells", default=20, show_default=True, help="Number of cells to compare CI widths at.")
+@click.option("--repeats", default=5, show_default=True, help="Number of seeds for each sampler and nVariates.")
+@click.option("--n-reference", default=2**14, show_default=True, help="Number of Sobol variates of the reference CIs.")
+def benchmark_sampler(dataset_names, n_cells, repeats, n_reference):
+    '''Report the root mean square relative error of the 95% CI width of each hazard against nVariates,
+    for pseudo-random and Sobol variates (see BOOTSTRAP_SAMPLER), at cells spread over the grid. The
+    reference widths use n_reference Sobol variates.'''
+    import copy
+    from .developing_process import init_composite_fit
+    from .hazards import hazards
+
+    seed = current_app.config['BOOTSTRAP_SEED']
+    sizes = [64, 128, 256, 512, 1024]
+
+    def ci_width(model, hazard, args, nVariates, sampler, seed):
+        model = copy.copy(model)
+        model.nVariates, model.sampler, model.seed = nVariates, sampler, seed
+        model.variate_bootstrap_dist(nVariates, seed=seed)
+        result = hazard['function'](model, *args, format='netcdf', mode='quantiles', quantiles=[0.025, 0.975])
+        lower, upper = result[[name for name in result.data_vars if name.endswith('_quantiles')][0]].values.ravel()
+        return upper - lower
+
+    for func_name, hazard in hazards.items():
+        if dataset_names and hazard['dataset'] not in dataset_names:
+            continue
+        model = init_composite_fit(
+            hazard['dataset'],
+            simParams='c,loc1,scale0,scale1',
+            nVariates=bootstrap_variates(current_app.config),
+            preProcess=False,
+        )
+        # A representative set of arguments from the middle of each list
+        args = [values[len(values)//2] for values in hazard['args']]
+        cells = np.argwhere(np.isfinite(model.fit.transpose(*model.gridDims, 'params').values).all(axis=-1))
+        cells = cells[np.linspace(0, len(cells) - 1, min(n_cells, len(cells))).astype(int)]
+        points = [model.select_cell(x, y) for x, y in cells]
+
+        reference = np.array([ci_width(point, hazard, args, n_reference, 'sobol', seed) for point in points])
+        click.echo(f"{func_name} {dict(zip(hazard['arg_names'], args))}:")
+        for nVariates in sizes:
+            errors = {
+                sampler: np.sqrt(np.nanmean([
+                    ((ci_width(point, hazard, args, nVariates, sampler, seed + r) - width) / width)**2
+                    for point, width in zip(points, reference)
+                    for r in range(repeats)
+                ]))
+                for sampler in SAMPLERS
+            }
+            click.echo(f"  nVariates={nVariates:5d} " + " ".join(f"{sampler} {error:.2%}" for sampler, error in errors.items()))
+
+
+def init_app(app):
+    '''Register the variate store commands with the Flask application.'''
+    app.cli.add_command(build_variates)
+    app.cli.add_command(validate_precision)
+    app.cli.add_command(benchmark_sampler)
@@ -0,0 +1,50 @@
+'''
+Warm-up of the fitted models before the workers are forked.
+
+With MODEL_WARMUP set, create_app builds the serving model of every dataset
+in data.datasets. Running gunicorn with --preload does this once in the
+master process, so the workers start with the models in their registry and
+share the memory of the models copy-on-write. To keep those pages shared,
+the model arrays are made read-only and the objects created so far are moved
+to the permanent generation of the garbage collector (gc.freeze), whose
+collections would otherwise write to them in every worker.
+'''
+import gc
+
+from flask import current_app
+
+from .data import datasets
+from .developing_process import composite_fit_key, init_composite_fit
+from .registry import reachable_arrays, registry
+from .variates import bootstrap_variates
+
+
+def serving_fit():
+    '''Options of the models used by the data and CI report routes.'''
+    return dict(simParams='c,loc1,scale0,scale1', nVariates=bootstrap_variates(current_app.config), preProcess=True)
+
+
+def freeze_arrays(model):
+    '''Make the numpy arrays of a model read-only, so a stray in-place write fails instead of copying shared pages.'''
+    for array in reachable_arrays(model):
+        array.flags.writeable = False
+
+
+def warm_models(app):
+    '''Build the serving model of each dataset and prepare the process for forking.'''
+    with app.app_context():
+        for dataset_name in datasets:
+            freeze_arrays(init_composite_fit(dataset_name, **serving_fit()))
+            app.logger.info('Warmed up the model of %s', dataset_name)
+    gc.freeze()
+
+
+def model_status():
+    '''Whether the serving model of each dataset is in the registry of this worker.'''
+    return {dataset_name: composite_fit_key(dataset_name, **serving_fit())[0] in registry for dataset_name in datasets}
+
+
+def init_app(app):
+    '''Warm up the models if MODEL_WARMUP is set.'''
+    if app.config['MODEL_WARMUP']:
+        warm_models(app)
@@ -1,7 +1,10 @@
 import os
+import numpy as np
 import pytest
+import xarray as xr
 from scotclimpact import create_app
 from scotclimpact.data import make_pooch
+from scotclimpact.developing_process import Fitted_Obs_Sim
 
 @pytest.fixture(scope='session')
 def test_app():
@@ -28,3 +31,39 @@ POOCH = make_pooch()
 @pytest.fixture()
 def pooch_fetcher():
     return lambda filename: POOCH.fetch(filename)
+
+PARAMS = ['c', 'loc0', 'loc1', 'scale0', 'scale1']
+SIM_PARAMS = ['c', 'loc1', 'scale0', 'scale1']
+
+def make_fit(rng, nx=4, ny=3):
+    '''A synthetic GEV fit on an nx by ny grid, in the layout of the model_fits files'''
+    coords = dict(projection_x_coordinate=np.arange(nx) * 12000.0, projection_y_coordinate=np.arange(ny) * 12000.0,
+                  params=PARAMS)
+    fit = np.array([-0.1, 25.0, 1.5, 0.4, 0.05]) + rng.normal(0, 0.01, (nx, ny, 5))
+    A = rng.normal(0, 0.03, (nx, ny, 5, 5))
+    dims = ['projection_x_coordinate', 'projection_y_coordinate']
+    return xr.Dataset(
+        dict(fit=(dims + ['params'], fit),
+             bootstrap_mean=(dims + ['params'], fit),
+             bootstrap_covariance=(dims + ['params_i', 'params_j'], A @ np.swapaxes(A, -1, -2))),
+        coords=coords,
+        attrs=dict(covariateFunction='linear_loc_log_scale'),
+    )
+
+def make_inputs(nx=6, ny=5):
+    '''The observed and simulated fits and the grid of a model, as returned by open_composite_inputs'''
+    rng = np.random.default_rng(0)
+    dsObs, dsSim = make_fit(rng, nx, ny), make_fit(rng, nx, ny)
+    grid = xr.Dataset(dict(mask=(['projection_x_coordinate', 'projection_y_coordinate'], np.ones((nx, ny)))),
+                      coords=dict(projection_x_coordinate=dsObs.projection_x_coordinate,
+                                  projection_y_coordinate=dsObs.projection_y_coordinate))
+    return dsObs, dsSim, grid
+
+def make_model(nx=6, ny=5, nVariates=200, **kwargs):
+    return Fitted_Obs_Sim(*make_inputs(nx, ny), simParams=SIM_PARAMS, nVariates=nVariates, seed=1, slim=True,
+                          **kwargs)
+
+@pytest.fixture(scope='module')
+def model():
+    '''A small slim model, shared by the tests of a module that only read it'''
+    return make_model()
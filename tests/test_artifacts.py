@@ -0,0 +1,35 @@
+import numpy as np
+import xarray as xr
+
+from scotclimpact import artifacts
+from scotclimpact.artifacts import artifact_path, save_artifact, load_artifact
+from scotclimpact.developing_process import Fitted_Obs_Sim
+from fixtures import make_fit
+
+def test_artifact_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    dsObs, dsSim = make_fit(rng), make_fit(rng)
+    grid = xr.Dataset(dict(mask=(['projection_y_coordinate', 'projection_x_coordinate'], np.ones((3, 4)))),
+                      coords=dict(projection_x_coordinate=dsObs.projection_x_coordinate,
+                                  projection_y_coordinate=dsObs.projection_y_coordinate))
+    model = Fitted_Obs_Sim(dsObs, dsSim, grid, simParams=['c', 'loc1', 'scale0', 'scale1'],
+                           nVariates=50, seed=1, slim=True)
+
+    path = artifact_path(str(tmp_path), 'extreme_temp', 'c,loc1,scale0,scale1')
+    save_artifact(path, model.ds, model.grid, model.gridDims)
+    loaded = Fitted_Obs_Sim.from_artifact(*load_artifact(path), nVariates=50, seed=1)
+
+    assert loaded.ds.identical(model.ds)
+    np.testing.assert_array_equal(loaded.bsVariates.values, model.bsVariates.values)
+    assert model.get_CI_report('intensity_from_return_time', return_time=50, T0=1.0, xIndex=1, yIndex=2) \
+        == loaded.get_CI_report('intensity_from_return_time', return_time=50, T0=1.0, xIndex=1, yIndex=2)
+
+
+def test_load_artifact_other_version(tmp_path, monkeypatch):
+    path = str(tmp_path / 'artifact.nc')
+    grid = xr.Dataset(dict(mask=(['projection_x_coordinate'], np.ones(2))))
+    save_artifact(path, xr.Dataset(), grid, ['projection_x_coordinate'])
+    assert load_artifact(path) is not None
+    monkeypatch.setattr(artifacts, 'DATA_REPO_VERSION', 'v9.9.9')
+    assert load_artifact(path) is None
+    assert load_artifact(str(tmp_path / 'missing.nc')) is None
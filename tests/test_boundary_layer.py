@@ -0,0 +1,160 @@
+import gzip
+import json
+import os
+import threading
+from unittest import mock
+
+import numpy as np
+import pytest
+import shapely
+import xarray as xr
+from flask import Flask
+from werkzeug.datastructures import Accept
+
+from scotclimpact import boundary_layer
+from scotclimpact.boundary_layer import Compressed_Asset, scotland_mask, scotland_mask_path, get_boundary_asset
+from scotclimpact.config import Config
+from scotclimpact.data_helpers import grid_to_geojson, xarray_to_geojson, xarray_to_values, unwrap_xarray
+
+SHAPE = shapely.Point(20e3, 30e3).buffer(15e3)
+
+
+@pytest.fixture()
+def app(tmp_path):
+    app = Flask('test')
+    app.config.from_object(Config)
+    app.config['DATA_DIR'] = str(tmp_path)
+    boundary_layer._scotland_mask.cache_clear()
+    with app.app_context(), mock.patch.object(boundary_layer, 'get_scotland_shape', return_value=SHAPE):
+        yield app
+    boundary_layer._scotland_mask.cache_clear()
+
+
+def make_grid():
+    x = np.arange(8) * 5e3 + 2.5e3
+    y = np.arange(12) * 5e3 + 2.5e3
+    return xr.DataArray(np.arange(96.0).reshape(8, 12), dims=['projection_x_coordinate', 'projection_y_coordinate'],
+                        coords=dict(projection_x_coordinate=x, projection_y_coordinate=y))
+
+
+def test_scotland_mask(app):
+    grid = make_grid()
+    x, y = grid.projection_x_coordinate.values, grid.projection_y_coordinate.values
+    mask = scotland_mask(x, y)
+
+    expected = [[SHAPE.intersects(shapely.box(xi - 2.5e3, yj - 2.5e3, xi + 2.5e3, yj + 2.5e3)) for yj in y] for xi in x]
+    np.testing.assert_array_equal(mask, expected)
+    assert os.path.basename(scotland_mask_path(x, y)).startswith('scotland_5km_')
+    assert os.path.exists(scotland_mask_path(x, y))
+
+    boundary_layer._scotland_mask.cache_clear()
+    with mock.patch.object(boundary_layer, 'get_scotland_shape') as get_shape:
+        np.testing.assert_array_equal(scotland_mask(x, y), mask)
+    get_shape.assert_not_called()
+
+
+def test_scotland_mask_concurrent(app):
+    # two workers building the mask of a cold cache at once both write it, neither fails
+    grid = make_grid()
+    x, y = tuple(grid.projection_x_coordinate.values), tuple(grid.projection_y_coordinate.values)
+    barrier = threading.Barrier(2, timeout=10)
+    save = np.save
+    def save_together(file, array):
+        barrier.wait()
+        save(file, array)
+        barrier.wait()
+
+    masks = []
+    def build():
+        with app.app_context():
+            masks.append(boundary_layer._scotland_mask.__wrapped__(x, y))
+    with mock.patch.object(boundary_layer.np, 'save', side_effect=save_together):
+        threads = [threading.Thread(target=build) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+    assert len(masks) == 2
+    np.testing.assert_array_equal(masks[0], masks[1])
+    np.testing.assert_array_equal(np.load(scotland_mask_path(x, y)), masks[0])
+    assert os.listdir(os.path.dirname(scotland_mask_path(x, y))) == [os.path.basename(scotland_mask_path(x, y))]
+
+
+def test_helpers_select_masked_cells(app):
+    grid = make_grid()
+    mask = scotland_mask(grid.projection_x_coordinate.values, grid.projection_y_coordinate.values)
+
+    geojson = xarray_to_geojson('test', grid)
+    assert geojson['numberMatched'] == mask.sum()
+    assert sorted(feature['properties']['data'] for feature in geojson['features']) == sorted(grid.values[mask])
+    assert [cell['coord_idx'] for cell in unwrap_xarray(grid, 5)] == list(zip(*np.where(mask)))
+
+
+def test_grid_values_order(app):
+    grid = make_grid()
+    grid[0, 5] = np.inf
+    grid[3, 5] = np.nan
+    cells = grid_to_geojson(5, grid)['features']
+    # the dimensions of a result may be in either order
+    values = xarray_to_values(grid.transpose())
+
+    assert values.dtype == np.float32
+    assert len(values) == len(cells)
+    geojson = xarray_to_geojson('test', grid, ci_report_url=lambda x, y: (x, y))
+    expected = {json.dumps(feature['geometry']): feature['properties'] for feature in geojson['features']}
+    assert np.isnan(values).sum() == 1
+    for cell, value in zip(cells, values):
+        if np.isnan(value):
+            # xarray_to_geojson leaves out cells without a value
+            assert (cell['properties']['x'], cell['properties']['y']) == (3, 5)
+            continue
+        properties = expected[json.dumps(cell['geometry'])]
+        assert properties['ci_report_url'] == (cell['properties']['x'], cell['properties']['y'])
+        assert cell['id'] == 5 * 1000 * 1000 + 1000 * cell['properties']['x'] + cell['properties']['y']
+        assert value == np.float32(properties['data'])
+
+
+def make_layer():
+    '''Four boards covering a square, divided by two detailed boundaries shared between neighbouring boards.'''
+    t = np.arange(0, 20e3 + 1, 10.0)
+    lines = [
+        shapely.box(0, 0, 20e3, 20e3).boundary,
+        shapely.LineString(np.c_[t, 10e3 + 50.0 * np.sin(t / 100.0)]),
+        shapely.LineString(np.c_[10e3 + 50.0 * np.sin(t / 100.0), t]),
+    ]
+    geometries = shapely.get_parts(shapely.polygonize([shapely.union_all(lines)]))
+    return json.dumps(dict(type='FeatureCollection', features=[
+        dict(type='Feature', properties=dict(HBName=f'Board {i}'), geometry=shapely.geometry.mapping(geometry))
+        for i, geometry in enumerate(geometries)]))
+
+
+def test_boundary_asset_details():
+    layer = make_layer()
+    boundary_layer.get_boundary_geometries.cache_clear()
+    get_boundary_asset.cache_clear()
+    with mock.patch.object(boundary_layer, 'get_boundary_layer', return_value=layer):
+        full = get_boundary_asset('health_boards')
+        high = get_boundary_asset('health_boards', 'high')
+        low = get_boundary_asset('health_boards', 'low')
+    get_boundary_asset.cache_clear()
+    boundary_layer.get_boundary_geometries.cache_clear()
+
+    assert full.encodings['identity'] == layer.encode('utf-8')
+    assert len(low.encodings['identity']) < len(high.encodings['identity']) < len(full.encodings['identity'])
+    simplified = json.loads(high.encodings['identity'])
+    geometries = np.array([shapely.geometry.shape(feature['geometry']) for feature in simplified['features']])
+    assert shapely.coverage_is_valid(geometries)
+    assert [feature['properties'] for feature in simplified['features']] == \
+        [feature['properties'] for feature in json.loads(layer)['features']]
+
+
+def test_boundary_asset_representation():
+    asset = Compressed_Asset(b'{"type": "FeatureCollection", "features": []}')
+    encoding, content, etag = asset.representation(Accept([('gzip', 1), ('deflate', 1)]))
+    assert (encoding, etag) == ('gzip', asset.etag + '-gzip')
+    assert gzip.decompress(content) == asset.encodings['identity']
+    assert asset.representation(Accept([])) == ('identity', asset.encodings['identity'], asset.etag)
+    # only gzip is served
+    assert asset.representation(Accept([('br', 1)]))[0] == 'identity'
+    assert Compressed_Asset(asset.encodings['identity']).etag == asset.etag
@@ -0,0 +1,28 @@
+import importlib
+
+import pytest
+
+from scotclimpact import config
+
+
+@pytest.mark.parametrize('name, value', [
+    ('BOOTSTRAP_SEED', '1'),
+    ('BOOTSTRAP_DTYPE', 'float32'),
+    ('BOOTSTRAP_SAMPLER', 'sobol'),
+    ('BOOTSTRAP_VARIATES', '512'),
+    ('ADAPTIVE_VARIATES', 'true'),
+    ('ADAPTIVE_VARIATES_TOLERANCE', '0.05'),
+    ('COVARIATE_LATTICE', 'true'),
+    ('COVARIATE_LATTICE_MAX_BYTES', '1024'),
+])
+def test_cache_key_prefix(monkeypatch, name, value):
+    '''Every setting that changes hazard results changes the prefix of their cache keys'''
+    prefix = config.Config.CACHE_KEY_PREFIX
+    monkeypatch.setenv(name, value)
+    try:
+        changed = importlib.reload(config).Config.CACHE_KEY_PREFIX
+    finally:
+        monkeypatch.undo()
+        importlib.reload(config)
+    assert changed != prefix
+    assert changed.startswith(f'scotclimpact_{config.DATA_REPO_VERSION}_')
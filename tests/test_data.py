@@ -0,0 +1,44 @@
+import os
+from unittest import mock
+
+import pooch
+import pytest
+
+from scotclimpact.data import fetch_verified, read_manifest, is_verified
+
+
+@pytest.fixture()
+def local_pooch(tmp_path):
+    (tmp_path / 'grids').mkdir()
+    path = tmp_path / 'grids' / 'grid.nc'
+    path.write_bytes(b'grid data')
+    return pooch.create(
+        path=tmp_path,
+        base_url='https://example.invalid/',
+        registry={'grids/grid.nc': 'md5:' + pooch.file_hash(str(path), alg='md5')},
+    )
+
+
+def test_fetch_verified_records_manifest(local_pooch):
+    filename = fetch_verified(local_pooch, 'grids/grid.nc')
+
+    assert filename == os.path.join(str(local_pooch.abspath), 'grids/grid.nc')
+    assert is_verified(local_pooch, 'grids/grid.nc', read_manifest(local_pooch))
+
+
+def test_fetch_verified_skips_hashing_verified_files(local_pooch):
+    fetch_verified(local_pooch, 'grids/grid.nc')
+    with mock.patch.object(local_pooch, 'fetch') as fetch:
+        fetch_verified(local_pooch, 'grids/grid.nc')
+    fetch.assert_not_called()
+
+
+def test_fetch_verified_rechecks_changed_files(local_pooch):
+    fetch_verified(local_pooch, 'grids/grid.nc')
+    path = os.path.join(str(local_pooch.abspath), 'grids/grid.nc')
+    os.utime(path, ns=(0, 0))
+
+    assert not is_verified(local_pooch, 'grids/grid.nc', read_manifest(local_pooch))
+    with mock.patch.object(local_pooch, 'fetch', return_value=path) as fetch:
+        fetch_verified(local_pooch, 'grids/grid.nc')
+    fetch.assert_called_once_with('grids/grid.nc')
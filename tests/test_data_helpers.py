@@ -1,6 +1,8 @@
+import numpy as np
 import pytest
+import xarray as xr
 
-from scotclimpact.data_helpers import xarray_to_geojson, is_number, validate_args
+from scotclimpact.data_helpers import xarray_to_geojson, is_number, validate_args, grid_geometries, make_geometry_id
 
 
 @pytest.mark.parametrize(
@@ -43,3 +45,15 @@ def test_validate_args():
     #assert test('a', 'b')[1] == 400
 
 
+def test_grid_geometries():
+    grid = xr.Dataset(coords=dict(projection_x_coordinate=[6e3, 18e3, 30e3], projection_y_coordinate=[6e3, 18e3]))
+    geometries = grid_geometries(grid, 'projection_x_coordinate', 'projection_y_coordinate')
+
+    assert geometries is grid_geometries(grid, 'projection_x_coordinate', 'projection_y_coordinate')
+    assert geometries.rings.shape == (6, 5, 2)
+    row = geometries.row_of_id(make_geometry_id(12, 2, 1))
+    assert geometries.ids[row] == make_geometry_id(12, 2, 1)
+    np.testing.assert_array_equal(geometries.rings[row],
+                                  [[36e3, 24e3], [36e3, 12e3], [24e3, 12e3], [24e3, 24e3], [36e3, 24e3]])
+    assert geometries.corners([row]) == [[[36e3, 24e3], [36e3, 12e3], [24e3, 24e3], [24e3, 12e3]]]
+    assert geometries.ring_lists[row] == geometries.rings[row].tolist()
@@ -1,3 +1,28 @@
 import pytest
 import numpy as np
+import xarray as xr
 
+from scotclimpact.db import hazard_results, values_by_geometry
+
+
+def test_hazard_results_sweep():
+    function = lambda fit, a, b: xr.DataArray(np.full(3, fit * a + b))
+    sweep_function = lambda fit, a, bs: xr.DataArray(fit * a + np.add.outer(bs, np.zeros(3)), dims=['b', 'x'])
+    hazard = dict(function=function, arg_names=['a', 'b'], args=[[1, 2], [10, 20, 30]])
+
+    expected = list(hazard_results(hazard, 5))
+    results = list(hazard_results(dict(hazard, sweep_function=sweep_function), 5))
+
+    assert [arg for arg, _ in results] == [arg for arg, _ in expected]
+    for (_, result), (_, expected_result) in zip(results, expected):
+        np.testing.assert_array_equal(result, expected_result)
+
+
+def test_values_by_geometry():
+    geometry_ids = np.array([12000001, 12000002, 12001000, 12001001])
+    rows = [(12001001, 4.0), (12000001, 1.0), (12001000, 3.0), (12005005, 9.0)]
+
+    values = values_by_geometry(geometry_ids, rows)
+    assert values.dtype == np.float32
+    np.testing.assert_array_equal(values, [1.0, np.nan, 3.0, 4.0])
+    assert np.isnan(values_by_geometry(geometry_ids, [])).all()
@@ -0,0 +1,59 @@
+import pytest
+import numpy as np
+from scipy import stats
+from scipy.integrate import quad
+
+from scotclimpact.diagnostics import ks_2samp, ks_1samp_less, normal_overlap
+
+
+@pytest.fixture()
+def samples():
+    rng = np.random.default_rng(0)
+    a = rng.normal(size=(20, 30))
+    b = rng.normal(0.2, 1.2, size=(20, 90))
+    b[1, :10] = a[1, :10] # shared values
+    a[2], b[2] = np.round(a[2]), np.round(b[2]) # ties
+    return a, b
+
+
+def test_ks_2samp_matches_scipy(samples):
+    a, b = samples
+    statistic, p = ks_2samp(a, b)
+    for i in range(a.shape[0]):
+        expected = stats.ks_2samp(a[i], b[i], method='asymp')
+        assert statistic[i] == pytest.approx(expected.statistic)
+        assert p[i] == pytest.approx(expected.pvalue)
+
+
+def test_ks_2samp_missing_values(samples):
+    a, b = samples
+    a[3, 4] = np.nan
+    statistic, p = ks_2samp(a, b)
+    assert np.isnan(statistic[3]) and np.isnan(p[3])
+    assert np.isfinite(p[4])
+
+
+def test_ks_1samp_less_matches_scipy():
+    x = np.random.default_rng(1).lognormal(size=(5, 40))
+    fits = [stats.lognorm.fit(xi) for xi in x]
+    params = np.array(fits).T[..., np.newaxis]
+    statistic, p = ks_1samp_less(x, lambda v: stats.lognorm.cdf(v, *params))
+    for i, fit in enumerate(fits):
+        expected = stats.kstest(x[i], stats.lognorm.cdf, args=fit, alternative='less')
+        assert statistic[i] == pytest.approx(expected.statistic)
+        assert p[i] == pytest.approx(expected.pvalue)
+
+
+@pytest.mark.parametrize('m0, s0, m1, s1', [
+    (0.0, 1.0, 0.5, 1.0),
+    (0.0, 1.0, 0.5, 2.0),
+    (1.0, 0.3, -0.2, 0.1),
+    (2.0, 1.0, 2.0, 1.0),
+])
+def test_normal_overlap_matches_quadrature(m0, s0, m1, s1):
+    expected, _ = quad(lambda x: min(stats.norm.pdf(x, m0, s0), stats.norm.pdf(x, m1, s1)), -20, 20, limit=200)
+    assert normal_overlap(m0, s0, m1, s1) == pytest.approx(expected, abs=1e-8)
+
+
+def test_normal_overlap_missing_values():
+    assert np.isnan(normal_overlap([0.0, np.nan], 1.0, 0.0, 1.0)[1])
@@ -0,0 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import xarray as xr
+
+from scotclimpact.developing_process import change_in_intensity, intensity_from_return_time
+from fixtures import make_model
+
+COVARIATES = [0.2, 0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 4.0]
+
+
+def calculate(model, covariate):
+    covariateFit = model.evaluate(covariate)
+    return (covariateFit.fitGEV + covariateFit.bsfitGEV,
+            intensity_from_return_time(model, covariate, 50, format='netcdf', mode='quantiles'),
+            change_in_intensity(model, 50, 0.5, covariate, format='netcdf', mode='quantiles'))
+
+
+def test_evaluate_concurrent():
+    # threads evaluating one shared model at different covariates each get the result of a serial run
+    model = make_model()
+    model.set_covariate(1.0)
+    fitGEV, bsfitGEV = [p.copy() for p in model.fitGEV], [p.copy() for p in model.bsfitGEV]
+    serial = [calculate(model, covariate) for covariate in COVARIATES]
+
+    with ThreadPoolExecutor(max_workers=len(COVARIATES)) as executor:
+        for _ in range(3):
+            results = list(executor.map(lambda covariate: calculate(model, covariate), COVARIATES))
+            for (params, *datasets), (expectedParams, *expectedDatasets) in zip(results, serial):
+                for p, e in zip(params, expectedParams):
+                    np.testing.assert_array_equal(p, e)
+                for dataset, expected in zip(datasets, expectedDatasets):
+                    xr.testing.assert_identical(dataset, expected)
+
+    # evaluate does not modify the parameters set with set_covariate
+    for params, expected in [(model.fitGEV, fitGEV), (model.bsfitGEV, bsfitGEV),
+                             (model.covariateFit.fitGEV, fitGEV), (model.covariateFit.bsfitGEV, bsfitGEV)]:
+        for p, e in zip(params, expected):
+            np.testing.assert_array_equal(p, e)
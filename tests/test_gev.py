@@ -0,0 +1,44 @@
+import pytest
+import numpy as np
+from scipy.stats import genextreme
+
+from scotclimpact import gev
+
+
+@pytest.fixture()
+def gev_params():
+    rng = np.random.default_rng(42)
+    c = rng.normal(0, 0.3, (20, 30))
+    c[0, :5] = 0.0 # Gumbel limit
+    c[1, :5] = 1e-12
+    loc = rng.normal(20, 3, (20, 30))
+    scale = np.exp(rng.normal(0, 0.5, (20, 30)))
+    return c, loc, scale
+
+
+@pytest.mark.parametrize('x', [5.0, 20.0, 30.0, 60.0])
+@pytest.mark.parametrize('func', ['cdf', 'sf'])
+def test_distribution_matches_scipy(gev_params, func, x):
+    result = getattr(gev, func)(x, *gev_params)
+    expected = getattr(genextreme, func)(x, *gev_params)
+    np.testing.assert_allclose(result, expected, rtol=1e-12, atol=1e-15)
+
+
+@pytest.mark.parametrize('q', [0.01, 0.5, 0.9, 0.99])
+def test_ppf_matches_scipy(gev_params, q):
+    result = gev.ppf(q, *gev_params)
+    expected = genextreme.ppf(q, *gev_params)
+    np.testing.assert_allclose(result, expected, rtol=1e-12)
+
+
+def test_out_parameter(gev_params):
+    out = np.empty(gev_params[0].shape)
+    result = gev.ppf(0.9, *gev_params, out=out)
+    assert result is out
+    np.testing.assert_allclose(out, genextreme.ppf(0.9, *gev_params), rtol=1e-12)
+
+
+def test_invalid_scale_and_dtype():
+    assert np.isnan(gev.sf(30.0, 0.1, 20.0, -1.0))
+    c = np.full(3, 0.1, dtype=np.float32)
+    assert gev.sf(30.0, c, np.float32(20.0), np.float32(1.0)).dtype == np.float32
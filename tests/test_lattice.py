@@ -0,0 +1,97 @@
+import copy
+
+import pytest
+import xarray as xr
+
+from scotclimpact.developing_process import (change_in_frequency, change_in_intensity, intensity_from_return_time,
+                                             return_time_from_intensity)
+from scotclimpact.hazards import hazard_covariates, hazards
+from fixtures import model
+
+COVARIATES = [0.5, 1.0, 2.0]
+QUANTILES = [0.025, 0.5, 0.975]
+
+
+def with_lattice(model, maxBytes=None):
+    latticeModel = copy.copy(model)
+    truncated = latticeModel.build_lattice(COVARIATES, maxBytes=maxBytes)
+    return latticeModel, truncated
+
+
+def hazard_results(model, covariate):
+    return [
+        intensity_from_return_time(model, covariate, 50, format='netcdf', mode='quantiles', quantiles=QUANTILES),
+        return_time_from_intensity(model, covariate, 26.0, format='netcdf', mode='quantiles', quantiles=QUANTILES),
+        change_in_intensity(model, 50, 0.5, covariate, format='netcdf', mode='quantiles', quantiles=QUANTILES),
+    ]
+
+
+def test_lattice_hazards(model):
+    latticeModel, truncated = with_lattice(model)
+    assert truncated == 0
+    assert latticeModel.in_lattice(('temperature', 1.0)) and latticeModel.in_lattice(('covariate', 1.0))
+    assert not model.in_lattice(('temperature', 1.0))
+
+    for result, expected in zip(hazard_results(latticeModel, 1.0), hazard_results(model, 1.0)):
+        xr.testing.assert_identical(result, expected)
+
+
+def test_lattice_fallback(model):
+    latticeModel, _ = with_lattice(model)
+    assert not latticeModel.in_lattice(('temperature', 1.5))
+
+    for result, expected in zip(hazard_results(latticeModel, 1.5), hazard_results(model, 1.5)):
+        xr.testing.assert_identical(result, expected)
+
+
+def test_lattice_max_bytes(model):
+    full, _ = with_lattice(model)
+    entryBytes = full.latticeBytes // len(full.lattice)
+    latticeModel, truncated = with_lattice(model, maxBytes=2 * entryBytes)
+
+    assert truncated == 2 * len(COVARIATES) - 2
+    assert latticeModel.latticeBytes < full.latticeBytes
+    # the bootstrap parameters that did not fit are calculated when needed
+    assert latticeModel.lattice[('covariate', 2.0)].bsfitGEV is None
+    for result, expected in zip(hazard_results(latticeModel, 2.0), hazard_results(model, 2.0)):
+        xr.testing.assert_identical(result, expected)
+
+
+def test_hazard_covariates():
+    covariates = hazard_covariates('extreme_temp')
+    assert covariates == sorted(set(covariates))
+    for hazard in hazards.values():
+        if hazard['dataset'] != 'extreme_temp':
+            continue
+        for arg_name, values in zip(hazard['arg_names'], hazard['args']):
+            if arg_name.startswith('covariate'):
+                assert set(values) <= set(covariates)
+    assert hazard_covariates('no_such_dataset') == []
+
+
+@pytest.mark.parametrize('lattice', [False, True])
+def test_central_fit(model, lattice):
+    if lattice:
+        model, _ = with_lattice(model)
+    central = model.central_fit()
+    assert central.bsVariates is None and model.bsVariates is not None
+    for hazard, args, var in [(intensity_from_return_time, (1.0, 50), 'intensity'),
+                              (change_in_intensity, (50, 0.5, 1.0), 'intensity_change'),
+                              (change_in_frequency, (26.0, 0.5, 1.0), 'times_more_likely')]:
+        result = hazard(central, *args, mode='fit')
+        expected = hazard(model, *args, format='netcdf', mode='quantiles', quantiles=QUANTILES)[var]
+        xr.testing.assert_equal(result, expected)
+
+
+def test_lattice_temperature_comparisons(model):
+    latticeModel, _ = with_lattice(model)
+    expected = [model.change_in_intensity_T(50, 0.5, 2.0, quantiles=QUANTILES),
+                model.times_more_likely_T(26.0, 0.5, 2.0, quantiles=QUANTILES)]
+
+    def evaluate(*args, **kwargs):
+        raise AssertionError('evaluated outside the lattice')
+    latticeModel.evaluate = evaluate
+    result = [latticeModel.change_in_intensity_T(50, 0.5, 2.0, quantiles=QUANTILES),
+              latticeModel.times_more_likely_T(26.0, 0.5, 2.0, quantiles=QUANTILES)]
+    for result, expected in zip(result, expected):
+        xr.testing.assert_identical(result, expected)
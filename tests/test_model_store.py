@@ -0,0 +1,149 @@
+import os
+import pickle
+import threading
+from unittest import mock
+
+import numpy as np
+import pytest
+import xarray as xr
+from flask import Flask
+from multiprocessing import shared_memory
+
+from scotclimpact.config import Config
+from scotclimpact import model_store
+from scotclimpact.model_store import (attach, clear_entries, entry_path, init_app, model_name, model_store_clear,
+                                      publish, shared_model, store_settings)
+from scotclimpact.registry import array_nbytes
+from fixtures import make_model
+
+
+class Model():
+    def __init__(self):
+        self.values = np.arange(10.0)
+        self.ds = xr.Dataset(dict(fit=(['x', 'y'], np.ones((3, 5), dtype=np.float32))))
+
+
+@pytest.fixture()
+def catalog_dir(tmp_path):
+    app = Flask('test')
+    app.config.from_object(Config)
+    app.config['MODEL_STORE_DIR'] = str(tmp_path)
+    yield str(tmp_path)
+    with app.app_context():
+        app.test_cli_runner().invoke(model_store_clear)
+
+
+def test_publish_and_attach(catalog_dir):
+    model = Model()
+    assert attach(catalog_dir, ('model', 1)) is None
+    publish(catalog_dir, ('model', 1), model)
+
+    shared = attach(catalog_dir, ('model', 1))
+    np.testing.assert_array_equal(shared.values, model.values)
+    assert shared.ds.identical(model.ds)
+    assert not shared.values.flags.writeable
+    assert array_nbytes(shared) == 0
+    assert attach(catalog_dir, ('model', 2)) is None
+
+
+def test_shared_model_builds_once(catalog_dir):
+    built = []
+    build = lambda: built.append(1) or Model()
+    first = shared_model(catalog_dir, ('model', 1), build)
+    second = shared_model(catalog_dir, ('model', 1), build)
+
+    assert built == [1]
+    np.testing.assert_array_equal(first.values, second.values)
+
+
+def test_fitted_obs_sim_pickle():
+    model = make_model(4, 3, nVariates=50)
+
+    loaded = pickle.loads(pickle.dumps(model, protocol=5))
+    assert loaded.fCovariate is model.fCovariate
+    assert model.get_CI_report('intensity_from_return_time', return_time=50, T0=1.0, xIndex=1, yIndex=2) \
+        == loaded.get_CI_report('intensity_from_return_time', return_time=50, T0=1.0, xIndex=1, yIndex=2)
+
+
+def test_model_name_settings():
+    app = Flask('test')
+    app.config.from_object(Config)
+    settings = store_settings(app.config)
+    assert model_name(('model', 1), settings) != model_name(('model', 1))
+    app.config['BOOTSTRAP_SEED'] += 1
+    assert model_name(('model', 1), store_settings(app.config)) != model_name(('model', 1), settings)
+
+
+def test_stale_entries_cleared(tmp_path):
+    app = Flask('test')
+    app.config.from_object(Config)
+    app.config['MODEL_STORE_DIR'] = str(tmp_path)
+    app.config['SHARED_MODEL_STORE'] = True
+    settings = store_settings(app.config)
+    publish(str(tmp_path), ('model', 1), Model(), settings)
+    publish(str(tmp_path), ('model', 2), Model(), (1,) + settings[1:])
+    publish(str(tmp_path), ('model', 3), Model())
+
+    init_app(app)
+    assert attach(str(tmp_path), ('model', 1), settings) is not None
+    assert attach(str(tmp_path), ('model', 2), (1,) + settings[1:]) is None
+    assert attach(str(tmp_path), ('model', 3)) is None
+    assert clear_entries(str(tmp_path)) == [repr(('model', 1))]
+
+
+def test_catalog_dir_checked(tmp_path):
+    catalogDir = str(tmp_path / 'models')
+    shared_model(catalogDir, ('model', 1), Model)
+    assert os.stat(catalogDir).st_mode & 0o777 == 0o700
+
+    # a catalog that others can write to could hold entries that are not ours
+    os.chmod(catalogDir, 0o777)
+    with pytest.raises(PermissionError):
+        shared_model(catalogDir, ('model', 1), Model)
+    with pytest.raises(PermissionError):
+        clear_entries(catalogDir)
+    os.chmod(catalogDir, 0o700)
+    assert clear_entries(catalogDir) == [repr(('model', 1))]
+
+    os.symlink(catalogDir, str(tmp_path / 'link'))
+    with pytest.raises(PermissionError):
+        shared_model(str(tmp_path / 'link'), ('model', 1), Model)
+
+
+def test_publish_concurrent(catalog_dir):
+    # two processes publishing the same model at once both write its entry, neither fails
+    barrier = threading.Barrier(2, timeout=10)
+    dump = pickle.dump
+    def dump_together(entry, f):
+        barrier.wait()
+        dump(entry, f)
+        barrier.wait()
+
+    segments = []
+    untrack = model_store.untrack
+    def track(segment):
+        segments.append(segment.name)
+        untrack(segment)
+
+    with mock.patch.object(model_store.pickle, 'dump', side_effect=dump_together), \
+         mock.patch.object(model_store, 'untrack', side_effect=track):
+        published = []
+        def publish_model():
+            publish(catalog_dir, ('model', 1), Model())
+            published.append(1)
+        threads = [threading.Thread(target=publish_model) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+    assert published == [1, 1]
+    np.testing.assert_array_equal(attach(catalog_dir, ('model', 1)).values, Model().values)
+    assert os.listdir(catalog_dir) == [os.path.basename(entry_path(catalog_dir, ('model', 1)))]
+    # the segment of the entry that was replaced is no longer in the catalog
+    with open(entry_path(catalog_dir, ('model', 1)), 'rb') as f:
+        segments.remove(pickle.load(f)['segment'])
+    for name in segments:
+        segment = shared_memory.SharedMemory(name=name)
+        segment.close()
+        segment.unlink()
@@ -0,0 +1,128 @@
+import pytest
+import numpy as np
+import xarray as xr
+
+from scotclimpact.quantiles import quantile, xarray_quantile
+
+QUANTILES = [0.0, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.975, 0.99, 1.0]
+
+
+@pytest.fixture()
+def variates():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(6, 7, 1000))
+    values[0, 0] = np.nan # masked cell
+    values[1, 1, 5] = np.nan # cell with a missing variate
+    values[2, 2, :3] = np.inf
+    values[3, 3, :500] = 1.0
+    return values
+
+
+@pytest.mark.parametrize('q', [QUANTILES, [0.5], [0.025, 0.975], 0.975])
+def test_quantile_matches_numpy(variates, q):
+    np.testing.assert_array_equal(
+        quantile(variates, q),
+        np.nanquantile(variates, q, axis=-1),
+    )
+
+
+def test_quantile_axis():
+    values = np.random.default_rng(1).normal(size=(1001, 4))
+    np.testing.assert_array_equal(
+        quantile(values, [0.5, 0.1], axis=0),
+        np.quantile(values, [0.5, 0.1], axis=0),
+    )
+
+
+def test_quantile_float32(variates):
+    result = quantile(variates[1:], QUANTILES[1:-1], dtype=np.float32)
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(result, np.nanquantile(variates[1:], QUANTILES[1:-1], axis=-1), rtol=1e-6)
+
+
+def test_xarray_quantile_matches_xarray(variates):
+    da = xr.DataArray(
+        variates,
+        dims=['projection_x_coordinate', 'projection_y_coordinate', 'variate'],
+        coords=dict(projection_x_coordinate=np.arange(6), projection_y_coordinate=np.arange(7)),
+        name='intensity',
+    )
+    for obj in [da, da.to_dataset()]:
+        assert xarray_quantile(obj, QUANTILES, dim='variate').identical(obj.quantile(QUANTILES, dim='variate'))
+
+
+def test_quantiles_converged():
+    from scotclimpact.developing_process import quantiles_converged
+    previous = np.array([[0.0, np.nan, 1.0], [1.0, np.nan, np.inf]])
+    for change, converged in [(0.005, True), (0.02, False)]:
+        current = previous.copy()
+        current[:, 0] += change
+        assert quantiles_converged({'q': previous}, {'q': current}, tolerance=0.01) == converged
+    current = previous.copy()
+    current[1, 2] = 2.0
+    assert not quantiles_converged({'q': previous}, {'q': current}, tolerance=0.01)
+
+
+@pytest.fixture(scope='module')
+def model():
+    from scotclimpact.developing_process import Fitted_Obs_Sim
+    from fixtures import SIM_PARAMS, make_inputs
+    dsObs, dsSim, grid = make_inputs(20, 15)
+    grid.mask[0, 0] = np.nan
+    return Fitted_Obs_Sim(dsObs, dsSim, grid, simParams=SIM_PARAMS, nVariates=1000, seed=1, slim=True)
+
+
+def change_in_intensity(model, mode):
+    return model.change_in_intensity_T(50, T0=0.5, T1=2.0, mode=mode, quantiles=[0.025, 0.5, 0.975])
+
+
+def test_adaptive_quantiles_reuse_variates(model):
+    computed = []
+    def calculate(m, mode):
+        computed.append(m.grid.mask.size * m.nVariates)
+        return change_in_intensity(m, mode)
+    result = model.adaptive_quantiles(calculate, [0.025, 0.5, 0.975], tolerance=0.0, minBatch=0)
+
+    # earlier variates are never calculated again
+    assert sum(computed) <= model.grid.mask.size * model.nVariates
+    assert result.attrs['nVariates_used'] == 1000
+    # the quantiles of each cell are those of a prefix of its variates
+    full = change_in_intensity(model, 'variates').intensity_change_variates.values
+    adaptive = result.intensity_change_quantiles.values
+    for x, y in np.ndindex(full.shape[:2]):
+        assert any(np.array_equal(quantile(full[x, y, :n], [0.025, 0.5, 0.975]), adaptive[:, x, y], equal_nan=True)
+                   for n in [100, 200, 400, 800, 1000])
+
+
+def test_adaptive_quantiles_fewer_variates(model):
+    tolerance = 0.05
+    full = change_in_intensity(model, 'quantiles')
+    result = model.adaptive_quantiles(change_in_intensity, [0.025, 0.5, 0.975], tolerance=tolerance, minBatch=0)
+
+    assert list(result.data_vars) == list(full.data_vars)
+    np.testing.assert_array_equal(result.intensity_change.values, full.intensity_change.values)
+    assert result.attrs['nVariates_mean'] < 0.6 * model.nVariates
+    q = full.intensity_change_quantiles.values
+    spread = np.nanmax(q, axis=0) - np.nanmin(q, axis=0)
+    error = (np.abs(result.intensity_change_quantiles.values - q).max(axis=0) / spread)[np.isfinite(spread)]
+    assert np.median(error) <= tolerance
+    assert np.percentile(error, 90) <= 3 * tolerance
+
+
+def test_adaptive_quantiles_sobol_batches():
+    from fixtures import make_model
+    model = make_model(nVariates=1024, sampler='sobol')
+    ends = []
+    def calculate(m, mode):
+        ends.append(m.firstVariate + m.nVariates)
+        return change_in_intensity(m, mode)
+    model.adaptive_quantiles(calculate, [0.025, 0.5, 0.975], tolerance=0.0, minBatch=0)
+    # every batch ends at a power of two, where the Sobol points are balanced
+    assert ends == [128, 256, 512, 1024]
+
+
+def test_adaptive_ci_report(model):
+    # a single cell is calculated on all its variates at once
+    kwargs = dict(report='calibrated_confidence', return_time=50, T0=1.5, xIndex=3, yIndex=4)
+    assert model.get_CI_report('intensity_from_return_time', tolerance=0.01, **kwargs) \
+        == model.get_CI_report('intensity_from_return_time', **kwargs)
@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+from unittest import mock
+
+import numpy as np
+import pytest
+import scipy.sparse
+import shapely
+import xarray as xr
+from flask import Flask
+
+from scotclimpact import boundary_layer, regions
+from scotclimpact.config import Config
+from scotclimpact.regions import aggregate_regions, compute_region_weights, region_means, region_weights_path
+
+REGIONS = [shapely.box(0, 0, 10e3, 20e3), shapely.box(10e3, 0, 20e3, 20e3), shapely.box(50e3, 50e3, 60e3, 60e3)]
+
+
+@pytest.fixture()
+def app(tmp_path):
+    app = Flask('test')
+    app.config.from_object(Config)
+    app.config['DATA_DIR'] = str(tmp_path)
+    layer = json.dumps(dict(type='FeatureCollection', features=[
+        dict(type='Feature', properties=dict(name=f'Region {i}'), geometry=shapely.geometry.mapping(region))
+        for i, region in enumerate(REGIONS)]))
+    boundary_layer.get_boundary_geometries.cache_clear()
+    regions._region_weights.cache_clear()
+    with app.app_context(), mock.patch.object(boundary_layer, 'get_boundary_layer', return_value=layer):
+        yield app
+    boundary_layer.get_boundary_geometries.cache_clear()
+    regions._region_weights.cache_clear()
+
+
+def make_result():
+    # 4 x 3 cells of 5km, covering x in [0, 20km] and y in [2.5km, 17.5km]
+    x = np.arange(4) * 5e3 + 2.5e3
+    y = np.arange(3) * 5e3 + 5e3
+    values = np.arange(12.0).reshape(4, 3)
+    values[0, 0] = np.nan
+    return xr.DataArray(values.T, dims=['projection_y_coordinate', 'projection_x_coordinate'],
+                        coords=dict(projection_x_coordinate=x, projection_y_coordinate=y))
+
+
+def test_compute_region_weights():
+    result = make_result()
+    weights = compute_region_weights(REGIONS, result.projection_x_coordinate.values,
+                                     result.projection_y_coordinate.values)
+
+    assert weights.shape == (3, 12)
+    np.testing.assert_allclose(weights.sum(axis=1).A1, [10e3 * 15e3, 10e3 * 15e3, 0])
+    # the first region covers the first two columns of cells, each cell entirely
+    np.testing.assert_allclose(weights[0].toarray().reshape(4, 3), np.r_[np.full((2, 3), 25e6), np.zeros((2, 3))])
+
+
+def test_region_means():
+    result = make_result().transpose('projection_x_coordinate', 'projection_y_coordinate')
+    weights = compute_region_weights(REGIONS, result.projection_x_coordinate.values,
+                                     result.projection_y_coordinate.values)
+    means = region_means(weights, result.values)
+
+    np.testing.assert_allclose(means[:2], [np.nanmean(result.values[:2]), np.mean(result.values[2:])])
+    assert np.isnan(means[2])
+
+
+def test_region_weights_touching_cells():
+    # the regions share edges with the cells next to them, which must not get a weight
+    result = make_result()
+    weights = compute_region_weights(REGIONS, result.projection_x_coordinate.values,
+                                     result.projection_y_coordinate.values)
+    assert (weights.data > 0).all()
+    assert weights[0].nnz == 6
+
+    values = result.transpose('projection_x_coordinate', 'projection_y_coordinate').values.copy()
+    values[3, :] = np.inf
+    means = region_means(weights, values)
+    np.testing.assert_allclose(means[0], np.nanmean(values[:2]))
+    assert means[1] == np.inf
+
+
+def test_aggregate_regions(app):
+    result = make_result()
+    aggregated = aggregate_regions('health_boards', result)
+
+    assert [region['properties']['name'] for region in aggregated] == ['Region 0', 'Region 1', 'Region 2']
+    assert aggregated[1]['data'] == pytest.approx(np.mean(result.values[:, 2:]))
+    assert aggregated[2]['data'] is None
+    assert os.path.exists(region_weights_path('health_boards', result.projection_x_coordinate.values,
+                                              result.projection_y_coordinate.values))
+
+
+def test_region_weights_concurrent(app):
+    # two workers building the weights of a cold cache at once both write them, neither fails
+    result = make_result()
+    x, y = tuple(result.projection_x_coordinate.values), tuple(result.projection_y_coordinate.values)
+    barrier = threading.Barrier(2, timeout=10)
+    save_npz = scipy.sparse.save_npz
+    def save_together(file, matrix):
+        barrier.wait()
+        save_npz(file, matrix)
+        barrier.wait()
+
+    weights = []
+    def build():
+        with app.app_context():
+            weights.append(regions._region_weights.__wrapped__('health_boards', x, y))
+    with mock.patch.object(regions.scipy.sparse, 'save_npz', side_effect=save_together):
+        threads = [threading.Thread(target=build) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+    assert len(weights) == 2
+    path = region_weights_path('health_boards', x, y)
+    assert (scipy.sparse.load_npz(path) != weights[0]).nnz == 0
+    assert os.listdir(os.path.dirname(path)) == [os.path.basename(path)]
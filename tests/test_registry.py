@@ -0,0 +1,86 @@
+import threading
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from scotclimpact.registry import Model_Registry, array_nbytes
+
+
+class Model():
+    def __init__(self, n):
+        self.values = np.zeros(n)
+        self.view = self.values[::2]
+        self.mask = xr.DataArray(np.ones(10)).expand_dims(variate=n)
+
+
+def test_array_nbytes(tmp_path):
+    model = Model(100)
+    assert array_nbytes(model) == 100 * 8 + 10 * 8
+
+    np.save(tmp_path / 'values.npy', model.values)
+    model.values = np.load(tmp_path / 'values.npy', mmap_mode='r')
+    model.view = model.values[::2]
+    assert array_nbytes(model) == 10 * 8
+
+
+def test_registry_eviction():
+    registry = Model_Registry()
+    built = []
+    build = lambda n: lambda: built.append(n) or Model(n)
+    maxBytes = 2 * array_nbytes(Model(100))
+
+    first = registry.get('a', build(100), maxBytes)
+    assert registry.get('a', build(100), maxBytes) is first
+    registry.get('b', build(100), maxBytes)
+    registry.get('a', build(100), maxBytes)
+    registry.get('c', build(100), maxBytes) # evicts b, the least recently used model
+
+    stats = registry.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (2, 3, 1)
+    assert list(stats['models']) == ['a', 'c']
+    assert stats['nbytes'] <= maxBytes
+    assert built == [100, 100, 100]
+
+
+def test_registry_builds_outside_lock():
+    registry = Model_Registry()
+    registry.get('b', lambda: Model(10))
+    started, release = threading.Event(), threading.Event()
+    built = []
+    def slow_build():
+        built.append('a')
+        started.set()
+        assert release.wait(10)
+        return Model(100)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get('a', slow_build))) for _ in range(2)]
+    threads[0].start()
+    assert started.wait(10)
+    threads[1].start()
+
+    # a hit on another model is not blocked by the build
+    hit = []
+    other = threading.Thread(target=lambda: hit.append(registry.get('b', lambda: Model(10))))
+    other.start()
+    other.join(5)
+    assert not other.is_alive() and len(hit) == 1
+    assert 'a' not in registry
+
+    release.set()
+    for thread in threads:
+        thread.join(10)
+    assert built == ['a']
+    assert len(results) == 2 and results[0] is results[1]
+    stats = registry.stats()
+    assert (stats['hits'], stats['misses'], stats['waits']) == (1, 2, 1)
+
+
+def test_registry_failed_build():
+    registry = Model_Registry()
+    def fail():
+        raise ValueError('no data')
+    with pytest.raises(ValueError):
+        registry.get('a', fail)
+    assert registry.get('a', lambda: Model(10)).values.size == 10
@@ -1,3 +1,8 @@
+import gzip
+import json
+import re
+
+import numpy as np
 import pytest
 
 import xarray as xr
@@ -66,6 +71,115 @@ def test_data_extreme_temp_frequency_change(client):
 #
 #    assert response.status_code == 400
 
+def test_boundaries(client):
+    '''Boundary layers are gzip compressed, vary by encoding and are not sent again to a client that has them'''
+    response = client.get("/boundaries/health_boards", headers={'Accept-Encoding': 'gzip, br'})
+
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.headers['ETag']
+    assert json.loads(gzip.decompress(response.data))['type'] == 'FeatureCollection'
+
+    cached = client.get("/boundaries/health_boards",
+                        headers={'Accept-Encoding': 'gzip, br', 'If-None-Match': response.headers['ETag']})
+    assert cached.status_code == 304
+    assert cached.data == b''
+    # the ETag differs per content encoding
+    assert client.get("/boundaries/health_boards",
+                      headers={'If-None-Match': response.headers['ETag']}).status_code == 200
+
+
+def test_boundaries_detail(client):
+    '''Boundary layers have levels of detail'''
+    full = client.get("/boundaries/health_boards")
+    low = client.get("/boundaries/health_boards", query_string=dict(detail='low'))
+
+    assert low.status_code == 200
+    assert len(low.data) < len(full.data)
+    assert low.headers['ETag'] != full.headers['ETag']
+    assert client.get("/boundaries/health_boards", query_string=dict(detail='highest')).status_code == 400
+    assert client.get("/boundaries/no_such_layer").status_code == 400
+
+
+def test_grid(client):
+    '''The cells of a grid, named by the X-Grid header, are cached by the client'''
+    response = client.get("/data/grid/12")
+
+    assert response.status_code == 200
+    grid = response.get_json()
+    assert grid['grid'] == response.headers['X-Grid']
+    assert len(grid['features']) > 0
+    assert set(grid['features'][0]['properties']) == {'x', 'y'}
+    assert 'max-age' in response.headers['Cache-Control']
+
+    assert client.get("/data/grid/7").status_code == 404
+    assert client.get("/data/grid/abc").status_code == 404
+
+
+def test_data_extreme_temp_values(client):
+    '''The values format has the central estimate of each cell of the grid, in its order'''
+    query_string = dict(covariate=2, return_time=100)
+    grid_response = client.get("/data/grid/12")
+    grid = grid_response.get_json()
+    response = client.get("/data/map/extreme_temp_intensity/values", query_string=query_string)
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/octet-stream'
+    assert response.headers['X-Grid'] == grid_response.headers['X-Grid']
+    values = np.frombuffer(response.data, dtype='<f4')
+    assert len(values) == len(grid['features'])
+
+    # the same values as the GeoJSON of the hazard, at the cells with the same indices
+    cells = {(feature['properties']['x'], feature['properties']['y']): i for i, feature in enumerate(grid['features'])}
+    geojson = client.get("/data/map/extreme_temp_intensity", query_string=query_string).get_json()
+    for feature in geojson['features']:
+        x, y = map(int, re.search(r'/(\d+)/(\d+)\?', feature['properties']['ci_report_url']).groups())
+        assert values[cells[x, y]] == pytest.approx(feature['properties']['data'], rel=1e-6)
+    assert np.isfinite(values).sum() == len(geojson['features'])
+
+
+def test_data_extreme_temp_values_json(client):
+    '''With output=json, the values format is JSON with null for cells without a value'''
+    query_string = dict(covariate=2, return_time=100)
+    binary = client.get("/data/map/extreme_temp_intensity/values", query_string=query_string)
+    response = client.get("/data/map/extreme_temp_intensity/values", query_string=dict(query_string, output='json'))
+
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result['grid_size'] == 12
+    assert result['grid'] == response.headers['X-Grid'] == binary.headers['X-Grid']
+    values = np.array([np.nan if value is None else value for value in result['values']], dtype=np.float32)
+    np.testing.assert_array_equal(values, np.frombuffer(binary.data, dtype='<f4'))
+
+    assert client.get("/data/map/extreme_temp_intensity/values",
+                      query_string=dict(query_string, output='xml')).status_code == 400
+
+
+def test_region_data(client):
+    '''The central estimate of a hazard averaged over the regions of a boundary layer'''
+    query_string = dict(covariate=2, return_time=100)
+    response = client.get("/data/region/extreme_temp_intensity/health_boards", query_string=query_string)
+
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result['name'] == 'extreme_temp_intensity' and result['layer'] == 'health_boards'
+    layer = client.get("/boundaries/health_boards").get_json()
+    assert [region['properties'] for region in result['regions']] == \
+        [feature['properties'] for feature in layer['features']]
+    values = [region['data'] for region in result['regions'] if region['data'] is not None]
+    assert len(values) > 0
+
+    geojson = client.get("/data/map/extreme_temp_intensity", query_string=query_string).get_json()
+    data = [feature['properties']['data'] for feature in geojson['features']]
+    assert min(data) <= min(values) and max(values) <= max(data)
+
+    assert client.get("/data/region/extreme_temp_intensity/no_such_layer",
+                      query_string=query_string).status_code == 404
+    assert client.get("/data/region/extreme_temp_intensity/health_boards",
+                      query_string=dict(covariate=2, return_time=7)).status_code == 400
+
+
 @pytest.fixture()
 def test_nc_data(pooch_fetcher):
     filename = pooch_fetcher('model_fits/obs/GEV_covaraite_fit_HadUK_tasmax_linear_loc_log_scale_nFits_1000_parametric_False.nc')
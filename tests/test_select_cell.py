@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from fixtures import model
+
+CALCULATIONS = [
+    ('intensity_from_return_time', dict(return_time=50, T0=1.0)),
+    ('return_time_from_intensity', dict(intensity=26.0, T0=1.0)),
+    ('change_in_intensity', dict(return_time=50, T0=0.5, T1=2.0)),
+    ('times_more_likely', dict(intensity=26.0, T0=0.5, T1=2.0)),
+]
+CELLS = [(0, 0), (3, 2), (5, 4)]
+
+
+@pytest.mark.parametrize('calculation, kwargs', CALCULATIONS)
+def test_variates_dist_cell(model, calculation, kwargs):
+    grid = model.get_variates_dist(calculation, **kwargs)
+    for xIndex, yIndex in CELLS:
+        cell = model.get_variates_dist(calculation, xIndex=xIndex, yIndex=yIndex, **kwargs)
+        expected = grid.isel(projection_x_coordinate=xIndex, projection_y_coordinate=yIndex)
+        for name in expected.data_vars:
+            np.testing.assert_array_equal(cell[name].values, expected[name].values)
+
+
+@pytest.mark.parametrize('calculation, kwargs, var', [(*CALCULATIONS[0], 'intensity'),
+                                                    (*CALCULATIONS[2], 'intensity_change')])
+def test_ci_report_cell(model, calculation, kwargs, var):
+    # without a cell the report is the dataset of the whole grid
+    grid = model.get_CI_report(calculation, report='central_CI', **kwargs)
+    for xIndex, yIndex in CELLS:
+        report = model.get_CI_report(calculation, report='central_CI', xIndex=xIndex, yIndex=yIndex, **kwargs)
+        expected = grid.isel(projection_x_coordinate=xIndex, projection_y_coordinate=yIndex)
+        low, high = expected[var + '_quantiles'].values
+        assert report == '%0.1f (%0.1f — %0.1f) %s' % (expected[var], low, high,
+                                                       expected.attrs['units'].replace('_', ' '))
+
+
+def test_covariate_fit_select_cell(model):
+    covariateFit = model.evaluate_temperature_anomaly(1.0)
+    for xIndex, yIndex in CELLS:
+        point = model.select_cell(xIndex, yIndex)
+        cell = covariateFit.select_cell(point, xIndex, yIndex)
+        assert cell.model is point
+        for params, expected in [(cell.fitGEV, covariateFit.fitGEV), (cell.bsfitGEV, covariateFit.bsfitGEV)]:
+            for p, e in zip(params, expected):
+                np.testing.assert_array_equal(p, e[xIndex:xIndex+1, yIndex:yIndex+1])
+        # evaluated at the cell, the parameters are the same
+        evaluated = point.evaluate_temperature_anomaly(1.0)
+        for p, e in zip(evaluated.fitGEV + evaluated.bsfitGEV, cell.fitGEV + cell.bsfitGEV):
+            np.testing.assert_array_equal(p, e)
@@ -0,0 +1,68 @@
+import pickle
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from scotclimpact.developing_process import Fitted_Obs_Sim, change_in_intensity, intensity_from_return_time
+from fixtures import SIM_PARAMS, make_inputs
+
+
+def with_data(ds, rng, dims):
+    '''a fit with tasmax and covariate data along the variate dimensions, as the model_fits files'''
+    shape = [ds[dim].size for dim in ['projection_x_coordinate', 'projection_y_coordinate']]
+    coords = {dim: np.arange(size) for dim, size in dims.items()}
+    covariate = xr.DataArray(rng.normal(0, 0.5, list(dims.values())), coords=coords, dims=list(dims))
+    tasmax = xr.DataArray(rng.gumbel(25, 1.5, shape + list(dims.values())),
+                          dims=['projection_x_coordinate', 'projection_y_coordinate'] + list(dims))
+    return ds.assign(tasmax=tasmax, covariate=covariate)
+
+
+@pytest.fixture()
+def input_files(tmp_path):
+    rng = np.random.default_rng(0)
+    dsObs, dsSim, grid = make_inputs()
+    paths = [str(tmp_path / 'obs.nc'), str(tmp_path / 'sim.nc')]
+    with_data(dsObs, rng, dict(year=20)).to_netcdf(paths[0])
+    with_data(dsSim, rng, dict(year=20, ensemble_member=3)).to_netcdf(paths[1])
+    files = [xr.open_dataset(path) for path in paths]
+    yield files, grid
+    for ds in files:
+        ds.close()
+
+
+def make_model(files, grid, slim):
+    return Fitted_Obs_Sim(*files, grid, simParams=SIM_PARAMS, nVariates=100, seed=1, slim=slim)
+
+
+def test_slim_hazards(input_files):
+    slim, full = make_model(*input_files, slim=True), make_model(*input_files, slim=False)
+    assert slim.dsObs is None and full.dsObs is not None
+    # a full model keeps the input data in its ds as well
+    xr.testing.assert_identical(slim.ds, full.ds.drop_vars(['tasmax', 'covariate', 'year']))
+
+    for hazard, args in [(intensity_from_return_time, (1.0, 50)), (change_in_intensity, (50, 0.5, 2.0))]:
+        xr.testing.assert_identical(hazard(slim, *args, format='netcdf', mode='quantiles'),
+                                    hazard(full, *args, format='netcdf', mode='quantiles'))
+    assert slim.get_CI_report('intensity_from_return_time', return_time=50, T0=1.0, xIndex=1, yIndex=2) \
+        == full.get_CI_report('intensity_from_return_time', return_time=50, T0=1.0, xIndex=1, yIndex=2)
+
+
+def test_slim_load_inputs(input_files):
+    files, grid = input_files
+    slim, full = make_model(files, grid, slim=True), make_model(files, grid, slim=False)
+    # the input files are reopened after they have been closed (as by build_composite_fit)
+    for ds in files:
+        ds.close()
+    for loaded, expected in zip(slim.load_inputs(), full.load_inputs()):
+        xr.testing.assert_identical(loaded, expected)
+    xr.testing.assert_identical(slim.renormalise(), full.renormalise())
+
+
+def test_slim_pickle(input_files):
+    slim = make_model(*input_files, slim=True)
+    loaded = pickle.loads(pickle.dumps(slim, protocol=5))
+    assert loaded.inputs is None
+    assert slim.inputs is not None
+    with pytest.raises(ValueError):
+        loaded.load_inputs()
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from scotclimpact.developing_process import Fitted_Obs_Sim, change_in_frequency, intensity_from_return_time
+from scotclimpact.tiling import compute_tiled, tile_size, tile_slices
+from fixtures import make_inputs
+
+QUANTILES = [0.05, 0.5, 0.95]
+
+
+def test_tile_slices_cover_grid():
+    covered = np.zeros((23, 17), dtype=int)
+    for xs, ys in tile_slices(covered.shape, 5):
+        assert covered[xs, ys].shape[0] <= 5 and covered[xs, ys].shape[1] <= 5
+        covered[xs, ys] += 1
+    assert (covered == 1).all()
+
+
+def test_tile_size():
+    assert tile_size(cellBytes=100, maxBytes=100 * 64) == 8
+    assert tile_size(cellBytes=1000, maxBytes=10) == 1
+
+
+@pytest.fixture(scope='module')
+def inputs():
+    dsObs, dsSim, grid = make_inputs(11, 7)
+    grid.mask[:2, :3] = np.nan
+    return dsObs, dsSim, grid
+
+
+@pytest.mark.parametrize('function, args', [(intensity_from_return_time, (2.0, 50)),
+                                            (change_in_frequency, (26.0, 1.0, 2.0))])
+def test_compute_tiled_matches_grid(inputs, tmp_path, function, args):
+    model = Fitted_Obs_Sim(*inputs, simParams=['c', 'loc1', 'scale0', 'scale1'], nVariates=100, seed=0, slim=True)
+    expected = function(model, *args, format='netcdf', mode='quantiles', quantiles=QUANTILES)
+
+    path = str(tmp_path / 'tiled.nc')
+    nTiles = compute_tiled(*inputs, function, args, path, maxBytes=9 * 100 * 8 * 20, nVariates=100,
+                           quantiles=QUANTILES, seed=0, bsVariates=model.bsVariates.values)
+    assert nTiles > 1
+
+    result = xr.load_dataset(path)
+    assert list(result.data_vars) == list(expected.data_vars)
+    for name, da in expected.data_vars.items():
+        assert result[name].dims == da.dims
+        np.testing.assert_array_equal(result[name].values, da.values)
+
+
+def test_compute_tiled_output(inputs, tmp_path):
+    dsObs, dsSim, grid = inputs
+    path = str(tmp_path / 'tiled.nc')
+    compute_tiled(dsObs, dsSim, grid, intensity_from_return_time, (2.0, 50), path, maxBytes=9 * 100 * 8 * 20,
+                  nVariates=100, quantiles=QUANTILES, seed=0, metadata=dict(covariate=2.0, return_time=50))
+
+    result = xr.load_dataset(path)
+    np.testing.assert_array_equal(result.projection_x_coordinate, grid.projection_x_coordinate)
+    np.testing.assert_array_equal(result.projection_y_coordinate, grid.projection_y_coordinate)
+    np.testing.assert_array_equal(result['quantile'], QUANTILES)
+    assert result.attrs['covariate'] == 2.0 and result.attrs['return_time'] == 50
+    assert result.intensity.attrs['units'] == '\u00b0C'
+    # cells outside the mask are NaN, the others are written by their tile
+    intensity = result.intensity.transpose('projection_x_coordinate', 'projection_y_coordinate', ...).values
+    mask = np.isfinite(grid.mask.values)
+    assert np.isnan(intensity[~mask]).all()
+    assert np.isfinite(intensity[mask]).all()
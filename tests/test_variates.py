@@ -0,0 +1,113 @@
+import warnings
+
+import numpy as np
+
+from scotclimpact.variates import bootstrap_variates, covariance_factors, sample_multivariate_normal, sobol_normal_variates, standard_normal_variates, variates_path
+
+
+def make_covariances(shape, p=3, seed=0):
+    rng = np.random.default_rng(seed)
+    A = rng.normal(0, 1, shape + (p, p))
+    return A @ np.swapaxes(A, -1, -2), rng.normal(0, 1, shape + (p,))
+
+
+def test_covariance_factors():
+    cov, _ = make_covariances((4, 5))
+    cov[0, 0] = np.nan
+    cov[1, 1] = np.diag([1.0, 1.0, 0.0]) # positive semi-definite
+
+    factors = covariance_factors(cov)
+
+    assert np.isnan(factors[0, 0]).all()
+    reconstructed = factors @ np.swapaxes(factors, -1, -2)
+    np.testing.assert_allclose(reconstructed[1:], cov[1:], atol=1e-12)
+
+
+def test_sample_multivariate_normal():
+    cov, mean = make_covariances((2, 3))
+    mean[0, 1, 0] = np.nan
+
+    samples = sample_multivariate_normal(mean, cov, 20000, seed=1)
+
+    assert samples.shape == (2, 3, 20000, 3)
+    assert np.isnan(samples[0, 1]).all()
+    assert np.isfinite(samples[1, 2]).all()
+    np.testing.assert_allclose(samples[1, 2].mean(axis=0), mean[1, 2], atol=0.1)
+    np.testing.assert_allclose(np.cov(samples[1, 2].T), cov[1, 2], atol=0.1 * np.abs(cov[1, 2]).max())
+
+
+def test_sample_multivariate_normal_is_reproducible():
+    cov, mean = make_covariances((2, 2))
+    np.testing.assert_array_equal(
+        sample_multivariate_normal(mean, cov, 10, seed=3),
+        sample_multivariate_normal(mean, cov, 10, seed=3),
+    )
+
+
+def test_sample_multivariate_normal_float32():
+    cov, mean = make_covariances((2, 2))
+    samples = sample_multivariate_normal(mean, cov, 10, seed=3, dtype=np.float32)
+    assert samples.dtype == np.float32
+    np.testing.assert_allclose(samples, sample_multivariate_normal(mean, cov, 10, seed=3), rtol=1e-5, atol=1e-5)
+
+
+def test_variates_path():
+    assert variates_path('data', 'extreme_temp', 'c,loc1', 10, 3).endswith('extreme_temp_c-loc1_n10_seed3.npy')
+    assert variates_path('data', 'extreme_temp', 'c,loc1', 10, 3, 'float32').endswith('_seed3_float32.npy')
+    assert variates_path('data', 'extreme_temp', 'c,loc1', 10, 3, sampler='sobol').endswith('_seed3_sobol_v2.npy')
+
+
+def test_standard_normal_variates():
+    variates = standard_normal_variates(100, seed=3)
+    assert variates is standard_normal_variates(100, seed=3)
+    assert not variates.flags.writeable
+    assert not np.array_equal(variates, standard_normal_variates(100, seed=4))
+    np.testing.assert_array_equal(variates, np.random.default_rng([3, 1]).standard_normal(100))
+
+
+def test_sample_multivariate_normal_sobol():
+    cov, mean = make_covariances((2, 3))
+    samples = sample_multivariate_normal(mean, cov, 4096, seed=1, sampler='sobol')
+
+    assert samples.shape == (2, 3, 4096, 3)
+    # Sobol points estimate the moments much more precisely than 4096 random variates
+    np.testing.assert_allclose(samples[1, 2].mean(axis=0), mean[1, 2], atol=0.01)
+    np.testing.assert_allclose(np.cov(samples[1, 2].T), cov[1, 2], atol=0.01 * np.abs(cov[1, 2]).max())
+
+
+def test_sobol_temperature_variates():
+    variates = sobol_normal_variates(256, 4, seed=3)
+    assert not variates.flags.writeable
+    np.testing.assert_array_equal(standard_normal_variates(256, seed=3, sampler='sobol', column=3), variates[:, 3])
+
+
+def test_sobol_variates_prefix():
+    # numbers of variates that are not powers of two (as the batches of adaptive_quantiles) are prefixes
+    # of the variates of the next power of two, without the warning of scipy about unbalanced points
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        variates = [standard_normal_variates(n, seed=3, sampler='sobol', column=3) for n in [100, 200, 400]]
+    for v in variates:
+        np.testing.assert_array_equal(v, sobol_normal_variates(512, 4, seed=3)[:len(v), 3])
+
+
+def test_sample_multivariate_normal_sobol_cells():
+    # every cell shifts the Sobol points differently, so the sampling errors of its quantiles
+    # are independent of those of the other cells
+    mean = np.zeros((200, 2))
+    cov = np.broadcast_to(np.eye(2), (200, 2, 2))
+    samples = sample_multivariate_normal(mean, cov, 1024, seed=1, sampler='sobol')
+    errors = np.quantile(samples[..., 0], 0.975, axis=1) - 1.959964
+    assert len(np.unique(errors)) == len(errors)
+    assert abs(np.corrcoef(errors[::2], errors[1::2])[0, 1]) < 0.3
+    # and each cell keeps the balance of the Sobol points
+    np.testing.assert_allclose(samples.mean(axis=1), 0, atol=0.01)
+    np.testing.assert_allclose(samples.var(axis=1), 1, atol=0.02)
+    np.testing.assert_array_equal(samples, sample_multivariate_normal(mean, cov, 1024, seed=1, sampler='sobol'))
+
+
+def test_bootstrap_variates():
+    config = dict(BOOTSTRAP_VARIATES=1000, BOOTSTRAP_SAMPLER='random')
+    assert bootstrap_variates(config) == 1000
+    assert bootstrap_variates(dict(config, BOOTSTRAP_SAMPLER='sobol')) == 1024
+    assert bootstrap_variates(dict(config, BOOTSTRAP_VARIATES=512, BOOTSTRAP_SAMPLER='sobol')) == 512
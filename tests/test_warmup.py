@@ -0,0 +1,52 @@
+import gc
+from unittest import mock
+
+import numpy as np
+import pytest
+import xarray as xr
+from flask import Flask
+
+from scotclimpact import developing_process, warmup
+from scotclimpact.config import Config
+from scotclimpact.registry import registry
+
+
+class Model():
+    def __init__(self):
+        self.values = np.zeros(10)
+        self.view = self.values[::2]
+        self.ds = xr.Dataset(dict(fit=(['x'], np.ones(3))))
+
+
+@pytest.fixture()
+def app():
+    app = Flask('test')
+    app.config.from_object(Config)
+    registry.clear()
+    yield app
+    registry.clear()
+    gc.unfreeze()
+
+
+def test_freeze_arrays():
+    model = Model()
+    warmup.freeze_arrays(model)
+    for array in (model.values, model.view, model.ds.fit.values):
+        assert not array.flags.writeable
+    with pytest.raises(ValueError):
+        model.values[0] = 1
+
+
+def test_warm_models(app):
+    with app.app_context():
+        assert not any(warmup.model_status().values())
+
+    with mock.patch.object(developing_process, 'build_composite_fit', side_effect=lambda *args, **kwargs: Model()) as build:
+        warmup.warm_models(app)
+    assert build.call_count == len(warmup.datasets)
+    assert gc.get_freeze_count() > 0
+
+    with app.app_context():
+        assert all(warmup.model_status().values())
+        model = developing_process.init_composite_fit(next(iter(warmup.datasets)), **warmup.serving_fit())
+    assert not model.values.flags.writeable